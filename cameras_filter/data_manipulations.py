@@ -1,15 +1,19 @@
 from typing import Union, Tuple, Sequence, Optional
 from pathlib import Path
-import re
 import os
 
 from utils.read_write_model import (
-    read_images_binary,
-    read_images_text,
-    write_images_binary,
-    write_images_text,
+    write_images_binary_subset,
+    camera_dict_to_arrays,
+    point_dict_to_arrays,
+    detect_model_format,
 )
+from utils.columnar_model import ColumnarModel
+from utils.pruning import extract_model, write_images_arrays
+from utils.merge import merge_models
+from utils.model_cache import read_images_cached
 from poses_object import Poses
+from image_registry import ImageRegistry
 from reconstruction_poses import Reconstruction
 from passage_poses import Passage
 
@@ -47,6 +51,13 @@ def select_images(
             file will get the default name
             'images_subset.*' with the extension of
             the source images file.
+
+    Returns the list of the ids of the selected
+    images (not the {id: Image} dict, the images
+    aren't decoded) and the path to the output
+    file. Binary files are processed without
+    decoding: the records of the selected images
+    are copied as they are.
     """
 
     path_to_images = Path(reconst_images_path)
@@ -56,55 +67,153 @@ def select_images(
         else Path(path_to_images.parent) / f"images_subset{Path(path_to_images).suffix}"
     )
 
-    read_method = (
-        read_images_text
-        if str(reconst_images_path).endswith(".txt")
-        else read_images_binary
-    )
-
-    images = read_method(path_to_images)
-
     mark = "delet" if delete else "extract"
     print(f"{mark.capitalize()}ing given subset from reconstruction...")
-    subset_images = extract_delete_images(images, image_subset, delete)
 
-    if path_to_images == path_to_output:
-        os.remove(path_to_images)
+    in_place = path_to_images == path_to_output
+    if in_place:
         path_to_output = Path(
             str(path_to_output)[:-4] + f"_{mark}ed" + str(path_to_output)[-4:]
         )
 
-    write_method = (
-        write_images_text
-        if str(path_to_output).endswith(".txt")
-        else write_images_binary
-    )
-    write_method(subset_images, path_to_output)
+    if not (
+        str(path_to_images).endswith(".txt") or str(path_to_output).endswith(".txt")
+    ):
+        subset_ids, num_images = write_images_binary_subset(
+            path_to_images,
+            path_to_images if in_place else path_to_output,
+            lambda ids, names: subset_mask(names, image_subset, delete),
+        )
+        subset_ids = subset_ids.tolist()
+        if in_place:
+            os.replace(path_to_images, path_to_output)
+    else:
+        # The same file is selected in every test (see 'utils.estimation.main')
+        images = read_images_cached(path_to_images)
+        # Only the images file is selected, the model has no cameras and points
+        model = ColumnarModel(
+            camera_dict_to_arrays({}), images, point_dict_to_arrays({})
+        )
+        subset = model.select_images(
+            subset_mask(model.images.names, image_subset, delete)
+        )
+        subset_ids, num_images = subset.images.ids.tolist(), model.num_images
+
+        if in_place:
+            os.remove(path_to_images)
+
+        write_images_arrays(subset.images, path_to_output)
 
     print(
-        f"{len(subset_images)} images out of {len(images)} were {mark}ed ({round(len(subset_images)/len(images)*100, 1)}%).\n"
+        f"{len(subset_ids)} images out of {num_images} were {mark}ed ({round(len(subset_ids)/num_images*100, 1)}%).\n"
     )
 
-    return subset_images, path_to_output
+    return subset_ids, path_to_output
+
+
+def subset_mask(names: Sequence[str], image_subset: Sequence, delete: bool = False):
+    """Boolean mask of the images to keep."""
+
+    mask = ImageRegistry(names, pattern=Poses.pattern).mask(image_subset)
+    return ~mask if delete else mask
 
 
 def extract_delete_images(images: dict, image_subset: Sequence, delete: bool = False):
     """Delete or extract necessary data."""
 
-    pattern = Poses.pattern  # Extract image id from filename
+    registry = ImageRegistry.from_images(images, Poses.pattern)
+    mask = registry.mask(image_subset)
     if delete:
-        subset_images = {
-            key: image
-            for key, image in images.items()
-            if not re.search(pattern, image[4])[1] in image_subset
-        }
-    else:
-        subset_images = {
-            key: image
-            for key, image in images.items()
-            if re.search(pattern, image[4])[1] in image_subset
-        }
-    return subset_images
+        mask = ~mask
+    return {key: images[key] for key in registry.image_ids[mask].tolist()}
+
+
+def extract_submodel(
+    sparse_dir: PathLikeObject,
+    image_subset: Sequence,
+    output_dir: PathLikeObject,
+    min_observations: int = 2,
+    ext: str = "",
+) -> ColumnarModel:
+    """Write the self-contained model of the image subset.
+
+    Unlike 'select_images', which only writes the images file,
+    the output is a complete model: the referenced cameras, the
+    images of the subset and the points observed by at least
+    min_observations distinct images of them, with the dense ids
+    (see 'utils.pruning.extract_model').
+
+    Parameters
+    --------------
+        sparse_dir : PathLikeObject
+            The sparse reconstruction directory.
+        image_subset : Sequence
+            The images to extract.
+        output_dir : PathLikeObject
+            The directory of the extracted model.
+        min_observations : int = 2
+            The minimal number of distinct images observing a kept point.
+        ext : str = ""
+            '.bin' or '.txt'. If it's empty, the format of the
+            source model is used.
+
+    Return the extracted model.
+    """
+
+    if ext == "":
+        ext = ".bin" if detect_model_format(sparse_dir, ".bin") else ".txt"
+
+    model = ColumnarModel.read(sparse_dir)
+    submodel = extract_model(
+        model, subset_mask(model.images.names, image_subset), min_observations
+    )
+    submodel.write(output_dir, ext)
+
+    print(
+        f"{submodel.num_images} images, {submodel.num_cameras} cameras",
+        f"and {submodel.num_points3D} points were extracted to {output_dir}.",
+    )
+
+    return submodel
+
+
+def merge_submodels(
+    sparse_dirs: Sequence[PathLikeObject],
+    output_dir: PathLikeObject,
+    ext: str = "",
+) -> ColumnarModel:
+    """Merge the models of the directories into one model.
+
+    The ids are offset, the identical cameras and the images
+    with the same name are merged (see 'utils.merge.merge_models').
+
+    Parameters
+    --------------
+        sparse_dirs : Sequence[PathLikeObject]
+            The sparse model directories, e.g. the outputs of
+            'extract_submodel'. The images of the first models
+            take precedence.
+        output_dir : PathLikeObject
+            The directory of the merged model.
+        ext : str = ""
+            '.bin' or '.txt'. If it's empty, the format of the
+            first model is used.
+
+    Return the merged model.
+    """
+
+    if ext == "":
+        ext = ".bin" if detect_model_format(sparse_dirs[0], ".bin") else ".txt"
+
+    model = merge_models(ColumnarModel.read(sparse_dir) for sparse_dir in sparse_dirs)
+    model.write(output_dir, ext)
+
+    print(
+        f"{len(sparse_dirs)} models were merged into {model.num_images} images,",
+        f"{model.num_cameras} cameras and {model.num_points3D} points.",
+    )
+
+    return model
 
 
 def main(
@@ -157,7 +266,7 @@ def main(
 
     select_images(
         reconst_images_path=reconst_images_path,
-        image_subset=passage.images,
+        image_subset=passage.index,
         delete=False,
         output_file=output_file,
     )
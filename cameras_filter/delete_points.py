@@ -1,50 +1,39 @@
 from pathlib import Path
-from typing import Union
-import os
+from typing import Optional, Union
 import argparse
 
-from utils.read_write_model import (
-    read_images_binary,
-    read_points3D_binary,
-    write_points3D_binary,
-)
+from utils.pruning import prune_points
 
 
 PathLikeObject = Union[str, Path]
 
 
-def delete_points(path_to_images: PathLikeObject, path_to_points: PathLikeObject):
+def delete_points(
+    path_to_images: PathLikeObject,
+    path_to_points: PathLikeObject,
+    path_to_output: Optional[PathLikeObject] = None,
+):
     """Delete the dots that are associated with the deleted image.
 
-    TODO: read/write points3D.txt and images.txt files.
+    The tracks are checked for all points at once,
+    see 'utils.pruning.prune_points'.
 
     Parameters
         --------------
         path_to_images : PathLikeObject
             Path to the filtered file with image
-            information of '.bin' extension.
-        path_to_points: Optional[PathLikeObject]
-            The regular points3D.bin file from
-            COLMAP sparse reconstruction.
+            information of '.bin' or '.txt' extension.
+        path_to_points: PathLikeObject
+            The regular points3D file from COLMAP
+            sparse reconstruction ('.bin' or '.txt').
+        path_to_output : Optional[PathLikeObject] = None
+            Path to the output points3D file. If it's None,
+            the points3D file is replaced.
     """
-    points = read_points3D_binary(path_to_points)
-    images = read_images_binary(path_to_images)
-    new_points = {}
+    points, new_points = prune_points(path_to_images, path_to_points, path_to_output)
 
-    image_ids = images.keys()
-    count = 0
-
-    for key, value in points.items():
-        if any([id not in image_ids for id in value[4]]):
-            count += 1
-            continue
-        new_points[key] = value
-
-    print(f"{round(count/len(points)*100, 2)}% points were removed.")
-
-    os.remove(path_to_points)
-
-    write_points3D_binary(new_points, path_to_points)
+    count = len(points.ids) - len(new_points.ids)
+    print(f"{round(count/len(points.ids)*100, 2)}% points were removed.")
 
 
 if __name__ == "__main__":
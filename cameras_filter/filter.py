@@ -1,14 +1,16 @@
 from pathlib import Path
-from typing import Union, Tuple, Optional
+from typing import Union, Tuple, Optional, Sequence
 import json
-import copy
 
 from reconstruction_poses import Reconstruction
 from passage_poses import Passage
+from spatial_index import append_rows
 
 import numpy as np
 from scipy.stats import norm
 
+PathLikeObject = Union[str, Path]
+
 
 class CameraFilter:
     """Cameras filtering algorithm.
@@ -36,67 +38,154 @@ class CameraFilter:
         else:
             self.with_passage = False
         self.reconst = reconstruction
+        self._passage_to_reconst = self._passage_reverse = None
 
-    def calculate_true_distances(self):
+    def calculate_true_distances(self, rows: Optional[np.ndarray] = None):
         """Get the distances to the true
         neighbours from the passage information
         from the Augmented City API.
+
+        The true neighbours of every image are the first k unique
+        images of its passage neighbours followed by its COLMAP
+        neighbours, which exist in the COLMAP representation.
+        If rows are given, only their true neighbours are updated.
         """
 
+        reconst = self.reconst
+        self._true_distances = None
+
         if not self.with_passage:
             # Use the calculated COLMAP distances as the accurate distances.
-            self.true_distances = copy.deepcopy(self.reconst.distances)
+            self.true_neighbour_rows = reconst.neighbour_rows
+            self.true_neighbour_distances = reconst.neighbour_distances
             return
 
-        self.true_distances = {}
+        all_rows = rows is None
+        rows = np.arange(reconst.num_of_objects) if all_rows else rows
+
+        k = reconst.neighbour_rows.shape[1]
+        candidates = np.hstack(
+            [self.passage_neighbour_rows(rows), reconst.neighbour_rows[rows]]
+        )
+
+        # It is possible that there won't be such images in the COLMAP representation
+        # So extract the first k unique images, which exist in the COLMAP representation
+        valid = candidates >= 0
+        for column in range(1, candidates.shape[1]):
+            for previous in range(column):
+                valid[:, column] &= candidates[:, column] != candidates[:, previous]
+        first_valid = np.argsort(~valid, axis=1, kind="stable")[:, :k]
+
+        true_rows = np.take_along_axis(candidates, first_valid, axis=1)
+        true_distances = Reconstruction.row_distances(
+            reconst.positions[rows][:, None], reconst.positions[true_rows]
+        )
 
-        for image in self.reconst.camera_poses.keys():
+        if all_rows:
+            self.true_neighbour_rows = true_rows
+            self.true_neighbour_distances = true_distances
+            return
 
-            true_neighbour_1, true_neighbour_2 = self.passage.neighbours[image]
+        # New images are appended to the end of the reconstruction
+        missing = reconst.num_of_objects - len(self.true_neighbour_rows)
+        if missing > 0:
+            append_rows(
+                self, "true_neighbour_rows", np.zeros((missing, k), dtype=np.int64)
+            )
+            append_rows(self, "true_neighbour_distances", np.zeros((missing, k)))
+        self.true_neighbour_rows[rows] = true_rows
+        self.true_neighbour_distances[rows] = true_distances
+
+    def passage_neighbour_rows(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rows of the passage neighbours of every COLMAP image
+        (or of the given rows) in the COLMAP representation,
+        -1 for missing images.
+        """
 
-            point = self.reconst.camera_poses[image]
+        reconst, passage = self.reconst, self.passage
+        images = (
+            reconst.images if rows is None else [reconst.images[row] for row in rows]
+        )
 
-            reconst_neighbour_1 = self.reconst.neighbours[image][0]
-            reconst_neighbour_2 = self.reconst.neighbours[image][1]
+        if passage.neighbour_rows is None:
+            # Passages without geometric information keep the pairs of neighbours as ids
+            neighbours = [passage.neighbours[image] for image in images]
+            return np.array(
+                [[reconst.index.get(x, -1) for x in ids] for ids in neighbours],
+                dtype=np.int64,
+            ).reshape(-1, 2)
+
+        if self._passage_to_reconst is None:
+            self._passage_to_reconst = np.array(
+                [reconst.index.get(image, -1) for image in passage.images],
+                dtype=np.int64,
+            )
+        return self._passage_to_reconst[passage.neighbour_rows[passage.rows(images)]]
 
-            # It is possible that there won't be such images in the COLMAP representation
-            # So extract the first two unique filenames, which exist in the COLMAP representation
-            used = []
-            ids = [
-                true_neighbour_1,
-                true_neighbour_2,
-                reconst_neighbour_1,
-                reconst_neighbour_2,
-            ]
-            neighbour_1, neighbour_2 = [
-                x
-                for x in ids
-                if (x not in used)
-                and (x in self.reconst.images)
-                and (used.append(x) or True)
-            ][:2]
+    def passage_neighbours_of(self, images: Sequence[str]) -> np.ndarray:
+        """Rows of the COLMAP images, which have any
+        of the images among their passage neighbours.
 
-            point_1 = self.reconst.camera_poses[neighbour_1]
-            point_2 = self.reconst.camera_poses[neighbour_2]
+        The passage never changes, so the reverse lookup
+        is built once.
+        """
 
-            distance_1 = Reconstruction.distance(point, point_1)
-            distance_2 = Reconstruction.distance(point, point_2)
+        reconst, passage = self.reconst, self.passage
 
-            self.true_distances[image] = {
-                neighbour_1: distance_1,
-                neighbour_2: distance_2,
-            }
+        if self._passage_reverse is None:
+            if passage.neighbour_rows is None:
+                pairs = passage.neighbours.items()
+            else:
+                pairs = (
+                    (passage.images[row], [passage.images[x] for x in neighbours])
+                    for row, neighbours in enumerate(passage.neighbour_rows.tolist())
+                )
+            self._passage_reverse = {}
+            for image, neighbours in pairs:
+                for neighbour in set(neighbours):
+                    self._passage_reverse.setdefault(neighbour, []).append(image)
+
+        found = {
+            image
+            for neighbour in images
+            for image in self._passage_reverse.get(neighbour, ())
+        }
+        rows = [reconst.index.get(image, -1) for image in found]
+        return np.array([row for row in rows if row >= 0], dtype=np.int64)
+
+    @property
+    def true_distances(self) -> dict:
+        """The distances to the true neighbours as {id: {neighbour id: distance}}."""
+
+        if self._true_distances is None:
+            self._true_distances = self.reconst.distances_dict(
+                self.true_neighbour_rows, self.true_neighbour_distances
+            )
+        return self._true_distances
 
     def is_anomaly(self, distances: dict, interval: Tuple[float, float] = 0.95):
         dist = np.mean(np.array(list(distances.values())))
         return not interval[0] < dist < interval[1]
 
-    def filter(self, softness: float = 0.95) -> set:
+    # Tiles with less images use the statistics of the whole reconstruction
+    min_tile_images = 30
+
+    def filter(
+        self,
+        softness: float = 0.95,
+        k: int = 2,
+        tile_size: Optional[float] = None,
+        margin: Optional[float] = None,
+        statistics: str = "global",
+        processes: Optional[int] = None,
+    ) -> set:
         """Cameras filtering algorithm.
 
         Preprocess the camera positions information.
         Find neighbours, calculate distances
-        and run the algorithm.
+        and run the algorithm. The distances, the
+        statistics and the anomalies of all images
+        are computed at once as N x k arrays.
 
         Parameters
         --------------
@@ -104,47 +193,211 @@ class CameraFilter:
                 A real parameter with a value between 0 and 1,
                 which determines approximately how many images
                 won't be deleted by the algorithm.
+            k : int = 2
+                The number of neighbours of every image.
+            tile_size : Optional[float] = None
+                If it's given, the neighbours are searched in
+                cubic tiles of this size in a pool of processes,
+                see 'tiling.tiled_neighbours'.
+            margin : Optional[float] = None
+                The overlap around every tile. If it's None,
+                a quarter of the tile size is used.
+            statistics : str = "global"
+                "global" compares every image with the mean and
+                the std of the whole reconstruction, "tile" with
+                the ones of its tile (requires the tile size).
+            processes : Optional[int] = None
+                The number of processes of the tiled search.
         """
 
-        self.cameras_filter = {}
+        assert statistics in ("global", "tile"), f"Unknown statistics {statistics}."
+        assert (
+            statistics == "global" or tile_size is not None
+        ), "Tile statistics require the tile size."
 
         if self.with_passage:
             # Extract only the necessary images.
             self.reconst.delete_unnecessary_images(self.passage)
 
         # The data preprocession
-        self.reconst.find_neighbours()
+        self.reconst.find_neighbours(
+            k=k, tile_size=tile_size, margin=margin, processes=processes
+        )
         self.reconst.calculate_distances()
         if self.with_passage:
-            self.passage.find_neighbours()
+            self.passage.find_neighbours(k=k)
 
+        self._passage_to_reconst = self._passage_reverse = None
         self.calculate_true_distances()
 
-        # Confidence interval
-        interval = norm.interval(
-            softness, loc=self.reconst.mean, scale=self.reconst.std
+        self.softness = softness
+        self.statistics = statistics
+        self.tile_size = tile_size
+        # The tiles of the statistics stay in place when the reconstruction grows
+        self.tile_origin = (
+            None if tile_size is None else self.reconst.positions.min(axis=0)
         )
-        print(f"The confidence interval: {interval}")
+        self.flags = np.empty(0, dtype=bool)
+        self.filtered = set()
+        self.cameras_filter = {}
+
+        return self.decide()
 
-        for image in self.reconst.camera_poses.keys():
-            flag = 1 if self.is_anomaly(self.true_distances[image], interval) else 0
-            result_distance = np.mean(
-                np.array(list(self.reconst.distances[image].values()))
+    # The sorted true distances are refreshed after this share of rows changed
+    resort_ratio = 0.05
+
+    def decide(self, rows: Optional[np.ndarray] = None) -> set:
+        """Compare the distances to the true neighbours of every
+        image with the confidence interval of the COLMAP distances.
+
+        If rows are given, only their true distances have changed
+        since the last call. Then only they and the images, whose
+        distances lie between the old and the new bounds of the
+        interval, are decided again: the others can't change. The
+        distances are found in the sorted snapshot of the last full
+        call, and the rows changed since then are decided every
+        time, until they exceed resort_ratio of all images. The
+        tile statistics always decide all images.
+
+        Only the entries of the images, whose decision has
+        changed since the last call, are updated in the
+        'cameras_filter' dict. Return the filtered images.
+        """
+
+        reconst = self.reconst
+
+        # Confidence interval
+        if self.statistics == "tile":
+            loc, scale = reconst.tile_distances_stats(
+                self.tile_size, self.tile_origin, self.min_tile_images
             )
+            interval = norm.interval(self.softness, loc=loc, scale=scale)
+            print(
+                f"The confidence intervals of the tiles: from {interval[0].min()} to {interval[1].max()}"
+            )
+        else:
+            interval = norm.interval(self.softness, loc=reconst.mean, scale=reconst.std)
+            print(f"The confidence interval: {interval}")
+
+        if rows is None or self.statistics == "tile" or len(self.flags) == 0:
+            rows = np.arange(reconst.num_of_objects)
+            true_distance = self.true_neighbour_distances.mean(axis=1)
+            # The snapshot of the distances for the incremental calls
+            self._sorted_rows = np.argsort(true_distance, kind="stable")
+            self._sorted_distances = true_distance[self._sorted_rows]
+            self._unsorted = set()
+        else:
+            self._unsorted.update(np.asarray(rows).tolist())
+            self._unsorted.update(range(len(self.flags), reconst.num_of_objects))
+            rows = [np.fromiter(self._unsorted, dtype=np.int64)]
+            for old, new in zip(self.interval, interval):
+                begin = np.searchsorted(self._sorted_distances, min(old, new), "left")
+                end = np.searchsorted(self._sorted_distances, max(old, new), "right")
+                rows.append(self._sorted_rows[begin:end])
+            rows = np.unique(np.concatenate(rows))
+            true_distance = self.true_neighbour_distances[rows].mean(axis=1)
+
+        self.interval = interval
+        flags = ~((interval[0] < true_distance) & (true_distance < interval[1]))
+
+        old_flags = np.zeros(len(rows), dtype=bool)
+        known = rows < len(self.flags)
+        old_flags[known] = self.flags[rows[known]]
+        changed = ~known | (flags != old_flags)
+
+        if reconst.num_of_objects > len(self.flags):
+            append_rows(
+                self,
+                "flags",
+                np.zeros(reconst.num_of_objects - len(self.flags), dtype=bool),
+            )
+        self.flags[rows] = flags
+
+        changed_rows = rows[changed].tolist()
+        for row, flag in zip(changed_rows, flags[changed].tolist()):
+            image = reconst.images[row]
+            self.cameras_filter[image] = int(flag)
             if flag:
+                self.filtered.add(image)
                 print(
-                    f"Image {image}. Average distance to COLMAP neighbours: {result_distance}. \n",
+                    f"Image {image}. Average distance to COLMAP neighbours: {reconst.neighbour_distances[row].mean()}. \n",
                     end="",
                 )
-            self.cameras_filter[image] = flag
+            else:
+                self.filtered.discard(image)
+
+        if len(self._unsorted) > self.resort_ratio * reconst.num_of_objects:
+            # The next incremental call uses the new snapshot
+            self._unsorted = set()
+            true_distance = self.true_neighbour_distances.mean(axis=1)
+            self._sorted_rows = np.argsort(true_distance, kind="stable")
+            self._sorted_distances = true_distance[self._sorted_rows]
 
-        filtered = sum(self.cameras_filter.values())
+        filtered = len(self.filtered)
 
         print(
-            f"{ filtered } cameras out of {self.reconst.object_num} were filtered (",
-            f"{ round(filtered * 100 / self.reconst.object_num, 2) } %).",
+            f"{ filtered } cameras out of {reconst.object_num} were filtered (",
+            f"{ round(filtered * 100 / reconst.object_num, 2) } %).",
         )
 
-        result = set(key for key, value in self.cameras_filter.items() if value == 1)
+        return set(self.filtered)
+
+    def add_images(self, images: Sequence[str], positions: np.ndarray) -> set:
+        """Incremental filtering after new images were registered.
+
+        The images, which are already in the reconstruction, are
+        moved to the new positions. Only the neighbours affected by
+        the changes are searched again (see 'Reconstruction.add_images')
+        and only the images, whose decision may change, are decided
+        again (see 'decide'). 'filter' must be called before.
+        Return the filtered images.
+        """
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        if self.with_passage:
+            # Extract only the necessary images.
+            keep = [
+                row for row, image in enumerate(images) if image in self.passage.index
+            ]
+            images, positions = [images[row] for row in keep], positions[keep]
+
+        index = self.reconst.index
+        new_images = [image for image in images if image not in index]
+        rows = self.reconst.add_images(images, positions)
+
+        if self.with_passage:
+            if not self._passage_to_reconst is None:
+                for image in new_images:
+                    self._passage_to_reconst[self.passage.index[image]] = index[image]
+            # The images, which have the new or the moved images among the
+            # passage neighbours. The ones, which have them among the COLMAP
+            # neighbours, were searched again by the reconstruction.
+            rows = np.union1d(rows, self.passage_neighbours_of(images))
+        self.calculate_true_distances(rows)
+
+        return self.decide(rows)
+
+    def update_poses(self, images: Sequence[str], positions: np.ndarray) -> set:
+        """Incremental filtering after the images were moved.
+
+        Return the filtered images.
+        """
+
+        rows = self.reconst.update_poses(images, positions)
+        if self.with_passage:
+            rows = np.union1d(rows, self.passage_neighbours_of(images))
+        self.calculate_true_distances(rows)
+
+        return self.decide(rows)
+
+    def update_from_file(self, path_to_images: PathLikeObject) -> set:
+        """Incremental filtering of the new state of the images file.
+
+        Only the new and the moved images are processed.
+        Return the filtered images.
+        """
+
+        images, positions = self.reconst.read_changes(path_to_images)
+        print(f"{len(images)} new or moved images in {path_to_images}.")
 
-        return set(key for key, value in self.cameras_filter.items() if value == 1)
+        return self.add_images(images, positions)
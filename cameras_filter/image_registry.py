@@ -0,0 +1,128 @@
+from typing import Iterable, Optional, Sequence, Union
+import functools
+import re
+
+import numpy as np
+
+from utils.columnar_model import lookup_rows
+
+# Extract id of every image from its name
+DEFAULT_PATTERN = re.compile("[_]?([0-9]+).jpg", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1 << 20)
+def image_key(name: str, pattern: re.Pattern = DEFAULT_PATTERN) -> Optional[str]:
+    """Extract the id of the image from its name, None if it doesn't match.
+
+    Results are memoized, so every name is parsed once
+    per process whichever module asks for it.
+    """
+
+    match = re.search(pattern, name)
+    return None if match is None else match[1]
+
+
+def image_keys(
+    names: Iterable[str], pattern: re.Pattern = DEFAULT_PATTERN, strict: bool = True
+) -> list:
+    """Extract the ids of the images from their names."""
+
+    names = list(names)
+    keys = [image_key(name, pattern) for name in names]
+    if strict and None in keys:
+        name = next(name for name, key in zip(names, keys) if key is None)
+        raise ValueError(f"Image name '{name}' doesn't match the pattern.")
+    return keys
+
+
+class ImageRegistry:
+    """Name <-> COLMAP image id <-> key <-> row mapping of a set of images.
+
+    The key of an image is the id extracted from its name
+    by the pattern (the id used by 'Poses'), the row is
+    its position in the registry. Every name is parsed
+    once, all lookups go through hash maps or arrays.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        image_ids: Optional[Sequence[int]] = None,
+        pattern: Union[str, re.Pattern] = DEFAULT_PATTERN,
+        strict: bool = True,
+    ):
+        """Construct the registry.
+
+        Parameters
+        --------------
+            names : Sequence[str]
+                The names of the images.
+            image_ids : Optional[Sequence[int]] = None
+                The COLMAP ids of the images in the same order.
+                If it's None, all ids are -1.
+            pattern : Union[str, re.Pattern] = DEFAULT_PATTERN
+                The pattern, which extracts the key from a name
+                as its first group.
+            strict : bool = True
+                If it's True, a name, which doesn't match the
+                pattern, raises ValueError. Otherwise its key
+                is None and it's never found by key.
+        """
+
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.names = list(names)
+        self.keys = image_keys(self.names, self.pattern, strict)
+
+        if image_ids is None:
+            self.image_ids = np.full(len(self.names), -1, dtype=np.int64)
+        else:
+            self.image_ids = np.asarray(image_ids, dtype=np.int64).reshape(-1)
+            assert len(self.image_ids) == len(self.names), "Ids don't match names."
+
+        self.row_of_name = {name: row for row, name in enumerate(self.names)}
+        # A repeated key is found at its last row, but masks select all its rows
+        self.row_of_key = {
+            key: row for row, key in enumerate(self.keys) if key is not None
+        }
+
+        # Dense codes of the keys for vectorized masks, -1 for unmatched names
+        self._codes = {key: code for code, key in enumerate(self.row_of_key)}
+        self.key_codes = np.fromiter(
+            (self._codes.get(key, -1) for key in self.keys),
+            dtype=np.int64,
+            count=len(self.keys),
+        )
+        self.matched = self.key_codes >= 0
+
+    @classmethod
+    def from_images(
+        cls, images: dict, pattern: Union[str, re.Pattern] = DEFAULT_PATTERN
+    ) -> "ImageRegistry":
+        """Construct the registry of the images dict {image_id: Image}."""
+        return cls([image.name for image in images.values()], list(images), pattern)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.row_of_key
+
+    def rows(self, keys: Iterable[str]) -> np.ndarray:
+        """Rows of the keys, -1 for missing keys."""
+        return np.array([self.row_of_key.get(key, -1) for key in keys], dtype=np.int64)
+
+    def rows_of_image_ids(self, image_ids: Sequence[int]) -> np.ndarray:
+        """Rows of the COLMAP image ids, -1 for missing ids."""
+        return lookup_rows(self.image_ids, image_ids)
+
+    def keys_of_image_ids(self, image_ids: Sequence[int]) -> list:
+        """Keys of the images with the COLMAP image ids."""
+        return [self.keys[row] for row in self.rows_of_image_ids(image_ids).tolist()]
+
+    def mask(self, keys: Iterable[str]) -> np.ndarray:
+        """Boolean mask of the rows, whose keys are among the keys."""
+
+        # The last element stands for the unmatched names
+        selected = np.zeros(len(self._codes) + 1, dtype=bool)
+        selected[[self._codes[key] for key in keys if key in self._codes]] = True
+        return selected[self.key_codes]
@@ -1,19 +1,19 @@
 from pathlib import Path
 from typing import Union, Tuple, Optional, Sequence
 import json
-import re
-import os
-import shutil
 import argparse
+import copy
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
-from passage_poses import Passage
+from passage_poses import Passage, PassageData, read_passages
 from reconstruction_poses import Reconstruction
-from data_manipulations import select_images
-from utils.read_write_model import read_images_binary, read_images_text
+from data_manipulations import subset_mask
 from filter import CameraFilter
-from utils.quaternion_transform import world_coordinates
+from prune_images import images_to_prune, prune_image_files, scan_images
+from utils.partition import partition_model
+from utils.model_cache import enable_disk_cache
 
 
 PathLikeObject = Union[str, Path]
@@ -24,50 +24,36 @@ def save_filter(
     image_subset: Sequence,
     output_dir: PathLikeObject,
     sparse_dir: Optional[PathLikeObject] = None,
+    prune: bool = True,
+    min_track_length: int = 1,
 ):
-    """Split source data on 'filtered' and 'not filtered' images"""
+    """Split source data on 'filtered' and 'not filtered' images
+
+    The images file is read once and every record is written
+    into 'right_positions' or 'wrong_positions', the cameras file
+    is reflinked where the filesystem supports it (see
+    'utils.partition.partition_model'). The outputs keep the
+    format of the images file.
+
+    If prune is True (default), every output is a consistent
+    model: the points3D file keeps only the observations of its
+    images and the points observed by at least min_track_length
+    of them, and the 2D points, which refer to the removed points,
+    get the point3D_id -1 (see 'utils.pruning.prune_model').
+    Otherwise the points3D file is reflinked or copied as it is.
+    """
 
-    images_path = Path(images_path)
     output_dir = Path(output_dir)
 
-    right_images_dir = output_dir / "right_positions"
-    wrong_images_dir = output_dir / "wrong_positions"
-    wrong_images_dir.mkdir(parents=True, exist_ok=True)
-    right_images_dir.mkdir(parents=True, exist_ok=True)
-
-    wrong_images_path = Path(wrong_images_dir) / "images.bin"
-    right_images_path = Path(right_images_dir) / "images.bin"
-
-    # Extracting and deleting filtered images
-    select_images(
-        reconst_images_path=images_path,
-        image_subset=image_subset,
-        delete=False,
-        output_file=wrong_images_path,
+    # All outputs are written with one read of the images file
+    partition_model(
+        images_path,
+        [output_dir / "right_positions", output_dir / "wrong_positions"],
+        lambda ids, names: subset_mask(names, image_subset).astype(np.int64),
+        sparse_dir=sparse_dir,
+        prune=prune,
+        min_track_length=min_track_length,
     )
-    select_images(
-        reconst_images_path=images_path,
-        image_subset=image_subset,
-        delete=True,
-        output_file=right_images_path,
-    )
-
-    # Copy other reconstruction files (cameras.bin, points.bin)
-    sparse_dir = Path(images_path.parent) if sparse_dir is None else Path(sparse_dir)
-
-    cameras_file_path = sparse_dir / "cameras.bin"
-    points_file_path = sparse_dir / "points3D.bin"
-
-    assert os.path.exists(
-        cameras_file_path
-    ), f"There is no 'cameras.bin' file in {sparse_dir}"
-    assert os.path.exists(
-        cameras_file_path
-    ), f"There is no 'points3D.bin' file in {sparse_dir}"
-
-    for dir in (right_images_dir, wrong_images_dir):
-        shutil.copy(cameras_file_path, dir)
-        shutil.copy(points_file_path, dir)
 
 
 def main(
@@ -78,6 +64,13 @@ def main(
     softness: float = 0.95,
     output_dir: Optional[PathLikeObject] = None,
     sparse_dir: Optional[PathLikeObject] = None,
+    previous: Optional[dict] = None,
+    tile_size: Optional[float] = None,
+    statistics: str = "global",
+    processes: Optional[int] = None,
+    cache_dir: Optional[PathLikeObject] = None,
+    prune: bool = True,
+    min_track_length: int = 1,
 ) -> dict:
     """Run the full filtering algorithm from scratch.
 
@@ -110,24 +103,61 @@ def main(
             This parameter should be used, when the
             user's images.bin file is located not in
             its sparse reconstruction directory.
+        previous : Optional[dict] = None
+            The output of the previous run on the same growing
+            reconstruction. If it's given, only the new and the
+            moved images are processed (see
+            'CameraFilter.update_from_file') and the passage
+            parameters are ignored.
+        tile_size : Optional[float] = None
+            If it's given, the reconstruction is filtered
+            in tiles of this size in a pool of processes.
+        statistics : str = "global"
+            The statistics of the tiled filtering, "global"
+            or "tile" (see 'CameraFilter.filter').
+        processes : Optional[int] = None
+            The number of processes of the tiled filtering.
+        cache_dir : Optional[PathLikeObject] = None
+            If it's given, the decoded model and the compact
+            index of the description file are kept there as
+            '.npz' files, so the next runs on the same inputs
+            skip parsing (see 'utils.model_cache').
+        prune : bool = True
+            If it's True, the saved outputs are consistent
+            models, otherwise the points3D file is copied
+            as it is (see 'save_filter').
+        min_track_length : int = 1
+            See 'save_filter'.
     """
-    if not description_file is None:
-        passage = Passage(
-            file_with_poses=description_file,
-            select_in_process=select_in_process,
-            selected_passage=selected_passage,
-        )
-    else:
-        passage = None
-
     images_path = Path(images_path)
     assert images_path.exists(), f"File {images_path} doesn't exist."
 
-    reconst = Reconstruction(images_path)
-
-    camera_filter = CameraFilter(reconst, passage)
+    if not cache_dir is None:
+        enable_disk_cache(cache_dir)
 
-    filtered = camera_filter.filter(softness=softness)
+    if not previous is None:
+        camera_filter = previous["camera_filter"]
+        filtered = camera_filter.update_from_file(images_path)
+    else:
+        if not description_file is None:
+            passage = Passage(
+                file_with_poses=description_file,
+                select_in_process=select_in_process,
+                selected_passage=selected_passage,
+            )
+        else:
+            passage = None
+
+        reconst = Reconstruction(images_path)
+
+        camera_filter = CameraFilter(reconst, passage)
+
+        filtered = camera_filter.filter(
+            softness=softness,
+            tile_size=tile_size,
+            statistics=statistics,
+            processes=processes,
+        )
 
     if not output_dir is None:
         save_filter(
@@ -135,11 +165,119 @@ def main(
             image_subset=filtered,
             output_dir=output_dir,
             sparse_dir=sparse_dir,
+            prune=prune,
+            min_track_length=min_track_length,
         )
 
     return {"camera_filter": camera_filter, "filtered": filtered}
 
 
+# The reconstruction shared by the workers of 'filter_passages'
+_shared_reconstruction = None
+
+
+def _share_reconstruction(reconst: Reconstruction):
+    global _shared_reconstruction
+    _shared_reconstruction = reconst
+
+
+def _filter_passage(
+    data: PassageData,
+    softness: float,
+    k: int,
+    reconst: Optional[Reconstruction] = None,
+) -> dict:
+    """Filter the reconstruction with one passage, return the row of the table."""
+
+    # Filtering replaces the poses of the reconstruction, but never changes
+    # its arrays, so a shallow copy keeps the shared reconstruction intact
+    reconst = copy.copy(_shared_reconstruction if reconst is None else reconst)
+    passage = Passage.from_data(data)
+
+    row = {
+        "passage_id": data.passage_id,
+        "style": data.style,
+        "passage_images": passage.num_of_objects,
+        "images": sum(image in reconst.index for image in passage.index),
+        "filtered": set(),
+        "cameras_filter": {},
+    }
+    if row["images"] <= k:
+        print(f"Passage {data.passage_id} has too few reconstructed images.")
+        return row
+
+    camera_filter = CameraFilter(reconst, passage)
+    row["filtered"] = camera_filter.filter(softness=softness, k=k)
+    row["cameras_filter"] = camera_filter.cameras_filter
+    return row
+
+
+def filter_passages(
+    images_path: PathLikeObject,
+    description_file: PathLikeObject,
+    passage_ids: Optional[Sequence[int]] = None,
+    softness: float = 0.95,
+    k: int = 2,
+    processes: Optional[int] = None,
+) -> list:
+    """Run the filtering algorithm with every passage of the description file.
+
+    The description file is parsed once and the reconstruction
+    is read once for all passages.
+
+    Parameters
+        --------------
+        images_path : PathLikeObject
+            Path to the file with image information
+            of '.txt' or '.bin' extension.
+        description_file: PathLikeObject
+            Path to the Augmented City output description.
+        passage_ids : Optional[Sequence[int]] = None
+            The ids of the passages. If it's None,
+            all passages are used.
+        softness : float = 0.95
+            See 'main'.
+        k : int = 2
+            The number of neighbours of every image.
+        processes : Optional[int] = None
+            If it's given, passages are filtered in a pool
+            of processes, otherwise one by one.
+
+    Return the table with one row (dict) per passage: 'passage_id',
+    'style', 'passage_images', 'images' (reconstructed images of the
+    passage), 'filtered' (set) and 'cameras_filter' (dict).
+    """
+
+    passages = read_passages(description_file)
+    if not passage_ids is None:
+        passages = [passages[passage_id] for passage_id in passage_ids]
+
+    reconst = Reconstruction(images_path)
+
+    if processes:
+        with ProcessPoolExecutor(
+            processes, initializer=_share_reconstruction, initargs=(reconst,)
+        ) as pool:
+            table = list(
+                pool.map(
+                    _filter_passage,
+                    passages,
+                    [softness] * len(passages),
+                    [k] * len(passages),
+                )
+            )
+    else:
+        table = [_filter_passage(data, softness, k, reconst) for data in passages]
+
+    print(f"{'Passage':>8} {'Style':>16} {'Images':>8} {'Filtered':>9}")
+    for row in table:
+        print(
+            f"{row['passage_id']:>8} {row['style']:>16} {row['images']:>8} {len(row['filtered']):>9}"
+        )
+
+    return table
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Filter reconstruction")
@@ -147,6 +285,14 @@ if __name__ == "__main__":
     parser.add_argument("input_dir", type=str, default="./")
     parser.add_argument("output_dir", type=str, default="./")
     parser.add_argument("path_to_images_dir", type=str, default=None)
+    parser.add_argument("--description_file", type=str, default=None)
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--no_prune", dest="prune", action="store_false")
+    parser.add_argument("--min_track_length", type=int, default=1)
+    parser.add_argument("--quarantine_dir", type=str, default=None)
+    parser.add_argument("--manifest", type=str, default=None)
+    parser.add_argument("--dry_run", action="store_true")
+    parser.add_argument("--threads", type=int, default=16)
 
     args = parser.parse_args()
     inp_dir, out_dir, path_to_images_dir = (
@@ -155,19 +301,31 @@ if __name__ == "__main__":
         args.path_to_images_dir,
     )
 
-    result = main(images_path=inp_dir, output_dir=out_dir)
-
-    path_to_images_dir = Path(path_to_images_dir)
-
-    pattern = re.compile("[_]?([0-9]+).jpg", re.IGNORECASE)
+    result = main(
+        images_path=inp_dir,
+        output_dir=out_dir,
+        description_file=args.description_file,
+        cache_dir=args.cache_dir,
+        prune=args.prune,
+        min_track_length=args.min_track_length,
+    )
 
     # Deleting images that are not in filtered file
     if path_to_images_dir is not None:
-        for image in os.listdir(path_to_images_dir):
-            ans = re.search(pattern, image)
-            if ans:
-                if (ans[1] in result["filtered"]) or (
-                    ans[1] not in result["camera_filter"].reconst.images
-                ):
-                    print(path_to_images_dir / image)
-                    os.remove(path_to_images_dir / image)
+        names = images_to_prune(
+            scan_images(path_to_images_dir),
+            result["filtered"],
+            result["camera_filter"].reconst.index,
+        )
+        prune_image_files(
+            path_to_images_dir,
+            names,
+            quarantine_dir=args.quarantine_dir,
+            manifest_path=(
+                Path(out_dir) / "pruned_images.json"
+                if args.manifest is None
+                else args.manifest
+            ),
+            dry_run=args.dry_run,
+            threads=args.threads,
+        )
@@ -1,13 +1,53 @@
 from pathlib import Path
-from typing import Union
-import json
-import re
+from typing import List, Optional, Sequence, Tuple, Union
+import collections
+
+import numpy as np
 
 from poses_object import Poses
+from image_registry import image_keys
+from utils.description import PassageArrays
+from utils.model_cache import read_passages_cached
 
 PathLikeObject = Union[str, Path]
 
 
+# The fields of one passage of the description file used by Passage.
+# Positions are None for the passages without geometric information.
+PassageData = collections.namedtuple(
+    "PassageData", ["passage_id", "style", "images", "positions"]
+)
+
+
+def passage_data(passages: PassageArrays, passage_id: int) -> PassageData:
+    """Extract the image ids and the positions of a passage of the index."""
+
+    style = str(passages.styles[passage_id])
+    is_manual = bool(Passage.manual_or_auto.get(style.split("_")[-1], 0))
+
+    begin, end = passages.offsets[passage_id], passages.offsets[passage_id + 1]
+    images = image_keys(passages.names[begin:end], Passage.pattern)
+
+    return PassageData(
+        int(passages.passage_ids[passage_id]),
+        style,
+        images,
+        None if is_manual else np.array(passages.positions[begin:end]),
+    )
+
+
+def read_passages(path_to_description: PathLikeObject) -> List[PassageData]:
+    """Extract every passage of the description file.
+
+    The description file is streamed once (see 'utils.description')
+    and its compact index is cached, so later calls don't parse it.
+    """
+
+    passages = read_passages_cached(path_to_description)
+
+    return [passage_data(passages, id) for id in range(len(passages.passage_ids))]
+
+
 class Passage(Poses):
     """A passage object, which is used to select a subset
     of the reconstruction images. It is also believed
@@ -24,10 +64,13 @@ class Passage(Poses):
         path_to_description: PathLikeObject,
         selected_passage: int = 0,
         select_in_process: bool = False,
-    ) -> dict:
+    ) -> Tuple[list, Optional[np.ndarray]]:
         """Extract true camera poses from the output
         description file from Augmented City API.
 
+        Return the image ids and the N x 3 array of positions,
+        None for the passages without geometric information.
+
         Parameters
         --------------
             path_to_description : PathLikeObject
@@ -43,58 +86,58 @@ class Passage(Poses):
                 of passages from the description file
                 and asks user to choose passage.
         """
-        path_to_description = Path(path_to_description)
+        passages = read_passages(path_to_description)
 
         if select_in_process:
-            selected_passage = self.select_passage(path_to_description)
+            selected_passage = self.select_passage(passages)
 
-        with open(path_to_description, "r") as read_file:
-            passage = json.load(read_file)["passages"][selected_passage]
+        data = passages[selected_passage]
+        self.set_style(data)
 
-        style = str.split(passage["style"], "_")
-        self.is_linear = bool(self.linear_or_circular[style[0]])
-        self.is_manual = bool(self.manual_or_auto.get(style[-1], 0))
-        self.passage_id = selected_passage
+        return data.images, data.positions
+
+    @classmethod
+    def from_data(cls, data: PassageData) -> "Passage":
+        """Construct the passage from the already parsed
+        description file (see 'read_passages').
+        """
 
-        result = [] if self.is_manual else {}
+        passage = cls.__new__(cls)
+        passage.set_style(data)
+        passage.set_poses(data.images, data.positions)
+        return passage
 
-        for passage_iter in passage["points"]:
-            for camera in passage_iter:
-                key = re.search(self.pattern, camera["filename"])[1]
-                if not self.is_manual:
-                    result[key] = camera["camera"]["pose"]["position"]
-                else:
-                    result.append(key)
+    def set_style(self, data: PassageData):
+        style = str.split(data.style, "_")
+        self.is_linear = bool(self.linear_or_circular[style[0]])
+        self.is_manual = bool(self.manual_or_auto.get(style[-1], 0))
+        self.passage_id = data.passage_id
 
-        return result
+    def select_passage(
+        self, passages: Union[PathLikeObject, Sequence[PassageData]]
+    ) -> int:
+        """Output the list of passages and ask user to make choice.
 
-    def select_passage(self, path_to_description: PathLikeObject) -> int:
-        """Output the list of passages and ask user to make choice."""
+        Passages are the description file or its parsed passages.
+        """
 
         print("Extracting information about available passages...\n")
-        # Read the entire description file
-        with open(path_to_description, "r") as read_file:
-            passages = json.load(read_file)["passages"]
+        if isinstance(passages, (str, Path)):
+            passages = read_passages(passages)
 
         # Output information about each passage
-        for id, passage in enumerate(passages):
-
-            number_of_images = 0
-
-            for sub_passage in passage["points"]:
-                number_of_images += len(sub_passage)
-
+        for passage in passages:
             print(
-                f"Passage: {passage['style']}. Id: {id}. Number of images: {number_of_images}"
+                f"Passage: {passage.style}. Id: {passage.passage_id}. Number of images: {len(passage.images)}"
             )
 
         users_choice = input("Input selected passage id: ")
 
         return int(users_choice)
 
-    def find_neighbours(self):
+    def find_neighbours(self, k: int = 2):
         """If the passage doesn't contain any geometric
         information, two closest images in image the list
         will be the neighbours.
         """
-        Poses.find_neighbours(self, manual=self.is_manual)
+        Poses.find_neighbours(self, manual=self.is_manual, k=k)
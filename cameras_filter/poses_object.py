@@ -1,8 +1,9 @@
 from pathlib import Path
-from typing import Union, Tuple
-import re
+from typing import Optional, Sequence, Union, Tuple
 
 from utils.quaternion_transform import world_coordinates
+from spatial_index import DynamicIndex, nearest_neighbours, row_distances
+from image_registry import DEFAULT_PATTERN
 
 import numpy as np
 
@@ -17,9 +18,7 @@ class Poses:
     file ('images.bin' or 'description.json').
     """
 
-    pattern = re.compile(
-        "[_]?([0-9]+).jpg", re.IGNORECASE
-    )  # Extract id of every image from its name
+    pattern = DEFAULT_PATTERN  # Extract id of every image from its name
 
     def __init__(self, file_with_poses: PathLikeObject, **kwargs) -> dict:
         """Construct poses object.
@@ -39,66 +38,118 @@ class Poses:
         file_with_poses = Path(file_with_poses)
 
         print(f"Extracting poses of cameras from {str(file_with_poses)} file...")
-        self.camera_poses = self.extract_poses(file_with_poses, **kwargs)
-
-        self.images = tuple(self.camera_poses)
-        self.num_of_objects = len(self.camera_poses)
+        self.set_poses(*self.extract_poses(file_with_poses, **kwargs))
 
         print(
             f"""Camera poses object was created. \nNumber of images: {self.num_of_objects}.\n"""
         )
 
+    def set_poses(self, images: Sequence[str], positions: Optional[np.ndarray] = None):
+        """Store the poses as the image ids and the N x 3 array of positions.
+
+        Parameters
+        --------------
+            images : Sequence[str]
+                The ids of the images.
+            positions : Optional[np.ndarray] = None
+                The positions of the images in the same order.
+                None for passages without geometric information,
+                then 'images' may contain repeated ids.
+        """
+
+        images = list(images)
+
+        if positions is None:
+            positions = np.empty((0, 3), dtype=np.float64)
+        else:
+            positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+            # A repeated id keeps its first place and its last position, like a dict
+            rows = dict(zip(images, range(len(images))))
+            if len(rows) != len(images):
+                images = list(rows)
+                positions = positions[list(rows.values())]
+
+        self.images = images
+        self.positions = positions
+        self.index = {image: row for row, image in enumerate(self.images)}
+        self.num_of_objects = self.object_num = len(self.images)
+        self._camera_poses = None
+        self.neighbour_rows = self._neighbours = self.spatial_index = None
+
+    def rows(self, images: Sequence[str]) -> np.ndarray:
+        """Convert the image ids into the rows of the positions array."""
+        return np.array([self.index[image] for image in images], dtype=np.int64)
+
     @property
-    def camera_poses(self):
+    def camera_poses(self) -> Union[dict, list]:
+        """The poses as {id: {"x": x, "y": y, "z": z}}.
+
+        Compatibility view of the positions array. It is
+        the list of ids for passages without positions.
+        """
+
+        if self._camera_poses is None:
+            if len(self.positions) != len(self.images):
+                self._camera_poses = list(self.images)
+            else:
+                Oxyz = ("x", "y", "z")
+                self._camera_poses = {
+                    image: dict(zip(Oxyz, position))
+                    for image, position in zip(self.images, self.positions.tolist())
+                }
         return self._camera_poses
 
     @camera_poses.setter
-    def camera_poses(self, value):
-        self._camera_poses = value
-        self.images = tuple(self.camera_poses)
-        self.object_num = len(self.images)
+    def camera_poses(self, value: Union[dict, list]):
+        if isinstance(value, dict):
+            self.set_poses(
+                list(value),
+                [
+                    list(point.values()) if isinstance(point, dict) else point
+                    for point in value.values()
+                ],
+            )
+        else:
+            self.set_poses(value)
+
+    def extract_poses(self, file: PathLikeObject) -> Tuple[list, Optional[np.ndarray]]:
+        """Extract poses from file.
 
-    def extract_poses(self, file: PathLikeObject) -> dict:
-        """Extract poses from file."""
+        Return the image ids and the N x 3 array of positions
+        (None if the file has no geometric information).
+        """
         # Python virtual method
         raise NotImplementedError()
 
     def find_nearest(self, image: Tuple) -> Tuple[str, str]:
         """Auxiliary function for neighbour searching.
 
-        Find two geometrically closest images for current image.
+        Find two geometrically closest images for current image
+        with a linear scan. 'find_neighbours' queries all images
+        at once, see 'spatial_index.nearest_neighbours'.
         """
 
         id, point = image
-        passage = list(self.camera_poses.items())
-
-        # Initial values
-        first = second = None
-        max_1 = max_2 = np.inf
-
-        for item in passage:
-            if item[0] == id:
-                continue
-            distance = Poses.distance(point, item[1])
-            if distance <= max_1:
-                max_2 = max_1
-                max_1 = distance
-                second = first
-                first = item[0]
-            elif distance <= max_2:
-                max_2 = distance
-                second = item[0]
+        if isinstance(point, dict):
+            point = list(point.values())
 
+        distances = Poses.row_distances(np.asarray(point), self.positions)
+        # The later of the equally distant images goes first, as in a linear scan
+        order = np.lexsort((-np.arange(len(distances)), distances))
+        order = order[order != self.index.get(id, -1)][:2]
+
+        first, second = [self.images[row] for row in order] + [None] * (2 - len(order))
         return (first, second)
 
-    def find_neighbours(self, manual: bool = False):
-        """Find two closest poses for every image.
+    def find_neighbours(self, manual: bool = False, k: int = 2):
+        """Find k closest poses for every image.
 
         For every image in reconstruction/passage information
-        algorithm searches two images, which are geometrically
-        closest to current image. If the passage doesn't
-        contain any geometric information, two closest
-        images in image list will be neighbours.
+        algorithm searches k images, which are geometrically
+        closest to current image. All images are queried at
+        once in a KD-tree built over the positions. If the
+        passage doesn't contain any geometric information,
+        two closest images in image list will be neighbours.
 
         Parameters
         --------------
@@ -106,28 +157,61 @@ class Poses:
                 The variable was added specially for passages,
                 which doesn't consist any geometric information
                 (*_MANUAL).
+            k : int = 2
+                The number of neighbours of the geometric search.
         """
 
-        self.neighbours = {}
-
         if manual:
+            self.neighbour_rows = None
+            self._neighbours = {}
             # The two closest to the first image are the second and the third
-            self.neighbours[self.images[0]] = (self.images[1], self.images[2])
+            self._neighbours[self.images[0]] = (self.images[1], self.images[2])
             # The two closest to the last image are the two previous images
             image_num = self.num_of_objects
-            self.neighbours[self.images[image_num - 1]] = (
+            self._neighbours[self.images[image_num - 1]] = (
                 self.images[image_num - 2],
                 self.images[image_num - 3],
             )
 
             for ind, image in enumerate(self.images[1 : image_num - 1]):
-                self.neighbours[image] = (self.images[ind - 1], self.images[ind + 1])
+                self._neighbours[image] = (self.images[ind - 1], self.images[ind + 1])
         else:
-            for image in self.camera_poses.items():
-                self.neighbours[image[0]] = tuple(self.find_nearest(image))
+            # N x k rows of the neighbours, the dict view is built on demand
+            self.spatial_index = DynamicIndex(self.positions)
+            self.neighbour_rows, _ = nearest_neighbours(
+                self.positions, k=k, tree=self.spatial_index.tree
+            )
+            self._neighbours = None
+
+    @property
+    def neighbours(self) -> dict:
+        """The neighbours as {id: (ids of the neighbours)}."""
+
+        if self._neighbours is None:
+            self._neighbours = {
+                image: tuple(self.images[row] for row in rows)
+                for image, rows in zip(self.images, self.neighbour_rows.tolist())
+            }
+        return self._neighbours
+
+    def distances_dict(self, rows: np.ndarray, distances: np.ndarray) -> dict:
+        """Convert N x k neighbour rows and distances
+        into {id: {neighbour id: distance}}.
+        """
+
+        images = self.images
+        return {
+            image: {images[row]: distance for row, distance in zip(*neighbours)}
+            for image, neighbours in zip(images, zip(rows.tolist(), distances.tolist()))
+        }
 
     @staticmethod
     def distance(point1: dict, point2: dict):
         point1 = np.array(list(point1.values()))
         point2 = np.array(list(point2.values()))
         return np.sqrt(sum((point2 - point1) ** 2))
+
+    @staticmethod
+    def row_distances(points1: np.ndarray, points2: np.ndarray) -> np.ndarray:
+        """Row-wise 'distance' between two (broadcastable) ... x 3 arrays."""
+        return row_distances(points1, points2)
@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional, Union
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from image_registry import ImageRegistry
+
+
+PathLikeObject = Union[str, Path]
+
+
+def scan_images(path_to_images_dir: PathLikeObject) -> list:
+    """Names of the regular files of the directory.
+
+    The directory is listed with 'os.scandir', so the file
+    type comes with the listing and no file is stat'ed.
+    """
+
+    with os.scandir(path_to_images_dir) as entries:
+        return [entry.name for entry in entries if entry.is_file()]
+
+
+def images_to_prune(
+    names: Iterable[str], filtered: Iterable[str], reconstructed: Iterable[str]
+) -> list:
+    """Names of the images, which are filtered or aren't reconstructed.
+
+    The keys of the names are parsed once and looked up in hash
+    maps (see 'ImageRegistry'). The files, whose names don't
+    match the pattern, are never pruned.
+    """
+
+    files = ImageRegistry(names, strict=False)
+    prune = files.matched & (files.mask(filtered) | ~files.mask(reconstructed))
+    return [files.names[row] for row in np.flatnonzero(prune).tolist()]
+
+
+def write_manifest(manifest: dict, path: PathLikeObject):
+    """Write the manifest next to the destination first, then replace it."""
+
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(path: PathLikeObject) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def _apply(task: tuple) -> str:
+    """Delete or move one file, return its status."""
+
+    action, source, destination = task
+    try:
+        if action == "delete":
+            os.remove(source)
+            return "deleted"
+        # A rename, or a copy and a delete across filesystems
+        shutil.move(source, destination)
+        return "moved" if action == "move" else "restored"
+    except OSError as error:
+        return f"failed: {error}"
+
+
+def _run(tasks: list, threads: int) -> list:
+    # The file operations wait on the filesystem, not on the interpreter
+    with ThreadPoolExecutor(max(int(threads), 1)) as pool:
+        return list(pool.map(_apply, tasks, chunksize=64))
+
+
+def prune_image_files(
+    path_to_images_dir: PathLikeObject,
+    names: Iterable[str],
+    quarantine_dir: Optional[PathLikeObject] = None,
+    manifest_path: Optional[PathLikeObject] = None,
+    dry_run: bool = False,
+    threads: int = 16,
+) -> dict:
+    """Delete the images of the directory or move them to the quarantine.
+
+    Parameters
+        --------------
+        path_to_images_dir : PathLikeObject
+            The directory with the images.
+        names : Iterable[str]
+            The names of the files to prune.
+        quarantine_dir : Optional[PathLikeObject] = None
+            If it's given, the files are moved there and the
+            pruning can be undone (see 'undo_pruning'),
+            otherwise they are deleted.
+        manifest_path : Optional[PathLikeObject] = None
+            The file, where the manifest is written.
+        dry_run : bool = False
+            If it's True, no file is touched, the manifest only
+            lists the planned operations.
+        threads : int = 16
+            The number of the threads, which delete or move files.
+
+    Return the manifest: the directories, the action ("delete"
+    or "move"), the dry_run flag and the status of every file.
+    """
+
+    path_to_images_dir = Path(path_to_images_dir)
+    names = list(names)
+    action = "delete" if quarantine_dir is None else "move"
+
+    if dry_run:
+        statuses = ["planned"] * len(names)
+    else:
+        if action == "move":
+            quarantine_dir = Path(quarantine_dir)
+            quarantine_dir.mkdir(parents=True, exist_ok=True)
+        statuses = _run(
+            [
+                (
+                    action,
+                    path_to_images_dir / name,
+                    None if quarantine_dir is None else quarantine_dir / name,
+                )
+                for name in names
+            ],
+            threads,
+        )
+
+    manifest = {
+        "images_dir": str(path_to_images_dir.resolve()),
+        "quarantine_dir": (
+            None if quarantine_dir is None else str(Path(quarantine_dir).resolve())
+        ),
+        "action": action,
+        "dry_run": dry_run,
+        "files": dict(zip(names, statuses)),
+    }
+    if not manifest_path is None:
+        write_manifest(manifest, manifest_path)
+
+    failed = sum(status.startswith("failed") for status in statuses)
+    print(
+        f"{len(names) - failed} of {len(names)} images",
+        "would be" if dry_run else "were",
+        "deleted." if action == "delete" else f"moved to {quarantine_dir}.",
+    )
+    return manifest
+
+
+def undo_pruning(manifest_path: PathLikeObject, threads: int = 16) -> dict:
+    """Move the quarantined images of the manifest back.
+
+    The manifest is updated: the returned files get the status
+    'restored'. Deleted files can't be restored and are kept
+    as they are.
+    """
+
+    manifest = read_manifest(manifest_path)
+    names = [name for name, status in manifest["files"].items() if status == "moved"]
+
+    if names:
+        images_dir, quarantine_dir = (
+            Path(manifest["images_dir"]),
+            Path(manifest["quarantine_dir"]),
+        )
+        statuses = _run(
+            [("restore", quarantine_dir / name, images_dir / name) for name in names],
+            threads,
+        )
+        for name, status in zip(names, statuses):
+            # A file, which failed to return, is still in the quarantine
+            manifest["files"][name] = "moved" if status.startswith("failed") else status
+
+    write_manifest(manifest, manifest_path)
+
+    restored = sum(status == "restored" for status in manifest["files"].values())
+    print(f"{restored} of {len(manifest['files'])} images were restored.")
+    return manifest
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Undo the pruning of images")
+
+    parser.add_argument("manifest_path", type=str)
+    parser.add_argument("--threads", type=int, default=16)
+
+    args = parser.parse_args()
+
+    undo_pruning(args.manifest_path, threads=args.threads)
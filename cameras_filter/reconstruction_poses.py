@@ -1,12 +1,14 @@
 from pathlib import Path
-from typing import Union, Tuple
-import re
+from typing import Optional, Sequence, Union, Tuple
 
 import numpy as np
 
 from poses_object import Poses
-from utils.read_write_model import read_images_binary, read_images_text
-from utils.quaternion_transform import world_coordinates
+from image_registry import ImageRegistry
+from spatial_index import DynamicIndex, append_rows, radius_cut
+from tiling import TileGrid, tiled_neighbours, tile_statistics
+from utils.model_cache import read_image_poses_cached
+from utils.quaternion_transform import world_coordinates_batch
 
 
 PathLikeObject = Union[str, Path]
@@ -19,11 +21,15 @@ class Reconstruction(Poses):
     and calculate average distances.
     """
 
-    def extract_poses(self, path_to_images: PathLikeObject) -> dict:
+    def extract_poses(self, path_to_images: PathLikeObject) -> Tuple[list, np.ndarray]:
         """Extract poses from file.
 
         File must contain information about images
         from COLMAP reconstruction (e.g. 'images.bin').
+        Only the poses and the names are read, the
+        2D observations of the images are skipped.
+        Decoded poses are cached, see 'utils.model_cache'.
+        Return the image ids and the N x 3 array of positions.
 
         Parameters
         --------------
@@ -34,30 +40,42 @@ class Reconstruction(Poses):
 
         print("Load COLMAP reconstruction...")
         path_to_images = Path(path_to_images)
-        images = (
-            read_images_binary(path_to_images)
-            if str(path_to_images).endswith(".bin")
-            else read_images_text(images)
-        )
+        poses = read_image_poses_cached(path_to_images)
+
+        images = ImageRegistry(poses.names, poses.ids, self.pattern).keys
 
-        result = {}
-        Oxyz = ("x", "y", "z")
+        return images, world_coordinates_batch(poses.qvecs, poses.tvecs)
 
-        for image in images.values():
+    def find_neighbours(
+        self,
+        k: int = 2,
+        tile_size: Optional[float] = None,
+        margin: Optional[float] = None,
+        processes: Optional[int] = None,
+    ):
+        """Find the k closest images of every image.
 
-            qvec = image[1]
-            tvec = image[2]
+        If the tile size is given, the search runs tile by tile
+        in a pool of processes (see 'tiling.tiled_neighbours'),
+        so the workers never hold the whole reconstruction.
+        """
 
-            result[re.search(self.pattern, image[4])[1]] = {
-                key: value
-                for key, value in zip(Oxyz, world_coordinates(qvec, tvec)[:, 0])
-            }
+        if tile_size is None:
+            # COLMAP neighbours search can only be called with manual = False.
+            Poses.find_neighbours(self, manual=False, k=k)
+            return
 
-        return result
+        self.neighbour_rows, _ = tiled_neighbours(
+            self.positions, k=k, tile_size=tile_size, margin=margin, processes=processes
+        )
+        self._neighbours = None
+        # The index of the whole reconstruction is built by the first update
+        self.spatial_index = None
 
-    def find_neighbours(self):
-        # COLMAP neighbours search can only be called with manual = False.
-        Poses.find_neighbours(self, manual=False)
+    def ensure_spatial_index(self) -> DynamicIndex:
+        if self.spatial_index is None:
+            self.spatial_index = DynamicIndex(self.positions)
+        return self.spatial_index
 
     def calculate_distances_stats(self, distances: np.ndarray) -> Tuple[float]:
         """Calculate statistics across the distances array.
@@ -71,46 +89,203 @@ class Reconstruction(Poses):
         self.mean = np.mean(mean_distances)
         self.std = np.std(mean_distances)
 
+        # Running sums for the incremental updates, see 'add_images'
+        self._sum = mean_distances.sum()
+        self._sum_squares = (mean_distances**2).sum()
+        # The rows, which the reverse queries check directly
+        self._ball_radius, large_rows = radius_cut(distances[:, -1])
+        self._large_rows = set(large_rows.tolist())
+
         print(
             f"Average COLMAP representation distance: {self.mean}.",
             f"Standard deviation: {self.std}.\n",
             sep="\n",
         )
 
+    def tile_distances_stats(
+        self,
+        tile_size: float,
+        origin: Optional[np.ndarray] = None,
+        min_images: int = 1,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Calculate the statistics of the distances tile by tile.
+
+        Return the mean and the standard deviation of the tile
+        of every image. The images of the tiles with less than
+        min_images images get the statistics of the whole
+        reconstruction.
+        """
+
+        grid = TileGrid(self.positions, tile_size, origin)
+        return tile_statistics(
+            self.neighbour_distances.mean(axis=1),
+            grid.tiles,
+            min_count=min_images,
+            default=(self.mean, self.std),
+        )
+
     def calculate_distances(self) -> np.ndarray:
-        """Calculate distances to two closest neighbours
+        """Calculate distances to the closest neighbours
         for every image in COLMAP reconstruction.
         """
 
-        self.distances = {}
-        distances = []
-
         print("Calculating distances...")
 
-        for image in self.neighbours.items():
-            point = self.camera_poses[image[0]]  # Current image
-            point1 = self.camera_poses[image[1][0]]  # The first neighbour.
-            point2 = self.camera_poses[image[1][1]]  # The second one.
-
-            distance_1 = Poses.distance(point, point1)
-            distance_2 = Poses.distance(point, point2)
+        # N x k distances to the neighbours
+        self.neighbour_distances = Poses.row_distances(
+            self.positions[:, None], self.positions[self.neighbour_rows]
+        )
+        self._distances = None
 
-            self.distances[image[0]] = {
-                image[1][0]: distance_1,
-                image[1][1]: distance_2,
-            }
+        self.calculate_distances_stats(self.neighbour_distances)
 
-            distances.append([distance_1, distance_2])
+    @property
+    def distances(self) -> dict:
+        """The distances as {id: {neighbour id: distance}}."""
 
-        self.calculate_distances_stats(np.array(distances))
+        if self._distances is None:
+            self._distances = self.distances_dict(
+                self.neighbour_rows, self.neighbour_distances
+            )
+        return self._distances
 
     def delete_unnecessary_images(self, passage: Poses):
         """Delete images that are not considered in a particular passage."""
 
         print("Deleting extra images from COLMAP reconstruction representation...")
 
-        self.camera_poses = {
-            key: value
-            for key, value in self.camera_poses.items()
-            if key in passage.images
-        }
+        rows = [row for row, image in enumerate(self.images) if image in passage.index]
+        self.set_poses([self.images[row] for row in rows], self.positions[rows])
+
+    def read_changes(self, path_to_images: PathLikeObject) -> Tuple[list, np.ndarray]:
+        """Read the images file again and return the images,
+        which are new or have moved, and their positions.
+        """
+
+        images, positions = self.extract_poses(path_to_images)
+        rows = np.array([self.index.get(image, -1) for image in images], dtype=np.int64)
+
+        changed = rows < 0
+        known = np.flatnonzero(~changed)
+        changed[known] = (positions[known] != self.positions[rows[known]]).any(axis=1)
+
+        return [images[row] for row in np.flatnonzero(changed)], positions[changed]
+
+    def add_images(self, images: Sequence[str], positions: np.ndarray) -> np.ndarray:
+        """Add newly registered images to the reconstruction.
+
+        The images, which are already in the reconstruction,
+        are moved to the new positions (see 'update_poses').
+        Only the neighbours of the images near the changes are
+        searched again, the mean and the std are updated from
+        running sums, and the arrays grow with spare capacity
+        (see 'spatial_index.append_rows'), so the cost is
+        proportional to the number of changes rather than to
+        the model size.
+
+        Return the rows, whose neighbours were searched again.
+        """
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.ensure_spatial_index()
+
+        # A repeated image keeps its last position, like a dict
+        new, moved = {}, {}
+        for image, position in zip(images, positions):
+            (moved if image in self.index else new)[image] = position
+
+        affected = [np.empty(0, dtype=np.int64)]
+        if moved:
+            affected.append(self.update_poses(list(moved), list(moved.values())))
+        if not new:
+            return np.unique(np.concatenate(affected))
+
+        start = self.num_of_objects
+        new_positions = np.array(list(new.values()), dtype=np.float64)
+        affected.append(self._reverse_query(new_positions))
+
+        self.images.extend(new)
+        self.index.update(zip(new, range(start, start + len(new))))
+        append_rows(self, "positions", new_positions)
+        self.num_of_objects = self.object_num = len(self.images)
+        self._camera_poses = self._neighbours = self._distances = None
+
+        # The rows of the new images are filled by the search below
+        k = self.neighbour_rows.shape[1]
+        append_rows(self, "neighbour_rows", np.zeros((len(new), k), dtype=np.int64))
+        append_rows(self, "neighbour_distances", np.full((len(new), k), np.nan))
+
+        rebuilt = self.spatial_index.add(new_positions)
+        affected.append(np.arange(start, self.num_of_objects))
+
+        return self._update_neighbours(np.unique(np.concatenate(affected)), rebuilt)
+
+    def update_poses(self, images: Sequence[str], positions: np.ndarray) -> np.ndarray:
+        """Move the images of the reconstruction to new positions.
+
+        Return the rows, whose neighbours were searched again.
+        """
+
+        rows = self.rows(images)
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.ensure_spatial_index()
+
+        # The images, which had the moved images among the neighbours,
+        # have their old positions within the radius, the images, which
+        # may have them now, have the new positions within it
+        affected = [self._reverse_query(self.positions[rows]), rows]
+
+        self.positions[rows] = positions
+        self._camera_poses = self._neighbours = self._distances = None
+        rebuilt = self.spatial_index.move(rows, positions)
+        affected.append(self._reverse_query(positions))
+
+        return self._update_neighbours(np.unique(np.concatenate(affected)), rebuilt)
+
+    def _reverse_query(self, points: np.ndarray) -> np.ndarray:
+        """Rows, which have any of the points within the distance
+        to their k-th neighbour (see 'DynamicIndex.reverse_query').
+        """
+
+        return self.spatial_index.reverse_query(
+            points,
+            self.neighbour_distances[:, -1],
+            self._ball_radius,
+            np.fromiter(self._large_rows, dtype=np.int64),
+        )
+
+    def _update_neighbours(self, rows: np.ndarray, rebuilt: bool = False) -> np.ndarray:
+        """Search the neighbours of the rows again and update the statistics."""
+
+        k = self.neighbour_rows.shape[1]
+        old_means = self.neighbour_distances[rows].mean(axis=1)
+        old_means = old_means[~np.isnan(old_means)]
+
+        neighbour_rows, _ = self.spatial_index.query(rows, k=k)
+        distances = Poses.row_distances(
+            self.positions[rows][:, None], self.positions[neighbour_rows]
+        )
+        self.neighbour_rows[rows] = neighbour_rows
+        self.neighbour_distances[rows] = distances
+
+        if rebuilt:
+            # Recalculate the statistics to drop the accumulated rounding errors
+            self.calculate_distances_stats(self.neighbour_distances)
+            return rows
+
+        for row, radius in zip(rows.tolist(), distances[:, -1].tolist()):
+            if radius > self._ball_radius:
+                self._large_rows.add(row)
+            else:
+                self._large_rows.discard(row)
+
+        new_means = distances.mean(axis=1)
+        self._sum += new_means.sum() - old_means.sum()
+        self._sum_squares += (new_means**2).sum() - (old_means**2).sum()
+
+        self.mean = self._sum / self.num_of_objects
+        self.std = np.sqrt(
+            max(self._sum_squares / self.num_of_objects - self.mean**2, 0)
+        )
+
+        return rows
@@ -1,22 +1,66 @@
 from typing import Union, Tuple, Optional
 from pathlib import Path
-import re
-import os
-
-from utils.read_write_model import (
-    read_images_text,
-    read_images_binary,
-    write_images_text,
-    write_images_binary,
-)
-from utils.read_write_model import Image
-from utils.quaternion_transform import world_coordinates, colmap_coordinates, add_vector
+
+from utils.pruning import read_images_arrays, write_images_arrays
+from utils.quaternion_transform import qvec2rotmat_batch
+from image_registry import ImageRegistry
 
 import numpy as np
 
 
 PathLikeObject = Union[str, Path]
-pattern = re.compile("[_]?([0-9]+).jpg", re.IGNORECASE)
+
+
+def noise_translations(
+    qvecs: np.ndarray,
+    tvecs: np.ndarray,
+    probability: float = 0.15,
+    noise_scale: float = 1,
+    uniform: bool = True,
+    rng: Union[None, int, np.random.Generator] = None,
+    num_variants: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Shift the cameras of the random subset by random vectors.
+
+    The selection and the noise vectors of all images (and
+    all variants) are drawn at once, and the cameras are shifted
+    in world coordinates with batched rotations: the translation
+    t of a camera shifted by a is t - R a.
+
+    Parameters
+        --------------
+        qvecs : np.ndarray
+            N x 4 array of the rotations of the images.
+        tvecs : np.ndarray
+            N x 3 array of the translations of the images.
+        probability, noise_scale, uniform
+            See 'add_noise'.
+        rng : Union[None, int, np.random.Generator] = None
+            The generator or the seed of a new one.
+        num_variants : Optional[int] = None
+            If it's given, so many independent variants are drawn.
+
+    Return the N mask of the noised images and the N x 3 translations,
+    or the V x N mask and the V x N x 3 translations of V variants.
+    """
+
+    rng = np.random.default_rng(rng)
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)
+    shape = (len(tvecs),) if num_variants is None else (num_variants, len(tvecs))
+
+    noised = rng.random(shape) < probability
+    if uniform:
+        noises = rng.uniform(-1, 1, (int(noised.sum()), 3)) * noise_scale
+    else:
+        noises = rng.standard_normal((int(noised.sum()), 3)) * noise_scale
+
+    # The rotations are shared by the variants
+    rows = np.nonzero(noised)[-1]
+    R = qvec2rotmat_batch(qvecs)
+    result = np.array(np.broadcast_to(tvecs, shape + (3,)))
+    result[noised] -= np.matmul(R[rows], noises[:, :, None])[:, :, 0]
+
+    return noised, result
 
 
 def add_noise(
@@ -25,6 +69,7 @@ def add_noise(
     probability: float = 0.15,
     noise_scale: float = 1,
     uniform: bool = True,
+    rng: Union[None, int, np.random.Generator] = None,
 ) -> Tuple[str]:
     """Add noise to each of the images
     from COLMAP reconstruction with a
@@ -40,7 +85,7 @@ def add_noise(
         path_to_output : Optional[PathLikeObject] = None
             The path to the output images file with noise on
             some images. If the path_to_output is equal to the
-            path_to_images, the source images file will be removed.
+            path_to_images, the source images file will be replaced.
         probability : float = 0.15
             The approximate proportion of noised data.
         noise_scale: float = 1
@@ -49,57 +94,98 @@ def add_noise(
             If it's true, the noise that generated by
             the uniform distribution is used. Otherwise,
             the normal one is used.
+        rng : Union[None, int, np.random.Generator] = None
+            The generator or the seed of a new one. The same
+            seed gives the same noise on every run.
     """
     path_to_images = Path(path_to_images)
-
-    read_method = (
-        read_images_text if str(path_to_images).endswith(".txt") else read_images_binary
-    )
-
-    images = read_method(path_to_images)
-
-    threshold = 1 - probability
-    noised = []
+    images = read_images_arrays(path_to_images)
 
     print("Noising image poses...")
 
-    for key, image in images.items():
-        if np.random.rand() > threshold:
-            if uniform:
-                noise = np.random.uniform(-1, 1, (3, 1)) * noise_scale
-            else:
-                noise = np.random.standard_normal((3, 1)) * noise_scale
-            images[key] = Image(
-                id=image[0],
-                qvec=image[1],
-                tvec=add_vector(image[1], image[2], noise)[:, 0],
-                camera_id=image[3],
-                name=image[4],
-                xys=image[5],
-                point3D_ids=image[6],
-            )
-            noised.append(re.search(pattern, image[4])[1])
+    mask, tvecs = noise_translations(
+        images.qvecs, images.tvecs, probability, noise_scale, uniform, rng
+    )
+    images = images._replace(tvecs=tvecs)
+    noised = [
+        key
+        for key, selected in zip(
+            ImageRegistry(images.names, images.ids).keys, mask.tolist()
+        )
+        if selected
+    ]
 
     if path_to_output is None:
         path_to_output = Path(
             str(path_to_images)[:-4] + "_sampled" + str(path_to_images)[-4:]
         )
 
-    if path_to_images == path_to_output:
-        os.remove(path_to_images)
-
-    write_method = (
-        write_images_text
-        if str(path_to_output).endswith(".txt")
-        else write_images_binary
-    )
-    write_method(images, path_to_output)
+    # The output replaces the source file atomically, if it's the same file
+    write_images_arrays(images, path_to_output)
 
     result = set(noised)
 
     print(
-        f"{len(noised)} poses out of {len(images)} were noised ({round(len(noised)/len(images)*100, 1)}%):"
+        f"{len(noised)} poses out of {len(images.ids)} were noised ({round(len(noised)/len(images.ids)*100, 1)}%):"
     )
     print(result)
 
     return result, path_to_output
+
+
+def add_noise_variants(
+    path_to_images: PathLikeObject,
+    num_variants: int,
+    output_dir: Optional[PathLikeObject] = None,
+    probability: float = 0.15,
+    noise_scale: float = 1,
+    uniform: bool = True,
+    rng: Union[None, int, np.random.Generator] = None,
+) -> Tuple[list, np.ndarray]:
+    """Draw many independent noised variants of the images file at once.
+
+    The file is read once and all variants are drawn in one
+    call (see 'noise_translations'), e.g. for Monte-Carlo
+    evaluation of the filtering.
+
+    Parameters
+        --------------
+        path_to_images : PathLikeObject
+            Path to the images file from the COLMAP reconstruction.
+        num_variants : int
+            The number of the variants.
+        output_dir : Optional[PathLikeObject] = None
+            If it's given, the i-th variant is written there
+            as 'images_{i}' with the extension of the source.
+        probability, noise_scale, uniform, rng
+            See 'add_noise'.
+
+    Return the sets of the noised images of every variant and
+    the V x N x 3 translations of the images of every variant.
+    """
+
+    path_to_images = Path(path_to_images)
+    images = read_images_arrays(path_to_images)
+
+    masks, tvecs = noise_translations(
+        images.qvecs,
+        images.tvecs,
+        probability,
+        noise_scale,
+        uniform,
+        rng,
+        num_variants=num_variants,
+    )
+    keys = np.array(ImageRegistry(images.names, images.ids).keys, dtype=object)
+    noised = [set(keys[mask]) for mask in masks]
+
+    if not output_dir is None:
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for variant, variant_tvecs in enumerate(tvecs):
+            write_images_arrays(
+                images._replace(tvecs=variant_tvecs),
+                output_dir / f"images_{variant}{path_to_images.suffix}",
+            )
+
+    return noised, tvecs
@@ -0,0 +1,326 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def row_distances(points1: np.ndarray, points2: np.ndarray) -> np.ndarray:
+    """Row-wise distances, summed in the order of 'Poses.distance'."""
+
+    difference = (points2 - points1) ** 2
+    return np.sqrt(difference[..., 0] + difference[..., 1] + difference[..., 2])
+
+
+def nearest_neighbours(
+    positions: np.ndarray, k: int = 2, tree: Optional[cKDTree] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the k closest positions for every position.
+
+    One KD-tree is built over the N x 3 array of positions
+    and all positions are queried in one batch. The position
+    itself is excluded from its neighbours. Equally distant
+    positions are ordered like in the linear scan of
+    'Poses.find_nearest': the later row goes first.
+
+    Parameters
+    --------------
+        positions : np.ndarray
+            N x 3 array of camera positions.
+        k : int = 2
+            The number of neighbours.
+        tree : Optional[cKDTree] = None
+            The KD-tree built over the positions.
+            If it's None, the tree will be built.
+
+    Returns the N x k array of neighbour rows and
+    the N x k array of distances to them, both sorted
+    by distance.
+    """
+
+    positions = np.asarray(positions, dtype=np.float64)
+    num_positions = len(positions)
+    tree = cKDTree(positions) if tree is None else tree
+    k = min(k, num_positions - 1)
+    if k <= 0:
+        return (
+            np.zeros((num_positions, 0), dtype=np.int64),
+            np.zeros((num_positions, 0)),
+        )
+
+    # One more result than needed shows whether the k-th one is tied
+    # with the positions, which the tree didn't return
+    k_query = min(k + 2, num_positions)
+    _, rows = tree.query(positions, k=k_query, workers=-1)
+    rows = rows.reshape(num_positions, k_query)
+    own_rows = np.arange(num_positions)[:, None]
+    distances = row_distances(positions[:, None], positions[rows])
+
+    # The position itself is usually the first result. With duplicate
+    # positions it may be elsewhere or even out of the result.
+    distances[rows == own_rows] = np.inf
+    order = np.lexsort((-rows, distances), axis=1)
+    rows = np.take_along_axis(rows, order, axis=1)
+    distances = np.take_along_axis(distances, order, axis=1)
+
+    # The rows, whose k-th neighbour may be tied with the positions
+    # out of the result, are searched again with all tied positions
+    tied = np.flatnonzero(
+        (distances[:, k - 1] >= distances[:, k_query - 2] * (1 - 1e-9))
+        if k_query < num_positions
+        else np.zeros(num_positions, dtype=bool)
+    )
+    radii = distances[tied, k - 1] * (1 + 1e-9)
+    for row, near in zip(tied, tree.query_ball_point(positions[tied], radii)):
+        near = np.asarray([x for x in near if x != row], dtype=np.int64)
+        near_distances = row_distances(positions[row], positions[near])
+        near_order = np.lexsort((-near, near_distances))[:k]
+        rows[row, :k] = near[near_order]
+        distances[row, :k] = near_distances[near_order]
+
+    return rows[:, :k], distances[:, :k]
+
+
+class RowBuffer:
+    """Rows of an array with spare capacity at the end.
+
+    Appending m rows costs O(m) amortized: when the capacity runs
+    out, a new array of twice the size is allocated and the rows
+    are copied into it.
+    """
+
+    def __init__(self, array: np.ndarray):
+        self.data = np.asarray(array)
+        self.size = len(self.data)
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.data[: self.size]
+
+    def holds(self, array: np.ndarray) -> bool:
+        """True, if the array is the current rows of the buffer."""
+
+        return (
+            array.base is self.data
+            and len(array) == self.size
+            and array.ctypes.data == self.data.ctypes.data
+        )
+
+    def append(self, rows: np.ndarray) -> np.ndarray:
+        """Append the rows, return the rows of the buffer."""
+
+        rows = np.asarray(rows, dtype=self.data.dtype)
+        size = self.size + len(rows)
+        if size > len(self.data):
+            data = np.empty(
+                (max(size, 2 * len(self.data)),) + self.data.shape[1:],
+                dtype=self.data.dtype,
+            )
+            data[: self.size] = self.data[: self.size]
+            self.data = data
+        self.data[self.size : size] = rows
+        self.size = size
+        return self.rows
+
+
+def append_rows(owner, name: str, rows: np.ndarray):
+    """Append rows to the array attribute of the owner in O(len(rows)) amortized.
+
+    The buffers are kept in the '_buffers' dict of the owner. If
+    the attribute was replaced since the last append, a new buffer
+    is started from it.
+    """
+
+    array = getattr(owner, name)
+    buffers = owner.__dict__.setdefault("_buffers", {})
+    if not (name in buffers and buffers[name].holds(array)):
+        buffers[name] = RowBuffer(array)
+    setattr(owner, name, buffers[name].append(rows))
+
+
+class DynamicIndex:
+    """KD-tree over a growing set of positions.
+
+    Rebuilding a KD-tree after every small change costs as much
+    as the first build. Positions added or moved after the last
+    build are kept in a small delta, which is searched by brute
+    force, and their stale entries in the tree are skipped. The
+    tree is rebuilt once the delta exceeds rebuild_ratio of all
+    positions (but not before min_rebuild changes).
+    """
+
+    def __init__(
+        self,
+        positions: np.ndarray,
+        rebuild_ratio: float = 0.05,
+        min_rebuild: int = 256,
+    ):
+        self.positions = np.array(positions, dtype=np.float64).reshape(-1, 3)
+        self.rebuild_ratio = rebuild_ratio
+        self.min_rebuild = min_rebuild
+        self.rebuild()
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def rebuild(self):
+        """Build the tree over all positions and clear the delta."""
+
+        self.tree = cKDTree(self.positions)
+        self.num_tree = len(self.positions)
+        self.stale = np.zeros(self.num_tree, dtype=bool)
+        self.delta = np.empty(0, dtype=np.int64)
+        self._delta_tree = None
+
+    @property
+    def delta_tree(self) -> cKDTree:
+        """KD-tree over the delta, rebuilt after every change."""
+
+        if self._delta_tree is None:
+            self._delta_tree = cKDTree(self.positions[self.delta])
+        return self._delta_tree
+
+    def _changed(self, rows: np.ndarray) -> bool:
+        """Put the rows into the delta, return True if the tree was rebuilt."""
+
+        self.stale[rows[rows < self.num_tree]] = True
+        self.delta = np.union1d(self.delta, rows)
+        self._delta_tree = None
+        if len(self.delta) > max(self.min_rebuild, self.rebuild_ratio * len(self)):
+            self.rebuild()
+            return True
+        return False
+
+    def add(self, positions: np.ndarray) -> bool:
+        """Append positions, return True if the tree was rebuilt."""
+
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        rows = np.arange(len(self), len(self) + len(positions))
+        append_rows(self, "positions", positions)
+        return self._changed(rows)
+
+    def move(self, rows: np.ndarray, positions: np.ndarray) -> bool:
+        """Change the positions of the rows, return True if the tree was rebuilt."""
+
+        rows = np.asarray(rows, dtype=np.int64)
+        self.positions[rows] = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        return self._changed(rows)
+
+    @staticmethod
+    def _closest(
+        tree: cKDTree, points: np.ndarray, k: int, skip: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """k closest entries of the tree for every point, ignoring the skipped ones.
+
+        The missing results have infinite distances. The rows,
+        whose results contain skipped entries, are queried again
+        with twice as many results.
+        """
+
+        size = tree.n
+        rows = np.zeros((len(points), k), dtype=np.int64)
+        distances = np.full((len(points), k), np.inf)
+
+        pending = np.arange(len(points))
+        k_query = k
+        while len(pending) and size:
+            k_query = min(k_query, size)
+            found_distances, found = tree.query(points[pending], k=k_query, workers=-1)
+            found_distances = found_distances.reshape(len(pending), k_query)
+            found = found.reshape(len(pending), k_query)
+
+            found[found >= size] = 0
+            if skip is not None:
+                found_distances[skip[found]] = np.inf
+
+            order = np.argsort(found_distances, axis=1, kind="stable")[:, :k]
+            rows[pending, : order.shape[1]] = np.take_along_axis(found, order, axis=1)
+            distances[pending, : order.shape[1]] = np.take_along_axis(
+                found_distances, order, axis=1
+            )
+
+            if k_query == size:
+                break
+            pending = pending[~np.isfinite(distances[pending]).all(axis=1)]
+            k_query *= 2
+
+        return rows, distances
+
+    def query(self, rows: np.ndarray, k: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+        """k closest positions for the positions of the rows, excluding themselves.
+
+        Return the len(rows) x k arrays of neighbour rows and
+        distances, like 'nearest_neighbours'.
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        points = self.positions[rows]
+        k = min(k, len(self) - 1)
+
+        # The point itself may take a place in the results
+        tree_rows, tree_distances = self._closest(self.tree, points, k + 1, self.stale)
+        delta_rows, delta_distances = self._closest(self.delta_tree, points, k + 1)
+
+        if len(self.delta):
+            delta_rows = self.delta[delta_rows]
+        candidates = np.hstack([tree_rows, delta_rows])
+        distances = np.hstack([tree_distances, delta_distances])
+        distances[candidates == rows[:, None]] = np.inf
+
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return (
+            np.take_along_axis(candidates, order, axis=1),
+            np.take_along_axis(distances, order, axis=1),
+        )
+
+    def reverse_query(
+        self,
+        points: np.ndarray,
+        radii: np.ndarray,
+        ball_radius: Optional[float] = None,
+        large_rows: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Rows, which have any of the points within their radius.
+
+        These are the rows whose k closest positions may change,
+        if the points are added, when radii are the distances
+        to their k-th neighbours, or whose neighbours may have
+        been the points, if the points are the old positions of
+        moved rows.
+
+        The rows with radii up to ball_radius are found with a
+        ball query around the points, the large_rows (all rows with
+        larger radii) are checked directly. If they aren't given,
+        they are found from all radii (see 'radius_cut').
+        """
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        radii = np.asarray(radii, dtype=np.float64)
+        if len(points) == 0 or len(radii) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        if ball_radius is None:
+            ball_radius, large_rows = radius_cut(radii)
+        found = [np.asarray(large_rows, dtype=np.int64)]
+        for tree, tree_rows in ((self.tree, None), (self.delta_tree, self.delta)):
+            for near in tree.query_ball_point(points, ball_radius, workers=-1):
+                near = np.asarray(near, dtype=np.int64)
+                found.append(near if tree_rows is None else tree_rows[near])
+
+        candidates = np.unique(np.concatenate(found))
+        candidates = candidates[candidates < len(radii)]
+
+        # The radii are computed with 'Poses.row_distances', which may
+        # round differently, so the rows on the boundary are kept too
+        distances, _ = cKDTree(points).query(self.positions[candidates], k=1)
+        return candidates[distances <= radii[candidates] * (1 + 1e-9)]
+
+
+def radius_cut(radii: np.ndarray) -> Tuple[float, np.ndarray]:
+    """The ball radius of 'DynamicIndex.reverse_query' and the rows above it.
+
+    Rows with a typical radius are found with a ball query, the
+    few rows with large radii are checked directly.
+    """
+
+    ball_radius = 4 * float(np.median(radii)) if len(radii) else 0.0
+    return ball_radius, np.flatnonzero(radii > ball_radius)
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from utils.benchmark import make_images, make_points3D
+from utils.read_write_model import (
+    image_dict_to_arrays,
+    point_dict_to_arrays,
+    read_images_binary,
+    read_points3D_binary,
+    write_images_binary,
+    write_images_binary_arrays,
+    write_images_binary_bulk,
+    write_points3D_binary,
+    write_points3D_binary_arrays,
+    write_points3D_binary_bulk,
+)
+
+
+def images_with_empty(num_images: int, seed: int) -> dict:
+    """Random images, every third of them has no observations."""
+
+    images = make_images(num_images, points_per_image=7, seed=seed)
+    for key in list(images)[::3]:
+        images[key] = images[key]._replace(
+            xys=np.empty((0, 2)), point3D_ids=np.empty(0, dtype=np.int64)
+        )
+    return images
+
+
+@pytest.mark.parametrize("num_images", [1, 2, 10])
+def test_images_binary_writers_match_dict_writer(tmp_path, num_images):
+    images = images_with_empty(num_images, seed=num_images)
+
+    write_images_binary(images, tmp_path / "reference.bin")
+    write_images_binary_arrays(image_dict_to_arrays(images), tmp_path / "arrays.bin")
+    write_images_binary_bulk(images, tmp_path / "bulk.bin")
+
+    reference = (tmp_path / "reference.bin").read_bytes()
+    assert (tmp_path / "arrays.bin").read_bytes() == reference
+    assert (tmp_path / "bulk.bin").read_bytes() == reference
+
+    for key, image in read_images_binary(tmp_path / "arrays.bin").items():
+        for value, expected in zip(image, images[key]):
+            assert np.array_equal(value, expected)
+
+
+@pytest.mark.parametrize("num_points", [1, 2, 50])
+def test_points3D_binary_writers_match_dict_writer(tmp_path, num_points):
+    points3D = make_points3D(num_points, num_images=10, seed=num_points)
+
+    write_points3D_binary(points3D, tmp_path / "reference.bin")
+    write_points3D_binary_arrays(
+        point_dict_to_arrays(points3D), tmp_path / "arrays.bin"
+    )
+    write_points3D_binary_bulk(points3D, tmp_path / "bulk.bin")
+
+    reference = (tmp_path / "reference.bin").read_bytes()
+    assert (tmp_path / "arrays.bin").read_bytes() == reference
+    assert (tmp_path / "bulk.bin").read_bytes() == reference
+
+    for key, point in read_points3D_binary(tmp_path / "arrays.bin").items():
+        for value, expected in zip(point, points3D[key]):
+            assert np.array_equal(value, expected)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from poses_object import Poses
+from spatial_index import nearest_neighbours
+
+
+def linear_scan(positions: np.ndarray, row: int) -> tuple:
+    """Two closest rows of the row, found like the original 'Poses.find_nearest'."""
+
+    first = second = None
+    max_1 = max_2 = np.inf
+    for other, position in enumerate(positions):
+        if other == row:
+            continue
+        distance = np.sqrt(sum((position - positions[row]) ** 2))
+        if distance <= max_1:
+            max_2, max_1 = max_1, distance
+            second, first = first, other
+        elif distance <= max_2:
+            max_2, second = distance, other
+    return first, second
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_duplicated_positions_match_linear_scan(seed):
+    rng = np.random.default_rng(seed)
+    num_positions = int(rng.integers(3, 200))
+    positions = np.round(rng.normal(0, 3, (num_positions, 3)))
+    # Many exact duplicates and ties
+    positions[: num_positions // 3] = positions[0]
+
+    rows, distances = nearest_neighbours(positions, k=2)
+
+    for row in range(num_positions):
+        assert tuple(rows[row].tolist()) == linear_scan(positions, row)
+    assert np.array_equal(
+        distances, Poses.row_distances(positions[:, None], positions[rows])
+    )
+
+
+def test_find_nearest_matches_nearest_neighbours():
+    positions = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [1, 0, 0], [0, 0, 0.0]])
+    poses = Poses.__new__(Poses)
+    poses.set_poses([str(row) for row in range(len(positions))], positions)
+
+    rows, _ = nearest_neighbours(positions, k=2)
+
+    for row, image in enumerate(poses.images):
+        expected = tuple(poses.images[x] for x in rows[row])
+        assert poses.find_nearest((image, positions[row])) == expected
@@ -0,0 +1,231 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Optional, Tuple
+import contextlib
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class TileGrid:
+    """Partition of camera positions into cubic tiles.
+
+    Only the occupied tiles are kept. The rows of the
+    i-th tile are order[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(
+        self,
+        positions: np.ndarray,
+        tile_size: float,
+        origin: Optional[np.ndarray] = None,
+    ):
+        self.positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        self.tile_size = float(tile_size)
+        assert self.tile_size > 0, "The tile size must be positive."
+
+        self.origin = self.positions.min(axis=0) if origin is None else origin
+        cells = np.floor((self.positions - self.origin) / self.tile_size)
+        self.cells, tiles = np.unique(
+            cells.astype(np.int64), axis=0, return_inverse=True
+        )
+        self.tiles = tiles.reshape(-1)
+
+        self.order = np.argsort(self.tiles, kind="stable")
+        self.offsets = np.zeros(len(self.cells) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.tiles, minlength=len(self.cells)), out=self.offsets[1:]
+        )
+
+        self.lower = self.positions.min(axis=0)
+        self.upper = self.positions.max(axis=0)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def rows(self, tile: int) -> np.ndarray:
+        return self.order[self.offsets[tile] : self.offsets[tile + 1]]
+
+    def box(self, tile: int, margin: float) -> Tuple[np.ndarray, np.ndarray]:
+        """The tile extended by the margin.
+
+        The sides beyond all positions are open, since
+        there is nothing to search behind them.
+        """
+
+        lower = self.origin + self.cells[tile] * self.tile_size - margin
+        upper = lower + self.tile_size + 2 * margin
+        lower[lower <= self.lower] = -np.inf
+        upper[upper >= self.upper] = np.inf
+        return lower, upper
+
+    def rows_in_box(self, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+        """Rows of the positions inside the box."""
+
+        # Only the tiles overlapping the box are scanned
+        first = np.floor((lower - self.origin) / self.tile_size)
+        last = np.floor((upper - self.origin) / self.tile_size)
+        tiles = np.flatnonzero(
+            ((self.cells >= first) & (self.cells <= last)).all(axis=1)
+        )
+        rows = np.concatenate(
+            [np.empty(0, dtype=np.int64)] + [self.rows(tile) for tile in tiles]
+        )
+
+        inside = (
+            (self.positions[rows] >= lower) & (self.positions[rows] <= upper)
+        ).all(axis=1)
+        return rows[inside]
+
+    def task(
+        self, rows: np.ndarray, lower: np.ndarray, upper: np.ndarray, k: int
+    ) -> tuple:
+        """The neighbour search of the rows among the positions inside the box."""
+
+        candidates = self.rows_in_box(lower, upper)
+        return (
+            rows,
+            self.positions[rows],
+            candidates,
+            self.positions[candidates],
+            lower,
+            upper,
+            k,
+        )
+
+
+def tile_neighbours(task: tuple) -> tuple:
+    """Find the k closest candidates of the query positions.
+
+    The task is made by 'TileGrid.task', so a worker only
+    receives the positions of its tile and of the margin.
+    A query is resolved, if the ball of its k-th distance
+    lies inside the box of the candidates: no position
+    outside the box could be closer.
+
+    Return the query rows, the N x k neighbour rows and
+    distances and the mask of the resolved queries.
+    """
+
+    rows, points, candidate_rows, candidates, lower, upper, k = task
+
+    # A missing neighbour is reported with the index len(candidates)
+    distances, found = cKDTree(candidates).query(points, k=k + 1)
+    found = np.append(candidate_rows, -1)[found]
+
+    # Drop the position itself, or the last neighbour if a duplicate hides it
+    is_self = found == rows[:, None]
+    drop = np.where(is_self.any(axis=1), is_self.argmax(axis=1), k)
+    keep = np.arange(k + 1) != drop[:, None]
+    found = found[keep].reshape(-1, k)
+    distances = distances[keep].reshape(-1, k)
+
+    radius = distances[:, -1]
+    resolved = ((points - lower).min(axis=1) >= radius) & (
+        (upper - points).min(axis=1) >= radius
+    )
+    return rows, found, distances, resolved
+
+
+def tiled_neighbours(
+    positions: np.ndarray,
+    k: int = 2,
+    tile_size: float = 100.0,
+    margin: Optional[float] = None,
+    processes: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Find the k closest positions for every position tile by tile.
+
+    The positions are partitioned into cubic tiles and every
+    tile is searched in the pool of processes together with
+    the positions within the margin around it. The cameras near
+    the border, whose neighbours may lie behind the margin, are
+    searched again in the box, which contains all their possible
+    neighbours. So the result is the same as the one of
+    'spatial_index.nearest_neighbours' up to the order of ties.
+
+    Parameters
+    --------------
+        positions : np.ndarray
+            N x 3 array of camera positions.
+        k : int = 2
+            The number of neighbours.
+        tile_size : float = 100.0
+            The side of a tile in the units of the positions.
+        margin : Optional[float] = None
+            The overlap around every tile. If it's None,
+            a quarter of the tile size is used.
+        processes : Optional[int] = None
+            If it's given, tiles are searched in a pool
+            of processes, otherwise one by one.
+
+    Returns the N x k array of neighbour rows and
+    the N x k array of distances to them.
+    """
+
+    grid = TileGrid(positions, tile_size)
+    margin = grid.tile_size / 4 if margin is None else margin
+
+    neighbour_rows = np.full((len(grid.positions), k), -1, dtype=np.int64)
+    neighbour_distances = np.full((len(grid.positions), k), np.inf)
+
+    pool = ProcessPoolExecutor(processes) if processes else contextlib.nullcontext()
+    with pool:
+
+        def search(tasks: Iterable[tuple]) -> list:
+            if processes:
+                results = pool.map(tile_neighbours, tasks, chunksize=16)
+            else:
+                results = map(tile_neighbours, tasks)
+
+            unresolved = []
+            for rows, found, distances, resolved in results:
+                neighbour_rows[rows] = found
+                neighbour_distances[rows] = distances
+                if not resolved.all():
+                    unresolved.append(rows[~resolved])
+            return unresolved
+
+        unresolved = search(
+            grid.task(grid.rows(tile), *grid.box(tile, margin), k)
+            for tile in range(len(grid))
+        )
+
+        # The border cameras are searched within the balls of their k-th distances
+        tasks = []
+        for rows in unresolved:
+            points = grid.positions[rows]
+            radius = neighbour_distances[rows, -1:]
+            tasks.append(
+                grid.task(
+                    rows,
+                    (points - radius).min(axis=0),
+                    (points + radius).max(axis=0),
+                    k,
+                )
+            )
+        search(tasks)
+
+    return neighbour_rows, neighbour_distances
+
+
+def tile_statistics(
+    values: np.ndarray,
+    tiles: np.ndarray,
+    min_count: int = 1,
+    default: Tuple[float, float] = (np.nan, np.nan),
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The mean and the standard deviation of the values of every tile.
+
+    Return them for every value. The values of the tiles
+    with less than min_count values get the default ones.
+    """
+
+    counts = np.bincount(tiles)
+    sums = np.bincount(tiles, weights=values)
+    means = sums / np.maximum(counts, 1)
+    squares = np.bincount(tiles, weights=(values - means[tiles]) ** 2)
+    stds = np.sqrt(squares / np.maximum(counts, 1))
+
+    small = counts < min_count
+    means[small], stds[small] = default
+    return means[tiles], stds[tiles]
@@ -0,0 +1,548 @@
+"""
+utils.benchmark
+
+Throughput benchmarks of the reconstruction I/O and filtering routines
+on synthetic COLMAP models. Run from the 'cameras_filter' directory:
+
+    python -m utils.benchmark read_images --num_images 20000
+"""
+from typing import Callable, Tuple, Union
+from pathlib import Path
+import contextlib
+import tempfile
+import argparse
+import inspect
+import time
+import io
+import os
+
+import numpy as np
+
+from .read_write_model import (
+    Image,
+    Point3D,
+    read_image_poses_binary,
+    read_images_binary,
+    read_images_binary_bulk,
+    read_points3D_binary,
+    read_images_text,
+    read_points3D_text,
+    write_images_text,
+    write_points3D_text,
+    write_images_binary,
+    write_images_binary_bulk,
+    write_images_binary_subset,
+    write_points3D_binary,
+    write_points3D_binary_bulk,
+)
+from .mapped_points3D import MappedPoints3D
+from .pruning import prune_points
+from .text_model import (
+    read_images_text_bulk,
+    read_points3D_text_bulk,
+    write_images_text_bulk,
+    write_points3D_text_bulk,
+)
+from .quaternion_transform import (
+    add_vector,
+    add_vector_batch,
+    world_coordinates,
+    world_coordinates_batch,
+)
+from spatial_index import nearest_neighbours
+from tiling import tiled_neighbours
+from reconstruction_poses import Reconstruction
+from filter import CameraFilter
+
+PathLikeObject = Union[str, Path]
+
+
+def make_images(num_images: int, points_per_image: int = 500, seed: int = 0) -> dict:
+    """Generate a dict of random Image records."""
+
+    rng = np.random.default_rng(seed)
+    qvecs = rng.standard_normal((num_images, 4))
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    tvecs = rng.uniform(-100, 100, (num_images, 3))
+
+    images = {}
+    for i in range(num_images):
+        images[i + 1] = Image(
+            id=i + 1,
+            qvec=qvecs[i],
+            tvec=tvecs[i],
+            camera_id=1,
+            name=f"image_{i + 1:06d}.jpg",
+            xys=rng.uniform(0, 1920, (points_per_image, 2)),
+            point3D_ids=rng.integers(-1, 10 * num_images, points_per_image),
+        )
+    return images
+
+
+def make_points3D(
+    num_points: int, num_images: int = 1000, track_length: int = 5, seed: int = 0
+) -> dict:
+    """Generate a dict of random Point3D records."""
+
+    rng = np.random.default_rng(seed)
+    xyzs = rng.uniform(-100, 100, (num_points, 3))
+    rgbs = rng.integers(0, 256, (num_points, 3))
+    errors = rng.uniform(0, 2, num_points)
+    lengths = rng.integers(2, 2 * track_length, num_points)
+
+    points3D = {}
+    for i in range(num_points):
+        points3D[i + 1] = Point3D(
+            id=i + 1,
+            xyz=xyzs[i],
+            rgb=rgbs[i],
+            error=np.array(errors[i]),
+            image_ids=rng.integers(1, num_images + 1, lengths[i]),
+            point2D_idxs=rng.integers(0, 1000, lengths[i]),
+        )
+    return points3D
+
+
+def timeit(function: Callable, *args, repeat: int = 3) -> Tuple[float, object]:
+    """Return the best wall time of the function and its last result."""
+
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_read_images(
+    num_images: int = 10000, points_per_image: int = 500, repeat: int = 3
+):
+    """Compare read_images_binary with the bulk reader."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "images.bin"
+        write_images_binary_bulk(make_images(num_images, points_per_image), path)
+
+        size = path.stat().st_size / 2**20
+        print(f"images.bin: {num_images} images, {size:.1f} MB")
+
+        reference_time, reference = timeit(read_images_binary, path, repeat=repeat)
+        bulk_time, bulk = timeit(read_images_binary_bulk, path, repeat=repeat)
+        poses_time, poses = timeit(read_image_poses_binary, path, repeat=repeat)
+
+    assert poses.names == [image.name for image in reference.values()]
+    for key, image in reference.items():
+        assert image.name == bulk[key].name
+        assert np.array_equal(image.tvec, bulk[key].tvec)
+        assert np.array_equal(image.xys, bulk[key].xys)
+        assert np.array_equal(image.point3D_ids, bulk[key].point3D_ids)
+
+    print(
+        f"read_images_binary:      {reference_time:.3f} s ({size / reference_time:.1f} MB/s)"
+    )
+    print(f"read_images_binary_bulk: {bulk_time:.3f} s ({size / bulk_time:.1f} MB/s)")
+    print(f"read_image_poses_binary: {poses_time:.3f} s")
+    print(
+        f"Speedup: {reference_time / bulk_time:.1f}x (poses only: {reference_time / poses_time:.1f}x)"
+    )
+
+
+def benchmark_read_points3D(
+    num_images: int = 10000, points_per_image: int = 500, repeat: int = 3
+):
+    """Compare read_points3D_binary with the memory-mapped reader."""
+
+    num_points = num_images * points_per_image // 5
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "points3D.bin"
+        write_points3D_binary_bulk(make_points3D(num_points, num_images), path)
+
+        size = path.stat().st_size / 2**20
+        print(f"points3D.bin: {num_points} points, {size:.1f} MB")
+
+        def read_xyzs(path):
+            with MappedPoints3D(path) as points3D:
+                return points3D.xyzs()
+
+        def read_tracks(path):
+            with MappedPoints3D(path) as points3D:
+                return points3D.tracks()
+
+        reference_time, reference = timeit(read_points3D_binary, path, repeat=repeat)
+        xyzs_time, xyzs = timeit(read_xyzs, path, repeat=repeat)
+        tracks_time, tracks = timeit(read_tracks, path, repeat=repeat)
+
+    track_offsets, image_ids, _ = tracks
+    for row, point in enumerate(reference.values()):
+        assert np.array_equal(point.xyz, xyzs[row])
+        track = image_ids[track_offsets[row] : track_offsets[row + 1]]
+        assert np.array_equal(point.image_ids, track)
+
+    print(f"read_points3D_binary:   {reference_time:.3f} s")
+    print(f"MappedPoints3D.xyzs:    {xyzs_time:.3f} s")
+    print(f"MappedPoints3D.tracks:  {tracks_time:.3f} s")
+
+
+def benchmark_write(
+    num_images: int = 10000, points_per_image: int = 500, repeat: int = 3
+):
+    """Compare the images.bin and points3D.bin writers with the bulk ones.
+
+    The bulk output must be byte-identical to the reference output
+    and must read back into the same records.
+    """
+
+    images = make_images(num_images, points_per_image)
+    points3D = make_points3D(num_images * points_per_image // 5, num_images)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for name, records, reference_writer, bulk_writer, reader in (
+            (
+                "images.bin",
+                images,
+                write_images_binary,
+                write_images_binary_bulk,
+                read_images_binary,
+            ),
+            (
+                "points3D.bin",
+                points3D,
+                write_points3D_binary,
+                write_points3D_binary_bulk,
+                read_points3D_binary,
+            ),
+        ):
+            reference_path = tmp_dir / f"reference_{name}"
+            bulk_path = tmp_dir / f"bulk_{name}"
+
+            reference_time, _ = timeit(
+                reference_writer, records, reference_path, repeat=repeat
+            )
+            bulk_time, _ = timeit(bulk_writer, records, bulk_path, repeat=repeat)
+
+            assert reference_path.read_bytes() == bulk_path.read_bytes()
+            for key, record in reader(bulk_path).items():
+                for value, expected in zip(record, records[key]):
+                    assert np.array_equal(value, expected)
+
+            size = bulk_path.stat().st_size / 2**20
+            print(f"{name}: {len(records)} records, {size:.1f} MB, round trip is exact")
+            print(
+                f"  reference writer: {reference_time:.3f} s ({size / reference_time:.1f} MB/s)"
+            )
+            print(
+                f"  bulk writer:      {bulk_time:.3f} s ({size / bulk_time:.1f} MB/s)"
+            )
+
+
+def benchmark_text(
+    num_images: int = 10000, points_per_image: int = 500, repeat: int = 3
+):
+    """Compare the text readers and writers with the chunked ones."""
+
+    images = make_images(num_images, points_per_image)
+    points3D = make_points3D(num_images * points_per_image // 5, num_images)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        for name, records, writers, readers in (
+            (
+                "images.txt",
+                images,
+                (write_images_text, write_images_text_bulk),
+                (read_images_text, read_images_text_bulk),
+            ),
+            (
+                "points3D.txt",
+                points3D,
+                (write_points3D_text, write_points3D_text_bulk),
+                (read_points3D_text, read_points3D_text_bulk),
+            ),
+        ):
+            reference_path = tmp_dir / f"reference_{name}"
+            chunked_path = tmp_dir / f"chunked_{name}"
+
+            write_times = (
+                timeit(writers[0], records, reference_path, repeat=repeat)[0],
+                timeit(writers[1], records, chunked_path, repeat=repeat)[0],
+            )
+            assert reference_path.read_bytes() == chunked_path.read_bytes()
+
+            read_times = (
+                timeit(readers[0], reference_path, repeat=repeat)[0],
+                timeit(readers[1], reference_path, repeat=repeat)[0],
+            )
+            for key, record in readers[1](reference_path).items():
+                for value, expected in zip(record, records[key]):
+                    assert np.array_equal(value, expected)
+
+            size = reference_path.stat().st_size / 2**20
+            print(f"{name}: {len(records)} records, {size:.1f} MB")
+            print(f"  write: {write_times[0]:.3f} s -> {write_times[1]:.3f} s")
+            print(f"  read:  {read_times[0]:.3f} s -> {read_times[1]:.3f} s")
+
+
+def benchmark_subset(
+    num_images: int = 10000, points_per_image: int = 500, repeat: int = 3
+):
+    """Compare decoding and re-encoding of 90% of images.bin with the raw subset copy."""
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        path = tmp_dir / "images.bin"
+        images = make_images(num_images, points_per_image)
+        write_images_binary_bulk(images, path)
+        deleted = set(list(images)[::10])
+
+        def decode_encode(path, output):
+            subset = {
+                key: image
+                for key, image in read_images_binary_bulk(path).items()
+                if key not in deleted
+            }
+            write_images_binary_bulk(subset, output)
+
+        def copy_subset(path, output):
+            write_images_binary_subset(
+                path, output, lambda ids, names: ~np.isin(ids, list(deleted))
+            )
+
+        reference_time, _ = timeit(
+            decode_encode, path, tmp_dir / "a.bin", repeat=repeat
+        )
+        subset_time, _ = timeit(copy_subset, path, tmp_dir / "b.bin", repeat=repeat)
+        assert (tmp_dir / "a.bin").read_bytes() == (tmp_dir / "b.bin").read_bytes()
+
+    print(f"decode + encode: {reference_time:.3f} s")
+    print(f"subset copy:     {subset_time:.3f} s")
+
+
+def benchmark_neighbours(num_images: int = 1_000_000, repeat: int = 3):
+    """Scaling of the KD-tree neighbour search from 1k cameras to num_images.
+
+    Up to 5k cameras the result is compared with the brute force search.
+    """
+
+    rng = np.random.default_rng(0)
+    sizes = [1000]
+    while sizes[-1] * 10 <= num_images:
+        sizes.append(sizes[-1] * 10)
+
+    for size in sizes:
+        positions = rng.uniform(-100, 100, (size, 3))
+        tree_time, (rows, _) = timeit(nearest_neighbours, positions, repeat=repeat)
+
+        if size <= 5000:
+
+            def brute_force(positions):
+                distances = np.linalg.norm(
+                    positions[:, None] - positions[None], axis=-1
+                )
+                np.fill_diagonal(distances, np.inf)
+                return np.argsort(distances, axis=1)[:, :2]
+
+            brute_time, expected = timeit(brute_force, positions, repeat=repeat)
+            assert np.array_equal(rows, expected)
+            print(
+                f"{size:>8} cameras: KD-tree {tree_time:.3f} s, brute force {brute_time:.3f} s"
+            )
+        else:
+            print(f"{size:>8} cameras: KD-tree {tree_time:.3f} s")
+
+
+def benchmark_poses(num_images: int = 100_000, repeat: int = 3):
+    """Compare the per-image pose conversions with the batched ones."""
+
+    rng = np.random.default_rng(0)
+    qvecs = rng.standard_normal((num_images, 4))
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    tvecs = rng.uniform(-100, 100, (num_images, 3))
+    noise = rng.standard_normal((num_images, 3))
+
+    def centres(qvecs, tvecs):
+        return np.array(
+            [world_coordinates(qvec, tvec)[:, 0] for qvec, tvec in zip(qvecs, tvecs)]
+        )
+
+    def shifts(qvecs, tvecs, noise):
+        return np.array(
+            [
+                add_vector(qvec, tvec, addition[:, None])[:, 0]
+                for qvec, tvec, addition in zip(qvecs, tvecs, noise)
+            ]
+        )
+
+    for name, reference, batched, args in (
+        ("world_coordinates", centres, world_coordinates_batch, (qvecs, tvecs)),
+        ("add_vector", shifts, add_vector_batch, (qvecs, tvecs, noise)),
+    ):
+        reference_time, expected = timeit(reference, *args, repeat=repeat)
+        batch_time, result = timeit(batched, *args, repeat=repeat)
+        assert np.array_equal(result, expected)
+        print(
+            f"{name}: {num_images} poses, {reference_time:.3f} s -> {batch_time:.3f} s"
+        )
+
+
+def benchmark_incremental(num_images: int = 1_000_000, repeat: int = 3):
+    """Compare filtering from scratch with the incremental update
+    after 300 new images were registered.
+    """
+
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-100, 100, (num_images, 3))
+    images = [str(image) for image in range(num_images)]
+    num_old = num_images - 300
+
+    def reconstruction(images, positions):
+        reconst = Reconstruction.__new__(Reconstruction)
+        reconst.set_poses(images, positions)
+        return reconst
+
+    def from_scratch(images, positions):
+        return CameraFilter(reconstruction(images, positions)).filter()
+
+    def incremental(camera_filter, images, positions):
+        return camera_filter.add_images(images, positions)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        scratch_time, expected = timeit(from_scratch, images, positions, repeat=repeat)
+
+        update_time = np.inf
+        for _ in range(repeat):
+            camera_filter = CameraFilter(
+                reconstruction(images[:num_old], positions[:num_old])
+            )
+            camera_filter.filter()
+            run_time, result = timeit(
+                incremental,
+                camera_filter,
+                images[num_old:],
+                positions[num_old:],
+                repeat=1,
+            )
+            update_time = min(update_time, run_time)
+
+    assert result == expected
+    print(f"{num_images} images, 300 new")
+    print(f"from scratch: {scratch_time:.3f} s")
+    print(f"incremental:  {update_time:.3f} s")
+
+
+def benchmark_tiled(num_images: int = 1_000_000, repeat: int = 3):
+    """Compare the neighbour search over the whole model with the tiled
+    search in 1, 2, 4 ... processes up to the number of cores.
+    """
+
+    rng = np.random.default_rng(0)
+    # A flat city block of about 10 cameras per 10 x 10 m
+    side = 10 * np.sqrt(num_images / 10)
+    positions = rng.uniform(0, 1, (num_images, 3)) * [side, side, 30]
+    tile_size = side / 8
+
+    global_time, (_, expected) = timeit(nearest_neighbours, positions, repeat=repeat)
+    print(f"{num_images} cameras, {tile_size:.0f} m tiles")
+    print(f"whole model: {global_time:.3f} s")
+
+    processes = 1
+    while processes <= max(os.cpu_count() or 1, 1):
+        tiled_time, (_, distances) = timeit(
+            tiled_neighbours,
+            positions,
+            2,
+            tile_size,
+            None,
+            processes,
+            repeat=repeat,
+        )
+        assert np.allclose(distances, expected)
+        print(f"tiled, {processes} processes: {tiled_time:.3f} s")
+        processes *= 2
+
+
+def benchmark_delete_points(
+    num_images: int = 1000, points_per_image: int = 500, repeat: int = 3
+):
+    """Compare the per-point track check of points3D.bin with the vectorized
+    pruning after 10% of images were deleted.
+    """
+
+    num_points = num_images * points_per_image // 5
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        images = make_images(num_images, 0)
+        for key in list(images)[::10]:
+            del images[key]
+        write_images_binary_bulk(images, tmp_dir / "images.bin")
+        write_points3D_binary_bulk(
+            make_points3D(num_points, num_images), tmp_dir / "points3D.bin"
+        )
+
+        def per_point(path_to_images, path_to_points, output):
+            image_ids = read_images_binary_bulk(path_to_images).keys()
+            points = {
+                key: value
+                for key, value in read_points3D_binary(path_to_points).items()
+                if not any([id not in image_ids for id in value[4]])
+            }
+            write_points3D_binary_bulk(points, output)
+
+        reference_time, _ = timeit(
+            per_point,
+            tmp_dir / "images.bin",
+            tmp_dir / "points3D.bin",
+            tmp_dir / "a.bin",
+            repeat=repeat,
+        )
+        prune_time, _ = timeit(
+            prune_points,
+            tmp_dir / "images.bin",
+            tmp_dir / "points3D.bin",
+            tmp_dir / "b.bin",
+            repeat=repeat,
+        )
+        assert (tmp_dir / "a.bin").read_bytes() == (tmp_dir / "b.bin").read_bytes()
+
+    print(f"{num_points} points")
+    print(f"per point:  {reference_time:.3f} s")
+    print(f"vectorized: {prune_time:.3f} s")
+
+
+BENCHMARKS = {
+    "read_images": benchmark_read_images,
+    "read_points3D": benchmark_read_points3D,
+    "write": benchmark_write,
+    "text": benchmark_text,
+    "subset": benchmark_subset,
+    "neighbours": benchmark_neighbours,
+    "poses": benchmark_poses,
+    "incremental": benchmark_incremental,
+    "tiled": benchmark_tiled,
+    "delete_points": benchmark_delete_points,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run I/O benchmarks")
+
+    parser.add_argument("benchmark", type=str, choices=list(BENCHMARKS))
+    # Every benchmark has its own defaults, e.g. the scaling ones run up to 1M images
+    parser.add_argument("--num_images", type=int, default=None)
+    parser.add_argument("--points_per_image", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=None)
+
+    args = parser.parse_args()
+
+    benchmark = BENCHMARKS[args.benchmark]
+    # Pass only the given options the benchmark accepts
+    parameters = inspect.signature(benchmark).parameters
+    benchmark(
+        **{
+            key: value
+            for key, value in vars(args).items()
+            if key in parameters and value is not None
+        }
+    )
@@ -7,7 +7,7 @@ import pycolmap
 import plotly.graph_objects as go
 
 from .viz_3d import init_figure, plot_reconstruction, plot_camera_colmap
-from .read_write_model import read_images_binary, read_images_text
+from .read_write_model import read_images_binary_bulk, read_images_text
 
 String_Path = Union[str, Path]
 
@@ -31,7 +31,7 @@ def visualize_cameras(
 ) -> go.Figure:
 
     read_method = (
-        read_images_binary
+        read_images_binary_bulk
         if str(wrong_images_path).endswith(".bin")
         else read_images_text
     )
@@ -0,0 +1,379 @@
+"""
+utils.columnar_model
+
+This module provides a columnar (struct-of-arrays) representation
+of a COLMAP sparse model and vectorized operations on it.
+"""
+from typing import Tuple, Union
+from pathlib import Path
+import os
+
+import numpy as np
+
+from .read_write_model import (
+    CameraArrays,
+    ImageArrays,
+    Point3DArrays,
+    camera_arrays_to_dict,
+    camera_dict_to_arrays,
+    image_arrays_to_dict,
+    image_dict_to_arrays,
+    point_arrays_to_dict,
+    point_dict_to_arrays,
+    detect_model_format,
+    read_cameras_binary,
+    read_cameras_text,
+    read_images_binary_arrays,
+    write_cameras_binary,
+    write_images_binary_arrays,
+    write_cameras_text,
+    write_points3D_binary_arrays,
+)
+from .text_model import (
+    read_images_text_arrays,
+    read_points3D_text_arrays,
+    write_images_text_arrays,
+    write_points3D_text_arrays,
+)
+from .mapped_points3D import MappedPoints3D
+
+PathLikeObject = Union[str, Path]
+
+
+def csr_take(offsets: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Select rows of a CSR (offsets + values) layout.
+
+    Return the offsets of the selected rows and the indices
+    of their elements in the values array.
+    """
+
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+
+    new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+
+    elements = np.arange(new_offsets[-1], dtype=np.int64) + np.repeat(
+        starts - new_offsets[:-1], lengths
+    )
+    return new_offsets, elements
+
+
+def csr_all(mask: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Reduce the mask of the CSR elements per row with logical and.
+
+    Empty rows are True.
+    """
+
+    lengths = np.diff(offsets)
+    result = np.ones(len(lengths), dtype=bool)
+    nonempty = lengths > 0
+    if nonempty.any():
+        # Empty rows add no elements between the starts of the others
+        result[nonempty] = np.logical_and.reduceat(mask, offsets[:-1][nonempty])
+    return result
+
+
+def lookup_rows(keys: np.ndarray, query) -> np.ndarray:
+    """Find the rows of the query values in the keys array, -1 if missing."""
+
+    query = np.asarray(query, dtype=np.int64)
+    if len(keys) == 0:
+        return np.full(query.shape, -1, dtype=np.int64)
+
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    position = np.minimum(np.searchsorted(sorted_keys, query), len(keys) - 1)
+    return np.where(sorted_keys[position] == query, order[position], -1)
+
+
+def _as_rows(selection, size: int) -> np.ndarray:
+    """Convert a boolean mask or a sequence of rows into rows."""
+
+    selection = np.asarray(selection)
+    if selection.dtype == bool:
+        assert len(selection) == size, "The mask doesn't match the number of rows."
+        return np.flatnonzero(selection)
+    return selection.astype(np.int64).reshape(-1)
+
+
+def take_images(images: ImageArrays, selection) -> ImageArrays:
+    """The selected images, a boolean mask or a sequence of rows."""
+
+    rows = _as_rows(selection, len(images.ids))
+    point2D_offsets, elements = csr_take(images.point2D_offsets, rows)
+
+    return ImageArrays(
+        ids=images.ids[rows],
+        qvecs=images.qvecs[rows],
+        tvecs=images.tvecs[rows],
+        camera_ids=images.camera_ids[rows],
+        names=[images.names[row] for row in rows.tolist()],
+        point2D_offsets=point2D_offsets,
+        xys=images.xys[elements],
+        point3D_ids=images.point3D_ids[elements],
+    )
+
+
+def take_points(points3D: Point3DArrays, selection) -> Point3DArrays:
+    """The selected 3D points, a boolean mask or a sequence of rows."""
+
+    rows = _as_rows(selection, len(points3D.ids))
+    track_offsets, elements = csr_take(points3D.track_offsets, rows)
+
+    return Point3DArrays(
+        ids=points3D.ids[rows],
+        xyzs=points3D.xyzs[rows],
+        rgbs=points3D.rgbs[rows],
+        errors=points3D.errors[rows],
+        track_offsets=track_offsets,
+        image_ids=points3D.image_ids[elements],
+        point2D_idxs=points3D.point2D_idxs[elements],
+    )
+
+
+class ColumnarModel:
+    """COLMAP sparse model stored as contiguous NumPy arrays.
+
+    Cameras, images and 3D points are kept as CameraArrays,
+    ImageArrays and Point3DArrays. The per-image observations
+    and the per-point tracks use the CSR layout: the values of
+    the i-th row are values[offsets[i]:offsets[i + 1]].
+
+    The model is converted to and from the dicts of namedtuples
+    used by 'read_write_model', so the modules can work with
+    either representation.
+    """
+
+    def __init__(
+        self, cameras: CameraArrays, images: ImageArrays, points3D: Point3DArrays
+    ):
+        self.cameras = cameras
+        self.images = images
+        self.points3D = points3D
+
+    @classmethod
+    def from_dicts(cls, cameras: dict, images: dict, points3D: dict):
+        """Construct the model from the 'read_model' output."""
+        return cls(
+            camera_dict_to_arrays(cameras),
+            image_dict_to_arrays(images),
+            point_dict_to_arrays(points3D),
+        )
+
+    def to_dicts(self) -> Tuple[dict, dict, dict]:
+        """Convert the model into the 'read_model' output."""
+        return (
+            camera_arrays_to_dict(self.cameras),
+            image_arrays_to_dict(self.images),
+            point_arrays_to_dict(self.points3D),
+        )
+
+    @classmethod
+    def read(cls, path: PathLikeObject, ext: str = ""):
+        """Read the sparse model directory.
+
+        Parameters
+        --------------
+            path : PathLikeObject
+                The sparse reconstruction directory.
+            ext : str = ""
+                '.bin' or '.txt'. If it's empty,
+                the format is detected automatically.
+        """
+
+        if ext == "":
+            ext = ".bin" if detect_model_format(path, ".bin") else ".txt"
+
+        if ext == ".txt":
+            cameras = read_cameras_text(os.path.join(path, "cameras.txt"))
+            images = read_images_text_arrays(os.path.join(path, "images.txt"))
+            points3D = read_points3D_text_arrays(os.path.join(path, "points3D.txt"))
+        else:
+            cameras = read_cameras_binary(os.path.join(path, "cameras.bin"))
+            images = read_images_binary_arrays(os.path.join(path, "images.bin"))
+            with MappedPoints3D(os.path.join(path, "points3D.bin")) as mapped:
+                points3D = mapped.to_arrays()
+
+        return cls(camera_dict_to_arrays(cameras), images, points3D)
+
+    def write(self, path: PathLikeObject, ext: str = ".bin"):
+        """Write the model into the sparse model directory."""
+
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+        if ext == ".txt":
+            write_cameras_text(
+                camera_arrays_to_dict(self.cameras), os.path.join(path, "cameras.txt")
+            )
+            write_images_text_arrays(self.images, os.path.join(path, "images.txt"))
+            write_points3D_text_arrays(
+                self.points3D, os.path.join(path, "points3D.txt")
+            )
+            return
+
+        write_cameras_binary(
+            camera_arrays_to_dict(self.cameras), os.path.join(path, "cameras.bin")
+        )
+        write_images_binary_arrays(self.images, os.path.join(path, "images.bin"))
+        write_points3D_binary_arrays(self.points3D, os.path.join(path, "points3D.bin"))
+
+    @property
+    def num_cameras(self) -> int:
+        return len(self.cameras.ids)
+
+    @property
+    def num_images(self) -> int:
+        return len(self.images.ids)
+
+    @property
+    def num_points3D(self) -> int:
+        return len(self.points3D.ids)
+
+    def camera_rows(self, camera_ids) -> np.ndarray:
+        return lookup_rows(self.cameras.ids, camera_ids)
+
+    def image_rows(self, image_ids) -> np.ndarray:
+        return lookup_rows(self.images.ids, image_ids)
+
+    def point_rows(self, point3D_ids) -> np.ndarray:
+        return lookup_rows(self.points3D.ids, point3D_ids)
+
+    def images_mask(self, image_ids) -> np.ndarray:
+        """Boolean mask of the images with the given ids."""
+        return np.isin(self.images.ids, np.asarray(image_ids, dtype=np.int64))
+
+    def points_mask(self, point3D_ids) -> np.ndarray:
+        """Boolean mask of the points with the given ids."""
+        return np.isin(self.points3D.ids, np.asarray(point3D_ids, dtype=np.int64))
+
+    def observation_point_rows(self) -> np.ndarray:
+        """Join the 2D observations with the 3D points.
+
+        Return the point row of every observation,
+        -1 if it has no (or a missing) 3D point.
+        """
+
+        point3D_ids = self.images.point3D_ids
+        rows = np.full(len(point3D_ids), -1, dtype=np.int64)
+        triangulated = point3D_ids >= 0
+        rows[triangulated] = self.point_rows(point3D_ids[triangulated])
+        return rows
+
+    def track_image_rows(self) -> np.ndarray:
+        """Join the track elements with the images.
+
+        Return the image row of every track element, -1 if
+        the image is not in the model.
+        """
+        return self.image_rows(self.points3D.image_ids)
+
+    def select_images(self, selection) -> "ColumnarModel":
+        """Model with the selected images only.
+
+        The selection is a boolean mask or a sequence of rows.
+        Cameras and points are shared with this model.
+        """
+
+        subset = take_images(self.images, selection)
+        return ColumnarModel(self.cameras, subset, self.points3D)
+
+    def select_points(self, selection) -> "ColumnarModel":
+        """Model with the selected 3D points only.
+
+        The selection is a boolean mask or a sequence of rows.
+        Cameras and images are shared with this model.
+        """
+
+        subset = take_points(self.points3D, selection)
+        return ColumnarModel(self.cameras, self.images, subset)
+
+    def select_track_elements(self, kept_elements: np.ndarray) -> "ColumnarModel":
+        """Model with the selected track elements only.
+
+        The points left without track elements are dropped, the
+        2D points of the images are not changed (see 'drop_missing_points').
+        """
+
+        points3D = self.points3D
+        track_rows = np.repeat(
+            np.arange(self.num_points3D), np.diff(points3D.track_offsets)
+        )
+        lengths = np.bincount(track_rows[kept_elements], minlength=self.num_points3D)
+        kept_points = lengths > 0
+        track_offsets = np.zeros(int(kept_points.sum()) + 1, dtype=np.int64)
+        np.cumsum(lengths[kept_points], out=track_offsets[1:])
+
+        subset = Point3DArrays(
+            ids=points3D.ids[kept_points],
+            xyzs=points3D.xyzs[kept_points],
+            rgbs=points3D.rgbs[kept_points],
+            errors=points3D.errors[kept_points],
+            track_offsets=track_offsets,
+            image_ids=points3D.image_ids[kept_elements],
+            point2D_idxs=points3D.point2D_idxs[kept_elements],
+        )
+        return ColumnarModel(self.cameras, self.images, subset)
+
+    def drop_missing_points(self) -> "ColumnarModel":
+        """Model, whose 2D points refer to the missing 3D points with -1."""
+
+        point3D_ids = np.where(
+            self.observation_point_rows() >= 0, self.images.point3D_ids, -1
+        )
+        images = self.images._replace(point3D_ids=point3D_ids)
+        return ColumnarModel(self.cameras, images, self.points3D)
+
+    def select_cameras(self, selection) -> "ColumnarModel":
+        """Model with the selected cameras only.
+
+        The selection is a boolean mask or a sequence of rows.
+        Images and points are shared with this model.
+        """
+
+        cameras = self.cameras
+        rows = _as_rows(selection, len(cameras.ids))
+        param_offsets, elements = csr_take(cameras.param_offsets, rows)
+
+        subset = CameraArrays(
+            ids=cameras.ids[rows],
+            model_ids=cameras.model_ids[rows],
+            widths=cameras.widths[rows],
+            heights=cameras.heights[rows],
+            param_offsets=param_offsets,
+            params=cameras.params[elements],
+        )
+        return ColumnarModel(subset, self.images, self.points3D)
+
+    def compact(self) -> "ColumnarModel":
+        """Model with the dense ids 1..N of the cameras, the images and the points.
+
+        The cameras, which no image refers to, are dropped. The ids
+        keep the order of the rows, the references between the parts
+        are remapped with one sorted lookup per part. The model must
+        be consistent (see 'utils.pruning.prune_model'): the references
+        to the missing points become -1.
+        """
+
+        model = self.select_cameras(np.isin(self.cameras.ids, self.images.camera_ids))
+
+        # The row of an old id plus one is its new id
+        point3D_ids = model.images.point3D_ids.copy()
+        triangulated = point3D_ids >= 0
+        rows = model.point_rows(point3D_ids[triangulated])
+        point3D_ids[triangulated] = np.where(rows >= 0, rows + 1, -1)
+
+        cameras = model.cameras._replace(
+            ids=np.arange(1, model.num_cameras + 1, dtype=np.int64)
+        )
+        images = model.images._replace(
+            ids=np.arange(1, model.num_images + 1, dtype=np.int64),
+            camera_ids=model.camera_rows(model.images.camera_ids) + 1,
+            point3D_ids=point3D_ids,
+        )
+        points3D = model.points3D._replace(
+            ids=np.arange(1, model.num_points3D + 1, dtype=np.int64),
+            image_ids=model.image_rows(model.points3D.image_ids) + 1,
+        )
+        return ColumnarModel(cameras, images, points3D)
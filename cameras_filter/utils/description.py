@@ -0,0 +1,272 @@
+"""
+utils.description
+
+This module provides a streaming reader of the Augmented City
+'description.json' files. Only the style of every passage and the
+filename and the position of every camera are extracted, the rest
+of the document (e.g. per-camera metadata) is skipped without being
+decoded, so memory doesn't scale with the size of the JSON tree.
+"""
+from typing import Iterator, Optional, Sequence, Union, IO
+from pathlib import Path
+import collections
+import json
+import re
+
+import numpy as np
+
+PathLikeObject = Union[str, Path]
+
+# Passages of the description file as arrays. The cameras of the
+# i-th passage are names[offsets[i]:offsets[i + 1]] (a list of the
+# filenames). Positions of the cameras without a position are NaN.
+PassageArrays = collections.namedtuple(
+    "PassageArrays", ["passage_ids", "styles", "offsets", "names", "positions"]
+)
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+STRUCTURE = re.compile(r'["\[\]{}]')
+STRING_TAIL = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+_decoder = json.JSONDecoder()
+
+
+class JsonStream:
+    """Pull reader of a JSON document.
+
+    The document is read in chunks. Containers are walked with
+    iter_object and iter_array, which stop before every value.
+    The value must then be consumed with read_value (decoded),
+    skip_value (scanned, never decoded) or another iteration.
+    """
+
+    def __init__(self, fid: IO[str], chunk_size: int = 1 << 20):
+        self.fid = fid
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        """Read the next chunk, return False at the end of the file."""
+
+        chunk = self.fid.read(self.chunk_size)
+        if not chunk:
+            return False
+        # The consumed part of the buffer is dropped
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character."""
+
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of the JSON document.")
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}', found '{found}'.")
+        self.pos += 1
+
+    def read_value(self):
+        """Decode the next value."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value may continue in the next chunk
+                if self._fill():
+                    continue
+                raise
+            if end == len(self.buffer) and self._fill():
+                # So may a number
+                continue
+            self.pos = end
+            return value
+
+    def skip_value(self):
+        """Move past the next value without decoding it."""
+
+        if self.peek() not in '"[{':
+            self.read_value()
+            return
+
+        depth = 0
+        while True:
+            match = STRUCTURE.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self._fill():
+                    raise ValueError("Unexpected end of the JSON document.")
+                continue
+
+            self.pos = match.end()
+            char = match.group()
+            if char == '"':
+                self._skip_string_tail()
+            elif char in "[{":
+                depth += 1
+            else:
+                depth -= 1
+            if depth == 0:
+                return
+
+    def _skip_string_tail(self):
+        while True:
+            match = STRING_TAIL.match(self.buffer, self.pos)
+            if match is not None:
+                self.pos = match.end()
+                return
+            if not self._fill():
+                raise ValueError("Unexpected end of the JSON document.")
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of the next object."""
+
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or '}}', found '{char}'.")
+
+    def iter_array(self) -> Iterator[int]:
+        """Yield the indices of the elements of the next array."""
+
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+
+        index = 0
+        while True:
+            yield index
+            index += 1
+
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']', found '{char}'.")
+
+
+def _read_camera(stream: JsonStream) -> tuple:
+    """Read the filename and the camera.pose.position of a camera."""
+
+    filename = None
+    position = (np.nan, np.nan, np.nan)
+
+    for key in stream.iter_object():
+        if key == "filename":
+            filename = stream.read_value()
+        elif key == "camera" and stream.peek() == "{":
+            for key in stream.iter_object():
+                if key == "pose" and stream.peek() == "{":
+                    for key in stream.iter_object():
+                        if key == "position":
+                            value = stream.read_value()
+                            position = (value["x"], value["y"], value["z"])
+                        else:
+                            stream.skip_value()
+                else:
+                    stream.skip_value()
+        else:
+            stream.skip_value()
+
+    return filename, position
+
+
+def _read_passage(stream: JsonStream, names: list, positions: list) -> str:
+    """Read the cameras of a passage, return its style."""
+
+    style = ""
+    for key in stream.iter_object():
+        if key == "style":
+            style = stream.read_value()
+        elif key == "points":
+            for _ in stream.iter_array():
+                for _ in stream.iter_array():
+                    filename, position = _read_camera(stream)
+                    names.append(filename)
+                    positions.append(position)
+        else:
+            stream.skip_value()
+    return style
+
+
+def iter_passages(
+    path_to_description: PathLikeObject,
+    passage_ids: Optional[Sequence[int]] = None,
+) -> Iterator[tuple]:
+    """Stream the passages of the description file.
+
+    Yield the id, the style, the camera filenames and the N x 3
+    camera positions of every passage (of passage_ids only, if
+    it's given; the other passages are skipped).
+    """
+
+    selected = None if passage_ids is None else set(passage_ids)
+
+    with open(path_to_description, "r") as fid:
+        stream = JsonStream(fid)
+        for key in stream.iter_object():
+            if key != "passages":
+                stream.skip_value()
+                continue
+
+            for passage_id in stream.iter_array():
+                if selected is not None and passage_id not in selected:
+                    stream.skip_value()
+                    continue
+
+                names, positions = [], []
+                style = _read_passage(stream, names, positions)
+                yield (
+                    passage_id,
+                    style,
+                    names,
+                    np.array(positions, dtype=np.float64).reshape(-1, 3),
+                )
+
+
+def read_description_arrays(path_to_description: PathLikeObject) -> PassageArrays:
+    """Read all passages of the description file into PassageArrays."""
+
+    passage_ids, styles, lengths, names, positions = [], [], [], [], []
+    for passage_id, style, passage_names, passage_positions in iter_passages(
+        path_to_description
+    ):
+        passage_ids.append(passage_id)
+        styles.append(style)
+        lengths.append(len(passage_names))
+        names.extend(passage_names)
+        positions.append(passage_positions)
+
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    return PassageArrays(
+        passage_ids=np.array(passage_ids, dtype=np.int64),
+        styles=np.array(styles, dtype=str),
+        offsets=offsets,
+        names=names,
+        positions=(np.concatenate(positions) if positions else np.empty((0, 3))),
+    )
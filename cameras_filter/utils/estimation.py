@@ -14,8 +14,10 @@ import os
 # sys.path.append("../")
 
 from sample_generation import add_noise
-from main import main as run_filter
-from data_manipulations import main as extract
+from data_manipulations import select_images
+from passage_poses import Passage, read_passages
+from reconstruction_poses import Reconstruction
+from filter import CameraFilter
 
 PathLikeObject = Union[str, Path]
 
@@ -60,6 +62,7 @@ def main(
     noised_data_proportion: float = 0.15,
     noise_scale: float = 1,
     uniform: bool = True,
+    seed: Optional[int] = None,
 ):
     """Evaluate the algorithm using 3 popular ML quality metrics.
 
@@ -95,6 +98,9 @@ def main(
             Determines the type of noise. If it's
             True, the noise variable will have
             uniform distribution, else - normal.
+        seed: Optional[int] = None
+            The seed of the noise. The same seed
+            gives the same tests on every run.
     """
 
     prec = []
@@ -103,6 +109,12 @@ def main(
 
     passages = range(number_of_passages) if number_of_passages else [None]
 
+    # One generator for all tests, so the tests are independent
+    rng = np.random.default_rng(seed)
+
+    # The description file is parsed once for all tests
+    passages_data = read_passages(description_file)
+
     for i in range(number_of_tests):
         for passage_id in range(number_of_passages):
 
@@ -110,11 +122,10 @@ def main(
                 str(Path(images_path).parent / Path(images_path).stem) + "_sampled.bin"
             )
 
-            extract(
+            select_images(
                 reconst_images_path=images_path,
-                description_file=description_file,
+                image_subset=set(passages_data[passage_id].images),
                 output_file=images_subset,
-                selected_passage=passage_id,
             )
 
             noised, images_subset = add_noise(
@@ -123,14 +134,14 @@ def main(
                 probability=noised_data_proportion,
                 noise_scale=noise_scale,
                 uniform=uniform,
+                rng=rng,
             )
 
-            filtering_result = run_filter(
-                images_path=images_subset,
-                description_file=description_file if with_passage else None,
-                softness=algorithm_softness,
-                selected_passage=passage_id,
-            )["camera_filter"]
+            filtering_result = CameraFilter(
+                Reconstruction(images_subset),
+                Passage.from_data(passages_data[passage_id]) if with_passage else None,
+            )
+            filtering_result.filter(softness=algorithm_softness)
 
             result = score_points(filtering_result.cameras_filter, noised)
 
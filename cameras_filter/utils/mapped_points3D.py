@@ -0,0 +1,192 @@
+"""
+utils.mapped_points3D
+
+This module provides a memory-mapped, lazily decoded
+reader of the COLMAP 'points3D.bin' file.
+"""
+from typing import Optional, Tuple, Union
+from pathlib import Path
+import mmap
+
+import numpy as np
+
+from .read_write_model import (
+    Point3D,
+    Point3DArrays,
+    point_arrays_to_dict,
+    scan_points3D_binary,
+    POINT3D_HEADER_DTYPE,
+    POINT3D_TRACK_DTYPE,
+)
+
+PathLikeObject = Union[str, Path]
+
+
+class MappedPoints3D:
+    """Memory-mapped 'points3D.bin' file.
+
+    Opening the file only builds a compact index: the byte offset
+    and the track length of every point. Records are decoded on
+    access, either one by one (reader[point3D_id]) or as columnar
+    arrays of the requested fields, so the tools that only need
+    'xyz' or only tracks never decode the rest of the file.
+
+    The reader should be closed after use, e.g.:
+
+        with MappedPoints3D("sparse/points3D.bin") as points3D:
+            xyzs = points3D.xyzs()
+    """
+
+    # Number of records gathered at once by the columnar accessors
+    chunk_size = 1 << 20
+
+    def __init__(self, path_to_model_file: PathLikeObject):
+        self.path = Path(path_to_model_file)
+        self._file = open(self.path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.offsets, self.track_lengths = scan_points3D_binary(self._buffer)
+        self.ids = self._gather("id").astype(np.int64)
+        # Sorted ids for the id -> row lookups
+        self._order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._order]
+
+    def _gather(self, field: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Decode one fixed-size field of the selected records."""
+
+        dtype, shift = POINT3D_HEADER_DTYPE.fields[field][:2]
+        offsets = self.offsets if rows is None else self.offsets[rows]
+        byte_range = np.arange(shift, shift + dtype.itemsize)
+
+        result = np.empty((len(offsets),) + dtype.shape, dtype=dtype.base)
+        raw = np.frombuffer(self._buffer, dtype=np.uint8)
+        try:
+            for start in range(0, len(offsets), self.chunk_size):
+                chunk = offsets[start : start + self.chunk_size]
+                result[start : start + len(chunk)] = (
+                    raw[chunk[:, None] + byte_range]
+                    .view(dtype.base)
+                    .reshape((len(chunk),) + dtype.shape)
+                )
+        finally:
+            # The mmap can't be closed while the array exports its buffer
+            del raw
+
+        return result
+
+    def rows(self, point3D_ids) -> np.ndarray:
+        """Convert point ids into row numbers, -1 for missing ids."""
+
+        point3D_ids = np.asarray(point3D_ids, dtype=np.int64)
+        if len(self._sorted_ids) == 0:
+            return np.full(point3D_ids.shape, -1, dtype=np.int64)
+        position = np.searchsorted(self._sorted_ids, point3D_ids)
+        position = np.minimum(position, len(self._sorted_ids) - 1)
+        found = self._sorted_ids[position] == point3D_ids
+        return np.where(found, self._order[position], -1)
+
+    def xyzs(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        return self._gather("xyz", rows)
+
+    def rgbs(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        return self._gather("rgb", rows)
+
+    def errors(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        return self._gather("error", rows)
+
+    def tracks(
+        self, rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Decode the tracks of the selected records in CSR layout.
+
+        Return the track offsets, the image ids and the 2D point indices.
+        The track of the i-th selected point is
+        image_ids[track_offsets[i]:track_offsets[i + 1]].
+        """
+
+        offsets = self.offsets if rows is None else self.offsets[rows]
+        lengths = self.track_lengths if rows is None else self.track_lengths[rows]
+        track_offsets = np.zeros(len(offsets) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=track_offsets[1:])
+
+        header_size = POINT3D_HEADER_DTYPE.itemsize
+        with memoryview(self._buffer) as view:
+            tracks = np.frombuffer(
+                b"".join(
+                    view[start : start + 8 * length]
+                    for start, length in zip(
+                        (offsets + header_size).tolist(), lengths.tolist()
+                    )
+                ),
+                dtype=POINT3D_TRACK_DTYPE,
+            )
+
+        return (
+            track_offsets,
+            tracks["image_id"].astype(np.int64),
+            tracks["point2D_idx"].astype(np.int64),
+        )
+
+    def to_arrays(self, rows: Optional[np.ndarray] = None) -> Point3DArrays:
+        """Decode the selected records into Point3DArrays."""
+
+        track_offsets, image_ids, point2D_idxs = self.tracks(rows)
+        return Point3DArrays(
+            ids=self.ids if rows is None else self.ids[rows],
+            xyzs=self.xyzs(rows),
+            rgbs=self.rgbs(rows),
+            errors=self.errors(rows),
+            track_offsets=track_offsets,
+            image_ids=image_ids,
+            point2D_idxs=point2D_idxs,
+        )
+
+    def to_dict(self) -> dict:
+        """Decode the whole file like read_points3D_binary."""
+        return point_arrays_to_dict(self.to_arrays())
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, point3D_id: int) -> bool:
+        return bool(self.rows([point3D_id])[0] >= 0)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __getitem__(self, point3D_id: int) -> Point3D:
+        """Decode a single point record."""
+
+        row = self.rows([point3D_id])[0]
+        if row < 0:
+            raise KeyError(point3D_id)
+
+        offset = int(self.offsets[row])
+        header = np.frombuffer(
+            self._buffer[offset : offset + POINT3D_HEADER_DTYPE.itemsize],
+            dtype=POINT3D_HEADER_DTYPE,
+        )[0]
+        track_start = offset + POINT3D_HEADER_DTYPE.itemsize
+        track = np.frombuffer(
+            self._buffer[track_start : track_start + 8 * int(header["track_length"])],
+            dtype=POINT3D_TRACK_DTYPE,
+        )
+
+        return Point3D(
+            id=int(header["id"]),
+            xyz=np.array(header["xyz"]),
+            rgb=header["rgb"].astype(np.int64),
+            error=np.array(header["error"]),
+            image_ids=track["image_id"].astype(np.int64),
+            point2D_idxs=track["point2D_idx"].astype(np.int64),
+        )
+
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
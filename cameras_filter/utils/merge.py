@@ -0,0 +1,180 @@
+"""
+utils.merge
+
+This module provides the merge of several COLMAP models (e.g. the
+tiles or the passages extracted with 'utils.pruning.extract_model')
+into one model.
+
+The models are concatenated part by part as arrays: the ids of
+every model are offset by the largest ids of the previous ones,
+the duplicates are resolved with 'np.unique' and sorted lookups.
+"""
+from typing import Sequence
+
+import numpy as np
+
+from .read_write_model import CameraArrays, camera_dict_to_arrays
+from .text_model import concatenate_image_arrays, concatenate_point_arrays
+from .columnar_model import ColumnarModel, lookup_rows, take_images
+
+
+def concatenate_camera_arrays(chunks: Sequence[CameraArrays]) -> CameraArrays:
+    """Concatenate CameraArrays of several chunks."""
+
+    chunks = list(chunks)
+    if not chunks:
+        return camera_dict_to_arrays({})
+
+    num_params = np.concatenate([np.diff(chunk.param_offsets) for chunk in chunks])
+    param_offsets = np.zeros(len(num_params) + 1, dtype=np.int64)
+    np.cumsum(num_params, out=param_offsets[1:])
+
+    return CameraArrays(
+        ids=np.concatenate([chunk.ids for chunk in chunks]),
+        model_ids=np.concatenate([chunk.model_ids for chunk in chunks]),
+        widths=np.concatenate([chunk.widths for chunk in chunks]),
+        heights=np.concatenate([chunk.heights for chunk in chunks]),
+        param_offsets=param_offsets,
+        params=np.concatenate([chunk.params for chunk in chunks]),
+    )
+
+
+def id_offsets(ids: Sequence[np.ndarray]) -> np.ndarray:
+    """Offset of the ids of every model, so the offset ids never collide."""
+
+    maxima = [int(model_ids.max()) if len(model_ids) else 0 for model_ids in ids]
+    offsets = np.zeros(len(maxima), dtype=np.int64)
+    np.cumsum(maxima[:-1], out=offsets[1:])
+    return offsets
+
+
+def first_duplicates(keys: np.ndarray) -> np.ndarray:
+    """Row of the first row with the same key, for every row."""
+
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    _, first, inverse = np.unique(
+        keys, axis=0 if keys.ndim > 1 else None, return_index=True, return_inverse=True
+    )
+    return first[inverse.reshape(-1)]
+
+
+def camera_keys(cameras: CameraArrays) -> np.ndarray:
+    """Rows of the model id, the size and the parameters of every camera.
+
+    The parameters are padded with zeros, the number of
+    parameters separates the cameras of different lengths.
+    """
+
+    num_params = np.diff(cameras.param_offsets)
+    width = int(num_params.max()) if len(num_params) else 0
+
+    keys = np.zeros((len(cameras.ids), 4 + width))
+    keys[:, 0] = cameras.model_ids
+    keys[:, 1] = cameras.widths
+    keys[:, 2] = cameras.heights
+    keys[:, 3] = num_params
+
+    rows = np.repeat(np.arange(len(cameras.ids)), num_params)
+    columns = np.arange(len(cameras.params)) - cameras.param_offsets[rows]
+    keys[rows, 4 + columns] = cameras.params
+    return keys
+
+
+def merge_models(models: Sequence[ColumnarModel]) -> ColumnarModel:
+    """Merge several models into one.
+
+    The ids of every model are offset by the largest ids of the
+    previous models, so the ids of the first model are kept.
+    The cameras with the same model, size and parameters are
+    merged into the first of them. The images with the same name
+    are merged into the first of them: it keeps its pose, and the
+    observations of the other copies are moved to it with the same
+    2D point index. An observation is dropped, if the 2D point is
+    missing or already observes another 3D point, and the points
+    left without observations are dropped. The 3D points themselves
+    are never merged.
+
+    Parameters
+    --------------
+        models : Sequence[ColumnarModel]
+            The models to merge. Every model must be consistent
+            (see 'utils.pruning.prune_model').
+    """
+
+    models = list(models)
+    camera_offsets = id_offsets([model.cameras.ids for model in models])
+    image_offsets = id_offsets([model.images.ids for model in models])
+    point_offsets = id_offsets([model.points3D.ids for model in models])
+
+    cameras = concatenate_camera_arrays(
+        model.cameras._replace(ids=model.cameras.ids + offset)
+        for model, offset in zip(models, camera_offsets)
+    )
+    images = concatenate_image_arrays(
+        model.images._replace(
+            ids=model.images.ids + image_offset,
+            camera_ids=model.images.camera_ids + camera_offset,
+            point3D_ids=np.where(
+                model.images.point3D_ids >= 0,
+                model.images.point3D_ids + point_offset,
+                -1,
+            ),
+        )
+        for model, camera_offset, image_offset, point_offset in zip(
+            models, camera_offsets, image_offsets, point_offsets
+        )
+    )
+    points3D = concatenate_point_arrays(
+        model.points3D._replace(
+            ids=model.points3D.ids + point_offset,
+            image_ids=model.points3D.image_ids + image_offset,
+        )
+        for model, image_offset, point_offset in zip(
+            models, image_offsets, point_offsets
+        )
+    )
+
+    # Cameras with identical parameters
+    first_camera = first_duplicates(camera_keys(cameras))
+    camera_rows = first_camera[lookup_rows(cameras.ids, images.camera_ids)]
+    images = images._replace(camera_ids=cameras.ids[camera_rows])
+    unique_cameras = first_camera == np.arange(len(first_camera))
+
+    # Images with the same name
+    first_image = first_duplicates(np.asarray(images.names, dtype=str))
+    unique_images = first_image == np.arange(len(first_image))
+    new_rows = np.cumsum(unique_images) - 1
+    merged = take_images(images, unique_images)
+
+    # The track elements of the duplicates are moved to the first images
+    image_rows = lookup_rows(images.ids, points3D.image_ids)
+    image_rows[image_rows >= 0] = first_image[image_rows[image_rows >= 0]]
+    track_rows = np.repeat(
+        np.arange(len(points3D.ids)), np.diff(points3D.track_offsets)
+    )
+    rows = new_rows[image_rows]
+    elements = np.flatnonzero(
+        (image_rows >= 0)
+        & (points3D.point2D_idxs < np.diff(merged.point2D_offsets)[rows])
+    )
+    slots = merged.point2D_offsets[rows[elements]] + points3D.point2D_idxs[elements]
+    point_of_element = points3D.ids[track_rows[elements]]
+
+    # A free 2D point takes the first element moved to it
+    point3D_ids = merged.point3D_ids.copy()
+    free = np.flatnonzero(point3D_ids[slots] == -1)
+    _, first_free = np.unique(slots[free], return_index=True)
+    point3D_ids[slots[free[first_free]]] = point_of_element[free[first_free]]
+
+    # The element is kept, if its 2D point refers to its 3D point
+    kept_elements = np.zeros(len(track_rows), dtype=bool)
+    kept_elements[elements] = point3D_ids[slots] == point_of_element
+
+    # The points left without track elements are dropped
+    model = ColumnarModel(
+        cameras,
+        merged._replace(point3D_ids=point3D_ids),
+        points3D._replace(image_ids=images.ids[image_rows]),
+    )
+    return model.select_track_elements(kept_elements).select_cameras(unique_cameras)
@@ -0,0 +1,297 @@
+"""
+utils.model_cache
+
+This module provides a cache of decoded COLMAP model files.
+
+The most recently used models are kept in memory within the limits
+of an LRU eviction policy. On request (see 'enable_disk_cache', the
+'--cache_dir' option of 'main.py' or the DL_RECONSTRUCTION_CACHE_DIR
+environment variable) the decoded arrays
+are also stored in '.npz' side files keyed by the path, the inode,
+the size, the modification and the change times (and optionally the
+content hash) of the source file, so repeated runs on an unchanged
+model skip parsing entirely. The side files are bounded in total
+size, the least recently used ones are removed first.
+
+The default cache, which the pipeline reads through, always keys by
+the content hash too: transient files (e.g. 'images_sampled.bin' of
+'utils.estimation') are rewritten at the same path in a loop, and a
+rewrite may keep the stat data on filesystems with coarse timestamps.
+"""
+from typing import Optional, Union
+from collections import OrderedDict
+from pathlib import Path
+import hashlib
+import os
+
+import numpy as np
+
+from .read_write_model import (
+    ImageArrays,
+    ImagePoses,
+    Point3DArrays,
+    read_image_poses,
+    read_images_binary_arrays,
+)
+from .text_model import read_images_text_arrays, read_points3D_text_arrays
+from .mapped_points3D import MappedPoints3D
+from .description import PassageArrays, read_description_arrays
+
+PathLikeObject = Union[str, Path]
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "dl_reconstruction"
+CACHE_DIR_VARIABLE = "DL_RECONSTRUCTION_CACHE_DIR"
+
+
+def _read_points3D_arrays(path: PathLikeObject) -> Point3DArrays:
+    if str(path).endswith(".txt"):
+        return read_points3D_text_arrays(path)
+    with MappedPoints3D(path) as points3D:
+        return points3D.to_arrays()
+
+
+def _read_images_arrays(path: PathLikeObject) -> ImageArrays:
+    if str(path).endswith(".txt"):
+        return read_images_text_arrays(path)
+    return read_images_binary_arrays(path)
+
+
+# Kinds of cached data: the namedtuple and the reader of every kind
+KINDS = {
+    "images": (ImageArrays, _read_images_arrays),
+    "poses": (ImagePoses, read_image_poses),
+    "points3D": (Point3DArrays, _read_points3D_arrays),
+    "passages": (PassageArrays, read_description_arrays),
+}
+
+
+def file_hash(path: PathLikeObject, chunk_size: int = 1 << 24) -> str:
+    """Hash the content of the file."""
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fid:
+        for chunk in iter(lambda: fid.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelCache:
+    """Two-level cache of decoded model files.
+
+    The first level is an in-process LRU of at most max_entries
+    models and max_bytes bytes of arrays. The optional second
+    level is the directory of '.npz' side files of at most
+    max_disk_bytes bytes.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[PathLikeObject] = None,
+        max_entries: int = 8,
+        max_bytes: int = 2 << 30,
+        verify_content: bool = False,
+        max_disk_bytes: int = 4 << 30,
+    ):
+        """Construct the cache.
+
+        Parameters
+        --------------
+            cache_dir : Optional[PathLikeObject] = None
+                The directory of side files, e.g. DEFAULT_CACHE_DIR.
+                If it's None, only the in-process cache is used.
+            max_entries : int = 8
+                The maximal number of models kept in memory.
+            max_bytes : int = 2 GiB
+                The maximal size of the arrays kept in memory.
+            verify_content : bool = False
+                If it's True, the content hash of the source
+                file is a part of the key. It protects from
+                changes which keep the size and the mtime,
+                but costs one sequential read of the file.
+            max_disk_bytes : int = 4 GiB
+                The maximal total size of the side files.
+        """
+
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.verify_content = verify_content
+        self.max_disk_bytes = max_disk_bytes
+
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+
+    def _key(self, path: Path, kind: str) -> tuple:
+        stat = path.stat()
+        content_hash = file_hash(path) if self.verify_content else ""
+        # The inode and the ctime catch the rewrites, which keep the size
+        # and land within the mtime resolution of the filesystem
+        return (
+            str(path.resolve()),
+            kind,
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ctime_ns,
+            content_hash,
+        )
+
+    def _side_file(self, key: tuple) -> Path:
+        name = hashlib.blake2b(f"{key[0]}:{key[1]}".encode(), digest_size=16)
+        return self.cache_dir / f"{name.hexdigest()}.npz"
+
+    def load(self, path: PathLikeObject, kind: str = "images"):
+        """Return the decoded file, parsing it only on a cache miss.
+
+        Parameters
+        --------------
+            path : PathLikeObject
+                Path to the model file of '.bin' or '.txt' extension
+                or to the description file of '.json' extension.
+            kind : str = "images"
+                "images" (ImageArrays), "poses" (ImagePoses),
+                "points3D" (Point3DArrays) or "passages" (PassageArrays).
+        """
+
+        path = Path(path)
+        arrays_type, reader = KINDS[kind]
+        key = self._key(path, kind)
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        data = self._load_side_file(key, arrays_type)
+        if data is None:
+            data = reader(path)
+            self._save_side_file(key, data)
+
+        data = arrays_type(*[self._freeze(value) for value in data])
+        self._remember(key, data)
+        return data
+
+    @staticmethod
+    def _freeze(value):
+        # Cached arrays are shared between the callers
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+        return value
+
+    def _load_side_file(self, key: tuple, arrays_type) -> Optional[tuple]:
+        if self.cache_dir is None:
+            return None
+
+        side_file = self._side_file(key)
+        if not side_file.exists():
+            return None
+
+        with np.load(side_file, allow_pickle=False) as stored:
+            if tuple(stored["key"].tolist()) != tuple(map(str, key)):
+                return None
+            fields = {field: stored[field] for field in arrays_type._fields}
+
+        # The mtime of a side file is its last use, see '_evict_side_files'
+        os.utime(side_file)
+        if "names" in fields:
+            fields["names"] = fields["names"].tolist()
+
+        return arrays_type(**fields)
+
+    def _save_side_file(self, key: tuple, data: tuple):
+        if self.cache_dir is None:
+            return
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        side_file = self._side_file(key)
+        fields = data._asdict()
+        if "names" in fields:
+            fields["names"] = np.array(fields["names"], dtype=str)
+
+        # Write to a temporary file first, so readers never see a partial file
+        tmp_file = side_file.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp_file, key=np.array(list(map(str, key))), **fields)
+        os.replace(tmp_file, side_file)
+
+        self._evict_side_files()
+
+    def _evict_side_files(self):
+        """Remove the least recently used side files over max_disk_bytes."""
+
+        side_files = []
+        for side_file in self.cache_dir.glob("*.npz"):
+            try:
+                stat = side_file.stat()
+            except FileNotFoundError:
+                continue
+            side_files.append((stat.st_mtime_ns, stat.st_size, side_file))
+
+        total = sum(size for _, size, _ in side_files)
+        for _, size, side_file in sorted(side_files, key=lambda item: item[0]):
+            if total <= self.max_disk_bytes:
+                break
+            side_file.unlink(missing_ok=True)
+            total -= size
+
+    def _remember(self, key: tuple, data: tuple):
+        size = sum(value.nbytes for value in data if isinstance(value, np.ndarray))
+        if size > self.max_bytes:
+            return
+
+        self._memory[key] = data
+        self._memory_bytes += size
+
+        # Evict the least recently used models
+        while (
+            len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes
+        ):
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= sum(
+                value.nbytes for value in evicted if isinstance(value, np.ndarray)
+            )
+
+    def clear(self):
+        """Forget the models kept in memory."""
+        self._memory.clear()
+        self._memory_bytes = 0
+
+
+# Hashing costs a sequential read of the file, which is still much
+# cheaper than parsing it, and never returns a stale model
+default_cache = ModelCache(
+    os.environ.get(CACHE_DIR_VARIABLE) or None, verify_content=True
+)
+
+
+def enable_disk_cache(
+    cache_dir: Optional[PathLikeObject] = DEFAULT_CACHE_DIR,
+    max_disk_bytes: int = 4 << 30,
+):
+    """Keep the decoded files of the default cache in the directory.
+
+    The side files outlive the process, so the cache should only
+    be enabled for models, which are read again, not for transient
+    files. If cache_dir is None, the disk cache is disabled.
+    """
+
+    default_cache.cache_dir = None if cache_dir is None else Path(cache_dir)
+    default_cache.max_disk_bytes = max_disk_bytes
+
+
+def read_images_cached(path: PathLikeObject) -> ImageArrays:
+    """Cached read of an images file into ImageArrays."""
+    return default_cache.load(path, "images")
+
+
+def read_image_poses_cached(path: PathLikeObject) -> ImagePoses:
+    """Cached read of the image poses of an images file."""
+    return default_cache.load(path, "poses")
+
+
+def read_points3D_cached(path: PathLikeObject) -> Point3DArrays:
+    """Cached read of a points3D file into Point3DArrays."""
+    return default_cache.load(path, "points3D")
+
+
+def read_passages_cached(path: PathLikeObject) -> PassageArrays:
+    """Cached streaming read of a description file into PassageArrays."""
+    return default_cache.load(path, "passages")
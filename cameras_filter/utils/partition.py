@@ -0,0 +1,167 @@
+"""
+utils.partition
+
+This module provides a writer, which splits a COLMAP model into
+several models (e.g. right/wrong images, passages or tiles) with
+one read of the source files.
+
+The files, which are the same in every output (cameras and, without
+pruning, points3D), are reflinked where the filesystem supports it,
+so the time and the disk space grow with the data actually written.
+"""
+from typing import Callable, Sequence, Union
+from pathlib import Path
+import errno
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+import numpy as np
+
+from .read_write_model import write_images_binary_partition
+from .columnar_model import take_images
+from .pruning import prune_model_files, read_images_arrays, write_images_arrays
+
+PathLikeObject = Union[str, Path]
+
+# ioctl request of the copy-on-write clone of a whole file (Linux)
+FICLONE = 0x40049409
+
+
+def link_file(
+    source: PathLikeObject, destination: PathLikeObject, hardlink: bool = False
+) -> str:
+    """Make the destination a copy of the source file as cheaply as possible.
+
+    A reflink (copy-on-write clone) is tried first, where 'fcntl' is
+    available, then a regular copy. A hard link is only made on
+    request: it shares the data with the source, so any tool, which
+    rewrites the destination in place (e.g. COLMAP), would rewrite
+    the source too. The destination can't be the source path.
+
+    Return the used method: "reflink", "hardlink" or "copy".
+    """
+
+    source, destination = Path(source), Path(destination)
+    # The destination is removed first, it must never be the source path
+    if destination.resolve() == source.resolve():
+        raise ValueError(f"{destination} is the source file itself.")
+    if hardlink and destination.exists() and os.path.samefile(source, destination):
+        return "hardlink"
+    if destination.exists() or destination.is_symlink():
+        destination.unlink()
+
+    if not fcntl is None:
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return "reflink"
+            except OSError as error:
+                if error.errno not in (
+                    errno.EOPNOTSUPP,
+                    errno.ENOTTY,
+                    errno.EXDEV,
+                    errno.EINVAL,
+                    errno.EBADF,
+                ):
+                    raise
+
+    if hardlink:
+        if destination.exists():
+            destination.unlink()
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            pass
+
+    shutil.copyfile(source, destination)
+    return "copy"
+
+
+def partition_model(
+    path_to_images: PathLikeObject,
+    output_dirs: Sequence[PathLikeObject],
+    assign: Callable[[np.ndarray, list], np.ndarray],
+    sparse_dir: Union[PathLikeObject, None] = None,
+    prune: bool = False,
+    min_track_length: int = 1,
+    hardlink: bool = False,
+) -> np.ndarray:
+    """Split the model into one model per output directory.
+
+    Every image goes to the output of its label. The model format
+    is the one of the images file: binary images are distributed
+    as raw records in a single pass without decoding, text images
+    are parsed once.
+
+    Parameters
+    --------------
+        path_to_images : PathLikeObject
+            Path to the images file of '.bin' or '.txt' extension.
+        output_dirs : Sequence[PathLikeObject]
+            The output directories.
+        assign : Callable[[np.ndarray, list], np.ndarray]
+            The function of the image ids and the names, which
+            returns the label of every image: the index of its
+            output directory or -1 if the image is dropped.
+        sparse_dir : Optional[PathLikeObject] = None
+            The directory of the cameras and the points3D files.
+            If it's None, the directory of the images file.
+        prune : bool = False
+            If it's True, the points3D file of every output is
+            pruned (see 'utils.pruning.prune_model'), otherwise
+            it's a copy of the source one.
+        min_track_length : int = 1
+            See 'utils.pruning.prune_model'.
+        hardlink : bool = False
+            If it's True, the unchanged files may be hard-linked
+            to the source ones (see 'link_file'). The outputs must
+            never be rewritten in place then.
+
+    Return the labels of the images.
+    """
+
+    path_to_images = Path(path_to_images)
+    ext = path_to_images.suffix
+    sparse_dir = path_to_images.parent if sparse_dir is None else Path(sparse_dir)
+    path_to_cameras = sparse_dir / f"cameras{ext}"
+    path_to_points = sparse_dir / f"points3D{ext}"
+
+    if not path_to_cameras.exists():
+        raise FileNotFoundError(f"There is no 'cameras{ext}' file in {sparse_dir}")
+    if not path_to_points.exists():
+        raise FileNotFoundError(f"There is no 'points3D{ext}' file in {sparse_dir}")
+
+    # Nothing is written before the outputs are checked
+    output_dirs = [Path(output_dir) for output_dir in output_dirs]
+    sources = {sparse_dir.resolve(), path_to_images.parent.resolve()}
+    for output_dir in output_dirs:
+        if output_dir.resolve() in sources:
+            raise ValueError(f"The output {output_dir} is a source directory.")
+
+    for output_dir in output_dirs:
+        output_dir.mkdir(parents=True, exist_ok=True)
+        link_file(path_to_cameras, output_dir / path_to_cameras.name, hardlink)
+
+    if prune:
+        return prune_model_files(
+            path_to_images, path_to_points, assign, output_dirs, min_track_length
+        )
+
+    for output_dir in output_dirs:
+        link_file(path_to_points, output_dir / path_to_points.name, hardlink)
+
+    outputs = [output_dir / f"images{ext}" for output_dir in output_dirs]
+    if ext != ".txt":
+        return write_images_binary_partition(path_to_images, outputs, assign)
+
+    images = read_images_arrays(path_to_images)
+    labels = np.asarray(assign(images.ids, images.names), dtype=np.int64)
+    for label, output in enumerate(outputs):
+        write_images_arrays(take_images(images, labels == label), output)
+    return labels
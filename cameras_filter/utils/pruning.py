@@ -0,0 +1,233 @@
+"""
+utils.pruning
+
+This module provides vectorized pruning of COLMAP models.
+
+Tracks of the 3D points are kept as flat image_ids and
+point2D_idxs arrays with offsets (see 'utils.columnar_model'),
+so the decisions are made for all observations at once and
+the kept records go straight to the array writers.
+"""
+from typing import Callable, Optional, Sequence, Tuple, Union
+from pathlib import Path
+
+import numpy as np
+
+from .read_write_model import (
+    ImageArrays,
+    Point3DArrays,
+    camera_dict_to_arrays,
+    read_image_poses,
+    read_images_binary_arrays,
+    write_images_binary_arrays,
+    write_points3D_binary_arrays,
+)
+from .text_model import (
+    read_images_text_arrays,
+    read_points3D_text_arrays,
+    write_images_text_arrays,
+    write_points3D_text_arrays,
+)
+from .mapped_points3D import MappedPoints3D
+from .columnar_model import ColumnarModel, csr_all, take_points
+
+PathLikeObject = Union[str, Path]
+
+
+def read_images_arrays(path: PathLikeObject) -> ImageArrays:
+    """Read a '.bin' or '.txt' images file into ImageArrays."""
+
+    if str(path).endswith(".txt"):
+        return read_images_text_arrays(path)
+    return read_images_binary_arrays(path)
+
+
+def write_images_arrays(images: ImageArrays, path: PathLikeObject):
+    """Write ImageArrays into a '.bin' or '.txt' images file."""
+
+    if str(path).endswith(".txt"):
+        write_images_text_arrays(images, path)
+    else:
+        write_images_binary_arrays(images, path)
+
+
+def read_points3D_arrays(path: PathLikeObject) -> Point3DArrays:
+    """Read a '.bin' or '.txt' points3D file into Point3DArrays."""
+
+    if str(path).endswith(".txt"):
+        return read_points3D_text_arrays(path)
+    with MappedPoints3D(path) as points3D:
+        return points3D.to_arrays()
+
+
+def write_points3D_arrays(points3D: Point3DArrays, path: PathLikeObject):
+    """Write Point3DArrays into a '.bin' or '.txt' points3D file.
+
+    The file is written next to the destination first
+    (see 'read_write_model.open_replacing'), so the source may be replaced.
+    """
+
+    if str(path).endswith(".txt"):
+        write_points3D_text_arrays(points3D, path)
+    else:
+        write_points3D_binary_arrays(points3D, path)
+
+
+def supported_points(points3D: Point3DArrays, image_ids: Sequence[int]) -> np.ndarray:
+    """Boolean mask of the points, whose tracks only contain the images."""
+
+    observed = np.isin(points3D.image_ids, np.asarray(image_ids, dtype=np.int64))
+    return csr_all(observed, points3D.track_offsets)
+
+
+def prune_points(
+    path_to_images: PathLikeObject,
+    path_to_points: PathLikeObject,
+    path_to_output: Optional[PathLikeObject] = None,
+) -> Tuple[Point3DArrays, Point3DArrays]:
+    """Keep the points, which are observed by the images of the images file only.
+
+    Parameters
+    --------------
+        path_to_images : PathLikeObject
+            Path to the images file of '.bin' or '.txt' extension.
+            Only the image ids are read.
+        path_to_points : PathLikeObject
+            Path to the points3D file of '.bin' or '.txt' extension.
+        path_to_output : Optional[PathLikeObject] = None
+            Path to the output points3D file. If it's None,
+            the points3D file is replaced.
+
+    Return the source and the kept points.
+    """
+
+    image_ids = read_image_poses(path_to_images).ids
+    points3D = read_points3D_arrays(path_to_points)
+
+    kept = take_points(points3D, supported_points(points3D, image_ids))
+    write_points3D_arrays(
+        kept, path_to_points if path_to_output is None else path_to_output
+    )
+
+    return points3D, kept
+
+
+def prune_model(
+    images: ImageArrays,
+    points3D: Point3DArrays,
+    selection,
+    min_track_length: int = 1,
+) -> Tuple[ImageArrays, Point3DArrays]:
+    """Keep the selected images and the points they support.
+
+    The observations of the removed images are dropped from the
+    tracks, the points observed by less than min_track_length
+    distinct kept images are dropped, and the 2D points of the kept images, which
+    refer to the dropped points, get the point3D_id -1. So the
+    result is a consistent model, which COLMAP loads without
+    triangulating again.
+
+    Parameters
+    --------------
+        images : ImageArrays
+        points3D : Point3DArrays
+        selection
+            The images to keep, a boolean mask or a sequence of rows.
+        min_track_length : int = 1
+            The minimal number of distinct images observing a kept
+            point, a point observed twice by one image counts once.
+            Points without observations are always dropped.
+    """
+
+    # The cameras are not needed for pruning
+    model = ColumnarModel(camera_dict_to_arrays({}), images, points3D)
+    model = model.select_images(selection)
+    points3D = model.points3D
+
+    # Drop the observations of the removed images from the tracks
+    observed = model.track_image_rows() >= 0
+    track_rows = np.repeat(
+        np.arange(model.num_points3D), np.diff(points3D.track_offsets)
+    )
+
+    # Unique (point, image) pairs, one key per pair
+    pairs = np.unique(
+        (track_rows[observed].astype(np.int64) << 32)
+        | (points3D.image_ids[observed].astype(np.int64) & 0xFFFFFFFF)
+    )
+    num_images = np.bincount(pairs >> 32, minlength=model.num_points3D)
+    kept_points = num_images >= max(min_track_length, 1)
+
+    model = model.select_track_elements(observed & kept_points[track_rows])
+    # Dangling references of the kept images
+    model = model.drop_missing_points()
+
+    return model.images, model.points3D
+
+
+def extract_model(
+    model: ColumnarModel, selection, min_observations: int = 1
+) -> ColumnarModel:
+    """Self-contained compact model of the selected images.
+
+    The model keeps the selected images, the cameras they refer to
+    and the points observed by at least min_observations distinct
+    images among them (see 'prune_model'). The ids are remapped densely
+    (see 'ColumnarModel.compact').
+    """
+
+    images, points3D = prune_model(
+        model.images, model.points3D, selection, min_observations
+    )
+    return ColumnarModel(model.cameras, images, points3D).compact()
+
+
+def prune_model_files(
+    path_to_images: PathLikeObject,
+    path_to_points: PathLikeObject,
+    assign: Callable[[np.ndarray, list], np.ndarray],
+    output_dirs: Sequence[PathLikeObject],
+    min_track_length: int = 1,
+) -> np.ndarray:
+    """Write the pruned model of every label of the images.
+
+    Both files are read once. The i-th output directory keeps
+    the images with the label i, see 'prune_model'.
+    The outputs are named 'images' and 'points3D' and keep
+    the extensions of the source files.
+
+    Parameters
+    --------------
+        path_to_images : PathLikeObject
+            Path to the images file of '.bin' or '.txt' extension.
+        path_to_points : PathLikeObject
+            Path to the points3D file of '.bin' or '.txt' extension.
+        assign : Callable[[np.ndarray, list], np.ndarray]
+            The function of the image ids and the names, which
+            returns the label of every image: the index of its
+            output directory or -1 if the image is dropped.
+        output_dirs : Sequence[PathLikeObject]
+            The output directories.
+        min_track_length : int = 1
+            See 'prune_model'.
+
+    Return the labels of the images.
+    """
+
+    images = read_images_arrays(path_to_images)
+    points3D = read_points3D_arrays(path_to_points)
+    images_ext, points_ext = Path(path_to_images).suffix, Path(path_to_points).suffix
+
+    labels = np.asarray(assign(images.ids, images.names), dtype=np.int64)
+
+    for label, output_dir in enumerate(output_dirs):
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        kept_images, kept_points = prune_model(
+            images, points3D, labels == label, min_track_length
+        )
+        write_images_arrays(kept_images, output_dir / f"images{images_ext}")
+        write_points3D_arrays(kept_points, output_dir / f"points3D{points_ext}")
+
+    return labels
@@ -24,3 +24,86 @@ def add_vector(
     X = world_coordinates(q_vec, t_vec)
     X += addition
     return colmap_coordinates(q_vec, X)
+
+
+def qvec2rotmat_batch(q_vecs: np.ndarray) -> np.ndarray:
+    """Batched qvec2rotmat: N x 4 quaternions into N x 3 x 3 rotation matrices."""
+
+    q_vecs = np.asarray(q_vecs, dtype=np.float64).reshape(-1, 4)
+    w, x, y, z = q_vecs.T
+    # float_power rounds like the scalar '**' of qvec2rotmat, x * x doesn't
+    x2, y2, z2 = (np.float_power(value, 2) for value in (x, y, z))
+
+    R = np.empty((len(q_vecs), 3, 3), dtype=np.float64)
+    R[:, 0, 0] = 1 - 2 * y2 - 2 * z2
+    R[:, 0, 1] = 2 * x * y - 2 * w * z
+    R[:, 0, 2] = 2 * z * x + 2 * w * y
+    R[:, 1, 0] = 2 * x * y + 2 * w * z
+    R[:, 1, 1] = 1 - 2 * x2 - 2 * z2
+    R[:, 1, 2] = 2 * y * z - 2 * w * x
+    R[:, 2, 0] = 2 * z * x - 2 * w * y
+    R[:, 2, 1] = 2 * y * z + 2 * w * x
+    R[:, 2, 2] = 1 - 2 * x2 - 2 * y2
+    return R
+
+
+def rotmat2qvec_batch(R: np.ndarray) -> np.ndarray:
+    """Batched rotmat2qvec: N x 3 x 3 rotation matrices into N x 4 quaternions.
+
+    The symmetric 4 x 4 matrices of all rotations are
+    decomposed with one batched call of np.linalg.eigh.
+    """
+
+    R = np.asarray(R, dtype=np.float64).reshape(-1, 3, 3)
+    Rxx, Ryx, Rzx = R[:, 0, 0], R[:, 0, 1], R[:, 0, 2]
+    Rxy, Ryy, Rzy = R[:, 1, 0], R[:, 1, 1], R[:, 1, 2]
+    Rxz, Ryz, Rzz = R[:, 2, 0], R[:, 2, 1], R[:, 2, 2]
+
+    # Only the lower triangle is used by eigh
+    K = np.zeros((len(R), 4, 4), dtype=np.float64)
+    K[:, 0, 0] = Rxx - Ryy - Rzz
+    K[:, 1, 0] = Ryx + Rxy
+    K[:, 1, 1] = Ryy - Rxx - Rzz
+    K[:, 2, 0] = Rzx + Rxz
+    K[:, 2, 1] = Rzy + Ryz
+    K[:, 2, 2] = Rzz - Rxx - Ryy
+    K[:, 3, 0] = Ryz - Rzy
+    K[:, 3, 1] = Rzx - Rxz
+    K[:, 3, 2] = Rxy - Ryx
+    K[:, 3, 3] = Rxx + Ryy + Rzz
+    K /= 3.0
+
+    eigvals, eigvecs = np.linalg.eigh(K)
+    largest = np.argmax(eigvals, axis=1)
+    q_vecs = eigvecs[np.arange(len(R)), :, largest][:, [3, 0, 1, 2]]
+    q_vecs[q_vecs[:, 0] < 0] *= -1
+    return q_vecs
+
+
+def world_coordinates_batch(q_vecs: np.ndarray, t_vecs: np.ndarray) -> np.ndarray:
+    """Batched world_coordinates: N x 3 camera centres -R^t * T."""
+
+    R = qvec2rotmat_batch(q_vecs)
+    t_vecs = np.asarray(t_vecs, dtype=np.float64).reshape(-1, 3, 1)
+    # Stacked matmul sums in the same order as np.dot of world_coordinates
+    return np.matmul(-R.transpose(0, 2, 1), t_vecs)[:, :, 0]
+
+
+def colmap_coordinates_batch(q_vecs: np.ndarray, X: np.ndarray) -> np.ndarray:
+    """Batched colmap_coordinates: N x 3 translations -R * X."""
+
+    R = qvec2rotmat_batch(q_vecs)
+    X = np.asarray(X, dtype=np.float64).reshape(-1, 3, 1)
+    return np.matmul(-R, X)[:, :, 0]
+
+
+def add_vector_batch(
+    q_vecs: np.ndarray, t_vecs: np.ndarray, additions: np.ndarray
+) -> np.ndarray:
+    """Batched add_vector: N x 3 translations of the shifted cameras."""
+
+    R = qvec2rotmat_batch(q_vecs)
+    t_vecs = np.asarray(t_vecs, dtype=np.float64).reshape(-1, 3, 1)
+    X = np.matmul(-R.transpose(0, 2, 1), t_vecs)
+    X += np.asarray(additions, dtype=np.float64).reshape(-1, 3, 1)
+    return np.matmul(-R, X)[:, :, 0]
@@ -31,9 +31,14 @@
 
 import os
 import collections
+import contextlib
+import mmap
+import array
+import time
 import numpy as np
 import struct
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 
 CameraModel = collections.namedtuple(
@@ -48,11 +53,68 @@ Point3D = collections.namedtuple(
 )
 
 
+CameraArrays = collections.namedtuple(
+    "CameraArrays",
+    ["ids", "model_ids", "widths", "heights", "param_offsets", "params"],
+)
+ImageArrays = collections.namedtuple(
+    "ImageArrays",
+    [
+        "ids",
+        "qvecs",
+        "tvecs",
+        "camera_ids",
+        "names",
+        "point2D_offsets",
+        "xys",
+        "point3D_ids",
+    ],
+)
+ImagePoses = collections.namedtuple(
+    "ImagePoses", ["ids", "qvecs", "tvecs", "camera_ids", "names"]
+)
+Point3DArrays = collections.namedtuple(
+    "Point3DArrays",
+    [
+        "ids",
+        "xyzs",
+        "rgbs",
+        "errors",
+        "track_offsets",
+        "image_ids",
+        "point2D_idxs",
+    ],
+)
+
+
 class Image(BaseImage):
     def qvec2rotmat(self):
         return qvec2rotmat(self.qvec)
 
 
+# Binary layouts of the records of images.bin
+IMAGE_HEADER_DTYPE = np.dtype(
+    [
+        ("id", "<i4"),
+        ("qvec", "<f8", (4,)),
+        ("tvec", "<f8", (3,)),
+        ("camera_id", "<i4"),
+    ]
+)
+IMAGE_POINT2D_DTYPE = np.dtype([("xy", "<f8", (2,)), ("point3D_id", "<i8")])
+# Binary layouts of the records of points3D.bin
+POINT3D_HEADER_DTYPE = np.dtype(
+    [
+        ("id", "<u8"),
+        ("xyz", "<f8", (3,)),
+        ("rgb", "u1", (3,)),
+        ("error", "<f8"),
+        ("track_length", "<u8"),
+    ]
+)
+POINT3D_TRACK_DTYPE = np.dtype([("image_id", "<i4"), ("point2D_idx", "<i4")])
+
+
 CAMERA_MODELS = {
     CameraModel(model_id=0, model_name="SIMPLE_PINHOLE", num_params=3),
     CameraModel(model_id=1, model_name="PINHOLE", num_params=4),
@@ -102,6 +164,26 @@ def write_next_bytes(fid, data, format_char_sequence, endian_character="<"):
     fid.write(bytes)
 
 
+@contextlib.contextmanager
+def open_replacing(path, mode="wb"):
+    """Open a temporary file next to the path, which replaces the path on close.
+
+    The output is never truncated in place, so a file hard-linked
+    to it (e.g. a source model) is left intact, and a failed write
+    leaves the previous file as it was.
+    """
+    path = os.fspath(path)
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, mode) as fid:
+            yield fid
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 def read_cameras_text(path):
     """
     see: src/base/reconstruction.cc
@@ -161,6 +243,50 @@ def read_cameras_binary(path_to_model_file):
     return cameras
 
 
+def camera_arrays_to_dict(arrays):
+    """Convert CameraArrays into the dict of Camera records."""
+    cameras = {}
+    offsets = arrays.param_offsets.tolist()
+    for i, (camera_id, model_id, width, height) in enumerate(
+        zip(
+            arrays.ids.tolist(),
+            arrays.model_ids.tolist(),
+            arrays.widths.tolist(),
+            arrays.heights.tolist(),
+        )
+    ):
+        cameras[camera_id] = Camera(
+            id=camera_id,
+            model=CAMERA_MODEL_IDS[model_id].model_name,
+            width=width,
+            height=height,
+            params=arrays.params[offsets[i] : offsets[i + 1]],
+        )
+    return cameras
+
+
+def camera_dict_to_arrays(cameras):
+    """Convert the dict of Camera records into CameraArrays."""
+    cameras = list(cameras.values())
+    num_params = np.array([len(cam.params) for cam in cameras], dtype=np.int64)
+    param_offsets = np.zeros(len(cameras) + 1, dtype=np.int64)
+    np.cumsum(num_params, out=param_offsets[1:])
+    return CameraArrays(
+        ids=np.array([cam.id for cam in cameras], dtype=np.int64),
+        model_ids=np.array(
+            [CAMERA_MODEL_NAMES[cam.model].model_id for cam in cameras],
+            dtype=np.int64,
+        ),
+        widths=np.array([cam.width for cam in cameras], dtype=np.int64),
+        heights=np.array([cam.height for cam in cameras], dtype=np.int64),
+        param_offsets=param_offsets,
+        params=np.concatenate(
+            [np.asarray(cam.params, dtype=np.float64) for cam in cameras]
+            or [np.empty(0)]
+        ),
+    )
+
+
 def write_cameras_text(cameras, path):
     """
     see: src/base/reconstruction.cc
@@ -172,7 +298,7 @@ def write_cameras_text(cameras, path):
         + "#   CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]\n"
         + "# Number of cameras: {}\n".format(len(cameras))
     )
-    with open(path, "w") as fid:
+    with open_replacing(path, "w") as fid:
         fid.write(HEADER)
         for _, cam in cameras.items():
             to_write = [cam.id, cam.model, cam.width, cam.height, *cam.params]
@@ -186,7 +312,7 @@ def write_cameras_binary(cameras, path_to_model_file):
         void Reconstruction::WriteCamerasBinary(const std::string& path)
         void Reconstruction::ReadCamerasBinary(const std::string& path)
     """
-    with open(path_to_model_file, "wb") as fid:
+    with open_replacing(path_to_model_file, "wb") as fid:
         write_next_bytes(fid, len(cameras), "Q")
         for _, cam in cameras.items():
             model_id = CAMERA_MODEL_NAMES[cam.model].model_id
@@ -280,6 +406,182 @@ def read_images_binary(path_to_model_file):
     return images
 
 
+def _scan_images_binary(buffer):
+    """Locate the records of an images.bin file without decoding observations.
+
+    Only the 64-byte record headers, the image names and the observation
+    counts are touched, every observation block is skipped.
+    :param buffer: bytes-like object or mmap with the content of images.bin.
+    :return: Tuple of the record headers (IMAGE_HEADER_DTYPE array), the list of
+    image names, the byte offsets of the observation blocks, the numbers of
+    observations and the byte offsets of the records, with the end of the last
+    record appended.
+    """
+    num_reg_images = struct.unpack_from("<Q", buffer, 0)[0]
+    headers = []
+    names = []
+    points2D_starts = []
+    num_points2D = []
+    record_offsets = []
+    pos = 8
+    for _ in range(num_reg_images):
+        record_offsets.append(pos)
+        name_start = pos + 64
+        name_end = buffer.find(b"\x00", name_start)
+        headers.append(buffer[pos:name_start])
+        names.append(buffer[name_start:name_end].decode("utf-8"))
+        num = struct.unpack_from("<Q", buffer, name_end + 1)[0]
+        pos = name_end + 9
+        points2D_starts.append(pos)
+        num_points2D.append(num)
+        pos += 24 * num
+    record_offsets.append(pos)
+    headers = np.frombuffer(b"".join(headers), dtype=IMAGE_HEADER_DTYPE)
+    return (
+        headers,
+        names,
+        np.array(points2D_starts, dtype=np.int64),
+        np.array(num_points2D, dtype=np.int64),
+        np.array(record_offsets, dtype=np.int64),
+    )
+
+
+def read_images_binary_arrays(path_to_model_file):
+    """Bulk version of read_images_binary returning contiguous arrays.
+
+    The whole file is read into one buffer, the record headers are decoded
+    with a structured dtype and all 'ddq' observation blocks are decoded
+    at once with np.frombuffer. The observations of the i-th image are
+    xys[point2D_offsets[i]:point2D_offsets[i + 1]].
+    """
+    with open(path_to_model_file, "rb") as fid:
+        buffer = fid.read()
+    headers, names, points2D_starts, num_points2D, _ = _scan_images_binary(buffer)
+
+    view = memoryview(buffer)
+    points2D = np.frombuffer(
+        b"".join(
+            view[start : start + 24 * num]
+            for start, num in zip(points2D_starts.tolist(), num_points2D.tolist())
+        ),
+        dtype=IMAGE_POINT2D_DTYPE,
+    )
+    point2D_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum(num_points2D, out=point2D_offsets[1:])
+
+    return ImageArrays(
+        ids=headers["id"].astype(np.int64),
+        qvecs=np.array(headers["qvec"]),
+        tvecs=np.array(headers["tvec"]),
+        camera_ids=headers["camera_id"].astype(np.int64),
+        names=names,
+        point2D_offsets=point2D_offsets,
+        xys=np.array(points2D["xy"]),
+        point3D_ids=np.array(points2D["point3D_id"]),
+    )
+
+
+def read_images_binary_bulk(path_to_model_file):
+    """Drop-in replacement of read_images_binary built on the bulk reader."""
+    return image_arrays_to_dict(read_images_binary_arrays(path_to_model_file))
+
+
+def read_image_poses_binary(path_to_model_file):
+    """Read the poses of images.bin skipping all 2D observations.
+
+    Only the fixed 64-byte header, the name and the observation count
+    of every record are read, the 24 * num_points2D bytes of the
+    observation block are skipped. The file is memory-mapped, so the
+    skipped blocks are never loaded into memory.
+    """
+    with open(path_to_model_file, "rb") as fid:
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            headers, names, _, _, _ = _scan_images_binary(buffer)
+    return ImagePoses(
+        ids=headers["id"].astype(np.int64),
+        qvecs=np.array(headers["qvec"]),
+        tvecs=np.array(headers["tvec"]),
+        camera_ids=headers["camera_id"].astype(np.int64),
+        names=names,
+    )
+
+
+def read_image_poses_text(path):
+    """Read the poses of images.txt skipping all 2D observations."""
+    ids, poses, camera_ids, names = [], [], [], []
+    with open(path, "r") as fid:
+        while True:
+            line = fid.readline()
+            if not line:
+                break
+            line = line.strip()
+            if len(line) > 0 and line[0] != "#":
+                elems = line.split()
+                ids.append(int(elems[0]))
+                poses.append(elems[1:8])
+                camera_ids.append(int(elems[8]))
+                names.append(elems[9])
+                fid.readline()  # POINTS2D[] line
+    poses = np.array(poses, dtype=np.float64).reshape(-1, 7)
+    return ImagePoses(
+        ids=np.array(ids, dtype=np.int64),
+        qvecs=poses[:, :4],
+        tvecs=poses[:, 4:],
+        camera_ids=np.array(camera_ids, dtype=np.int64),
+        names=names,
+    )
+
+
+def read_image_poses(path):
+    """Read the image poses of a '.bin' or '.txt' images file."""
+    if str(path).endswith(".txt"):
+        return read_image_poses_text(path)
+    return read_image_poses_binary(path)
+
+
+def image_arrays_to_dict(arrays):
+    """Convert ImageArrays into the dict of Image records."""
+    images = {}
+    offsets = arrays.point2D_offsets.tolist()
+    for i, (image_id, camera_id, name) in enumerate(
+        zip(arrays.ids.tolist(), arrays.camera_ids.tolist(), arrays.names)
+    ):
+        images[image_id] = Image(
+            id=image_id,
+            qvec=arrays.qvecs[i],
+            tvec=arrays.tvecs[i],
+            camera_id=camera_id,
+            name=name,
+            xys=arrays.xys[offsets[i] : offsets[i + 1]],
+            point3D_ids=arrays.point3D_ids[offsets[i] : offsets[i + 1]],
+        )
+    return images
+
+
+def image_dict_to_arrays(images):
+    """Convert the dict of Image records into ImageArrays."""
+    images = list(images.values())
+    num_points2D = np.array([len(img.point3D_ids) for img in images], dtype=np.int64)
+    point2D_offsets = np.zeros(len(images) + 1, dtype=np.int64)
+    np.cumsum(num_points2D, out=point2D_offsets[1:])
+    return ImageArrays(
+        ids=np.array([img.id for img in images], dtype=np.int64),
+        qvecs=np.array([img.qvec for img in images], dtype=np.float64).reshape(-1, 4),
+        tvecs=np.array([img.tvec for img in images], dtype=np.float64).reshape(-1, 3),
+        camera_ids=np.array([img.camera_id for img in images], dtype=np.int64),
+        names=[img.name for img in images],
+        point2D_offsets=point2D_offsets,
+        xys=np.concatenate(
+            [np.asarray(img.xys, dtype=np.float64).reshape(-1, 2) for img in images]
+            or [np.empty((0, 2))]
+        ),
+        point3D_ids=np.concatenate(
+            [np.asarray(img.point3D_ids, dtype=np.int64) for img in images]
+            or [np.empty(0, dtype=np.int64)]
+        ),
+    )
+
+
 def write_images_text(images, path):
     """
     see: src/base/reconstruction.cc
@@ -301,7 +603,7 @@ def write_images_text(images, path):
         )
     )
 
-    with open(path, "w") as fid:
+    with open_replacing(path, "w") as fid:
         fid.write(HEADER)
         for _, img in images.items():
             image_header = [img.id, *img.qvec, *img.tvec, img.camera_id, img.name]
@@ -320,7 +622,7 @@ def write_images_binary(images, path_to_model_file):
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
     """
-    with open(path_to_model_file, "wb") as fid:
+    with open_replacing(path_to_model_file, "wb") as fid:
         write_next_bytes(fid, len(images), "Q")
         for _, img in images.items():
             write_next_bytes(fid, img.id, "i")
@@ -335,6 +637,107 @@ def write_images_binary(images, path_to_model_file):
                 write_next_bytes(fid, [*xy, p3d_id], "ddq")
 
 
+def _record_runs(mask, record_offsets):
+    """Byte ranges of the runs of consecutive selected records."""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask, [0]]).astype(np.int8)))
+    return list(
+        zip(record_offsets[edges[0::2]].tolist(), record_offsets[edges[1::2]].tolist())
+    )
+
+
+def write_images_binary_subset(path_to_model_file, path_to_output_file, select):
+    """Write the selected records of images.bin without decoding them.
+
+    The record boundaries are scanned once and the raw bytes of the kept
+    records are copied as they are, every run of adjacent kept records
+    with one copy. The output may be the input file: it's replaced,
+    when all records are written.
+    :param select: Callable which receives the image ids and the names of
+    all records and returns the boolean mask of the kept records.
+    :return: Ids of the kept records and the number of records.
+    """
+    with open(path_to_model_file, "rb") as fid:
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            headers, names, _, _, record_offsets = _scan_images_binary(buffer)
+            mask = np.asarray(select(headers["id"].astype(np.int64), names), dtype=bool)
+
+            with open_replacing(path_to_output_file, "wb") as output:
+                with memoryview(buffer) as view:
+                    output.write(struct.pack("<Q", int(mask.sum())))
+                    for start, end in _record_runs(mask, record_offsets):
+                        output.write(view[start:end])
+
+    return headers["id"][mask].astype(np.int64), len(mask)
+
+
+def write_images_binary_partition(path_to_model_file, paths_to_output_files, assign):
+    """Distribute the records of images.bin among several files in one read.
+
+    The record boundaries are scanned once and the raw bytes of every
+    record are copied into the output of its label, every run of
+    adjacent records of the same output with one copy.
+    :param paths_to_output_files: Paths to the N output files.
+    :param assign: Callable which receives the image ids and the names of
+    all records and returns the label of every record: the index of its
+    output file or -1 if the record is dropped.
+    :return: The labels of the records.
+    """
+    with open(path_to_model_file, "rb") as fid:
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            headers, names, _, _, record_offsets = _scan_images_binary(buffer)
+            labels = np.asarray(
+                assign(headers["id"].astype(np.int64), names), dtype=np.int64
+            )
+
+            with memoryview(buffer) as view:
+                for label, path_to_output_file in enumerate(paths_to_output_files):
+                    mask = labels == label
+                    with open_replacing(path_to_output_file, "wb") as output:
+                        output.write(struct.pack("<Q", int(mask.sum())))
+                        for start, end in _record_runs(mask, record_offsets):
+                            output.write(view[start:end])
+
+    return labels
+
+
+def write_images_binary_arrays(images, path_to_model_file):
+    """Bulk version of write_images_binary for ImageArrays.
+
+    The record headers and the observations are packed with
+    structured dtypes and serialized with ndarray.tobytes, so
+    every image costs a few buffer writes. The output is
+    byte-identical to write_images_binary.
+    """
+    num_images = len(images.ids)
+    headers = np.empty(num_images, dtype=IMAGE_HEADER_DTYPE)
+    headers["id"] = images.ids
+    headers["qvec"] = images.qvecs
+    headers["tvec"] = images.tvecs
+    headers["camera_id"] = images.camera_ids
+    headers = headers.tobytes()
+
+    points2D = np.empty(len(images.point3D_ids), dtype=IMAGE_POINT2D_DTYPE)
+    points2D["xy"] = images.xys
+    points2D["point3D_id"] = images.point3D_ids
+    points2D = memoryview(points2D.tobytes())
+
+    offsets = images.point2D_offsets.tolist()
+    num_points2D = np.diff(images.point2D_offsets).astype("<u8").tobytes()
+
+    with open_replacing(path_to_model_file, "wb") as fid:
+        write_next_bytes(fid, num_images, "Q")
+        for i, name in enumerate(images.names):
+            fid.write(headers[64 * i : 64 * (i + 1)])
+            fid.write(name.encode("utf-8") + b"\x00")
+            fid.write(num_points2D[8 * i : 8 * (i + 1)])
+            fid.write(points2D[24 * offsets[i] : 24 * offsets[i + 1]])
+
+
+def write_images_binary_bulk(images, path_to_model_file):
+    """Drop-in replacement of write_images_binary built on the bulk writer."""
+    write_images_binary_arrays(image_dict_to_arrays(images), path_to_model_file)
+
+
 def read_points3D_text(path):
     """
     see: src/base/reconstruction.cc
@@ -405,6 +808,120 @@ def read_points3D_binary(path_to_model_file):
     return points3D
 
 
+def scan_points3D_binary(buffer):
+    """Locate the records of a points3D.bin file without decoding them.
+
+    :param buffer: bytes-like object or mmap with the content of points3D.bin.
+    :return: Tuple of the byte offsets and the track lengths of the records.
+    """
+    num_points = struct.unpack_from("<Q", buffer, 0)[0]
+    unpack_track_length = struct.Struct("<Q").unpack_from
+    track_length_shift = POINT3D_HEADER_DTYPE.fields["track_length"][1]
+    header_size = POINT3D_HEADER_DTYPE.itemsize
+
+    offsets = array.array("q")
+    track_lengths = array.array("q")
+    pos = 8
+    for _ in range(num_points):
+        offsets.append(pos)
+        track_length = unpack_track_length(buffer, pos + track_length_shift)[0]
+        track_lengths.append(track_length)
+        pos += header_size + 8 * track_length
+
+    return (
+        np.frombuffer(offsets, dtype=np.int64),
+        np.frombuffer(track_lengths, dtype=np.int64),
+    )
+
+
+def read_points3D_binary_arrays(path_to_model_file):
+    """Bulk version of read_points3D_binary returning contiguous arrays.
+
+    The whole file is read into one buffer, the record headers and
+    the tracks are decoded at once with np.frombuffer.
+    """
+    with open(path_to_model_file, "rb") as fid:
+        buffer = fid.read()
+    offsets, track_lengths = scan_points3D_binary(buffer)
+
+    header_size = POINT3D_HEADER_DTYPE.itemsize
+    view = memoryview(buffer)
+    headers = np.frombuffer(
+        b"".join(view[start : start + header_size] for start in offsets.tolist()),
+        dtype=POINT3D_HEADER_DTYPE,
+    )
+    tracks = np.frombuffer(
+        b"".join(
+            view[start : start + 8 * length]
+            for start, length in zip(
+                (offsets + header_size).tolist(), track_lengths.tolist()
+            )
+        ),
+        dtype=POINT3D_TRACK_DTYPE,
+    )
+    track_offsets = np.zeros(len(offsets) + 1, dtype=np.int64)
+    np.cumsum(track_lengths, out=track_offsets[1:])
+
+    return Point3DArrays(
+        ids=headers["id"].astype(np.int64),
+        xyzs=np.array(headers["xyz"]),
+        rgbs=np.array(headers["rgb"]),
+        errors=np.array(headers["error"]),
+        track_offsets=track_offsets,
+        image_ids=tracks["image_id"].astype(np.int64),
+        point2D_idxs=tracks["point2D_idx"].astype(np.int64),
+    )
+
+
+def read_points3D_binary_bulk(path_to_model_file):
+    """Drop-in replacement of read_points3D_binary built on the bulk reader."""
+    return point_arrays_to_dict(read_points3D_binary_arrays(path_to_model_file))
+
+
+def point_arrays_to_dict(arrays):
+    """Convert Point3DArrays into the dict of Point3D records."""
+    points3D = {}
+    offsets = arrays.track_offsets.tolist()
+    rgbs = arrays.rgbs.astype(np.int64)
+    image_ids = arrays.image_ids.astype(np.int64)
+    point2D_idxs = arrays.point2D_idxs.astype(np.int64)
+    for i, (point3D_id, error) in enumerate(
+        zip(arrays.ids.tolist(), arrays.errors.tolist())
+    ):
+        points3D[point3D_id] = Point3D(
+            id=point3D_id,
+            xyz=arrays.xyzs[i],
+            rgb=rgbs[i],
+            error=np.array(error),
+            image_ids=image_ids[offsets[i] : offsets[i + 1]],
+            point2D_idxs=point2D_idxs[offsets[i] : offsets[i + 1]],
+        )
+    return points3D
+
+
+def point_dict_to_arrays(points3D):
+    """Convert the dict of Point3D records into Point3DArrays."""
+    points3D = list(points3D.values())
+    track_lengths = np.array([len(pt.image_ids) for pt in points3D], dtype=np.int64)
+    track_offsets = np.zeros(len(points3D) + 1, dtype=np.int64)
+    np.cumsum(track_lengths, out=track_offsets[1:])
+    return Point3DArrays(
+        ids=np.array([pt.id for pt in points3D], dtype=np.int64),
+        xyzs=np.array([pt.xyz for pt in points3D], dtype=np.float64).reshape(-1, 3),
+        rgbs=np.array([pt.rgb for pt in points3D], dtype=np.uint8).reshape(-1, 3),
+        errors=np.array([pt.error for pt in points3D], dtype=np.float64),
+        track_offsets=track_offsets,
+        image_ids=np.concatenate(
+            [np.asarray(pt.image_ids, dtype=np.int64) for pt in points3D]
+            or [np.empty(0, dtype=np.int64)]
+        ),
+        point2D_idxs=np.concatenate(
+            [np.asarray(pt.point2D_idxs, dtype=np.int64) for pt in points3D]
+            or [np.empty(0, dtype=np.int64)]
+        ),
+    )
+
+
 def write_points3D_text(points3D, path):
     """
     see: src/base/reconstruction.cc
@@ -425,7 +942,7 @@ def write_points3D_text(points3D, path):
         )
     )
 
-    with open(path, "w") as fid:
+    with open_replacing(path, "w") as fid:
         fid.write(HEADER)
         for _, pt in points3D.items():
             point_header = [pt.id, *pt.xyz, *pt.rgb, pt.error]
@@ -442,7 +959,7 @@ def write_points3D_binary(points3D, path_to_model_file):
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
     """
-    with open(path_to_model_file, "wb") as fid:
+    with open_replacing(path_to_model_file, "wb") as fid:
         write_next_bytes(fid, len(points3D), "Q")
         for _, pt in points3D.items():
             write_next_bytes(fid, pt.id, "Q")
@@ -455,6 +972,72 @@ def write_points3D_binary(points3D, path_to_model_file):
                 write_next_bytes(fid, [image_id, point2D_id], "ii")
 
 
+def _pack_records(headers, elements, offsets):
+    """Interleave fixed-size record headers with their CSR element blocks.
+
+    :param headers: uint8 array of shape (num_records, header_size).
+    :param elements: uint8 array of shape (num_elements, element_size).
+    :param offsets: CSR offsets of the elements of every record.
+    :return: uint8 array with the records laid out one after another.
+    """
+    num_records, header_size = headers.shape
+    element_size = elements.shape[1]
+    lengths = np.diff(offsets)
+    first = offsets[:-1] - offsets[0]
+
+    packed = np.empty(headers.size + elements.size, dtype=np.uint8)
+    record_starts = np.arange(num_records) * header_size + first * element_size
+    packed[(record_starts[:, None] + np.arange(header_size)).ravel()] = headers.ravel()
+    # The k-th element of the i-th record starts at (i + 1) * header_size + k * element_size
+    element_starts = (
+        np.repeat(np.arange(1, num_records + 1), lengths) * header_size
+        + np.arange(len(elements)) * element_size
+    )
+    packed[(element_starts[:, None] + np.arange(element_size)).ravel()] = (
+        elements.ravel()
+    )
+    return packed
+
+
+def write_points3D_binary_arrays(points3D, path_to_model_file, chunk_size=1 << 18):
+    """Bulk version of write_points3D_binary for Point3DArrays.
+
+    Records are assembled with vectorized scatters in chunks of
+    chunk_size points and every chunk is written with one call.
+    The output is byte-identical to write_points3D_binary.
+    """
+    num_points = len(points3D.ids)
+    offsets = points3D.track_offsets
+
+    with open_replacing(path_to_model_file, "wb") as fid:
+        write_next_bytes(fid, num_points, "Q")
+        for start in range(0, num_points, chunk_size):
+            end = min(start + chunk_size, num_points)
+
+            headers = np.empty(end - start, dtype=POINT3D_HEADER_DTYPE)
+            headers["id"] = points3D.ids[start:end]
+            headers["xyz"] = points3D.xyzs[start:end]
+            headers["rgb"] = points3D.rgbs[start:end]
+            headers["error"] = points3D.errors[start:end]
+            headers["track_length"] = np.diff(offsets[start : end + 1])
+
+            track = np.empty(offsets[end] - offsets[start], dtype=POINT3D_TRACK_DTYPE)
+            track["image_id"] = points3D.image_ids[offsets[start] : offsets[end]]
+            track["point2D_idx"] = points3D.point2D_idxs[offsets[start] : offsets[end]]
+
+            packed = _pack_records(
+                headers.view(np.uint8).reshape(len(headers), headers.itemsize),
+                track.view(np.uint8).reshape(len(track), track.itemsize),
+                offsets[start : end + 1],
+            )
+            fid.write(packed.tobytes())
+
+
+def write_points3D_binary_bulk(points3D, path_to_model_file):
+    """Drop-in replacement of write_points3D_binary built on the bulk writer."""
+    write_points3D_binary_arrays(point_dict_to_arrays(points3D), path_to_model_file)
+
+
 def detect_model_format(path, ext):
     if (
         os.path.isfile(os.path.join(path, "cameras" + ext))
@@ -467,7 +1050,40 @@ def detect_model_format(path, ext):
     return False
 
 
-def read_model(path, ext=""):
+MODEL_PARTS = ("cameras", "images", "points3D")
+
+MODEL_READERS = {
+    ".txt": {
+        "cameras": read_cameras_text,
+        "images": read_images_text,
+        "points3D": read_points3D_text,
+    },
+    ".bin": {
+        "cameras": read_cameras_binary,
+        "images": read_images_binary_bulk,
+        "points3D": read_points3D_binary_bulk,
+    },
+}
+
+
+def _read_model_part(path, ext, part):
+    start = time.perf_counter()
+    data = MODEL_READERS[ext][part](os.path.join(path, part + ext))
+    return data, time.perf_counter() - start
+
+
+def read_model(
+    path, ext="", parts=None, parallel=False, use_processes=False, verbose=False
+):
+    """Read the cameras, images and points3D files of the model.
+
+    :param parts: Subset of MODEL_PARTS to read, e.g. {"images"}.
+    The parts which are not read are returned as None.
+    :param parallel: Read and decode the files concurrently.
+    :param use_processes: Use a process pool instead of a thread pool.
+    :param verbose: Print the reading time of every file.
+    :return: Tuple of cameras, images and points3D dicts.
+    """
     # try to detect the extension automatically
     if ext == "":
         if detect_model_format(path, ".bin"):
@@ -478,15 +1094,25 @@ def read_model(path, ext=""):
             print("Provide model format: '.bin' or '.txt'")
             return
 
-    if ext == ".txt":
-        cameras = read_cameras_text(os.path.join(path, "cameras" + ext))
-        images = read_images_text(os.path.join(path, "images" + ext))
-        points3D = read_points3D_text(os.path.join(path, "points3D") + ext)
+    parts = MODEL_PARTS if parts is None else tuple(parts)
+    assert set(parts) <= set(MODEL_PARTS), f"Unknown model parts: {parts}"
+
+    if parallel and len(parts) > 1:
+        executor_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_type(max_workers=len(parts)) as executor:
+            futures = {
+                part: executor.submit(_read_model_part, path, ext, part)
+                for part in parts
+            }
+            results = {part: future.result() for part, future in futures.items()}
     else:
-        cameras = read_cameras_binary(os.path.join(path, "cameras" + ext))
-        images = read_images_binary(os.path.join(path, "images" + ext))
-        points3D = read_points3D_binary(os.path.join(path, "points3D") + ext)
-    return cameras, images, points3D
+        results = {part: _read_model_part(path, ext, part) for part in parts}
+
+    if verbose:
+        for part, (_, seconds) in results.items():
+            print(f"Read '{part + ext}' in {seconds:.3f} s")
+
+    return tuple(results[part][0] if part in results else None for part in MODEL_PARTS)
 
 
 def write_model(cameras, images, points3D, path, ext=".bin"):
@@ -561,9 +1187,19 @@ def main():
         help="outut model format",
         default=".txt",
     )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="read the model files concurrently",
+    )
     args = parser.parse_args()
 
-    cameras, images, points3D = read_model(path=args.input_model, ext=args.input_format)
+    cameras, images, points3D = read_model(
+        path=args.input_model,
+        ext=args.input_format,
+        parallel=args.parallel,
+        verbose=True,
+    )
 
     print("num_cameras:", len(cameras))
     print("num_images:", len(images))
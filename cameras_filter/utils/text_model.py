@@ -0,0 +1,447 @@
+"""
+utils.text_model
+
+This module provides a chunked reader and writer of the COLMAP
+'images.txt' and 'points3D.txt' files. Records are parsed and
+formatted with NumPy in chunks of a fixed number of records, so
+memory stays bounded by the chunk size while the results are
+equivalent to 'read_write_model' text readers and writers.
+
+The numbers of a chunk are parsed with one call, the lines are
+separated afterwards by their token counts. The chunks are copied
+into arrays preallocated from the counts in the file header, so
+the whole model is never held twice.
+"""
+from typing import Iterable, Iterator, Sequence, Tuple, Union
+from pathlib import Path
+import itertools
+import re
+
+import numpy as np
+
+from .read_write_model import (
+    open_replacing,
+    ImageArrays,
+    Point3DArrays,
+    image_arrays_to_dict,
+    image_dict_to_arrays,
+    point_arrays_to_dict,
+    point_dict_to_arrays,
+)
+
+PathLikeObject = Union[str, Path]
+
+CHUNK_SIZE = 4096
+# The text of a chunk is limited too, since an image may have many observations
+CHUNK_BYTES = 1 << 23
+
+# The counts written into the header by COLMAP and 'write_*_text_arrays'
+HEADER_COUNTS = re.compile(
+    r"Number of (?:images|points): (\d+), "
+    r"mean (?:observations per image|track length): ([0-9.eE+-]+)"
+)
+
+
+def _offsets(lengths: Sequence[int]) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def _parse_lines(lines: Sequence[str]) -> tuple:
+    """Parse whitespace separated numbers of all lines at once.
+
+    The lines are joined and parsed with one call, the token
+    starts of every line give the CSR offsets.
+
+    Return the values of all lines and the CSR offsets of every line.
+    """
+    text = " ".join(lines).encode("ascii")
+    line_starts = _offsets(np.fromiter(map(len, lines), np.int64, len(lines)) + 1)
+
+    chars = np.frombuffer(text, dtype=np.uint8)
+    # Whitespace and control characters separate the tokens
+    blank = chars <= 32
+    token_starts = ~blank
+    token_starts[1:] &= blank[:-1]
+    token_starts = np.flatnonzero(token_starts)
+
+    values = np.fromstring(text, sep=" ", count=len(token_starts))
+    assert len(token_starts) == len(values), "A token isn't a number."
+    return values, np.searchsorted(token_starts, line_starts)
+
+
+def concatenate_image_arrays(chunks: Sequence[ImageArrays]) -> ImageArrays:
+    """Concatenate ImageArrays of several chunks."""
+
+    chunks = list(chunks)
+    if not chunks:
+        return image_dict_to_arrays({})
+
+    names = []
+    for chunk in chunks:
+        names.extend(chunk.names)
+
+    return ImageArrays(
+        ids=np.concatenate([chunk.ids for chunk in chunks]),
+        qvecs=np.concatenate([chunk.qvecs for chunk in chunks]),
+        tvecs=np.concatenate([chunk.tvecs for chunk in chunks]),
+        camera_ids=np.concatenate([chunk.camera_ids for chunk in chunks]),
+        names=names,
+        point2D_offsets=_offsets(
+            np.concatenate([np.diff(chunk.point2D_offsets) for chunk in chunks])
+        ),
+        xys=np.concatenate([chunk.xys for chunk in chunks]),
+        point3D_ids=np.concatenate([chunk.point3D_ids for chunk in chunks]),
+    )
+
+
+def concatenate_point_arrays(chunks: Sequence[Point3DArrays]) -> Point3DArrays:
+    """Concatenate Point3DArrays of several chunks."""
+
+    chunks = list(chunks)
+    if not chunks:
+        return point_dict_to_arrays({})
+
+    return Point3DArrays(
+        ids=np.concatenate([chunk.ids for chunk in chunks]),
+        xyzs=np.concatenate([chunk.xyzs for chunk in chunks]),
+        rgbs=np.concatenate([chunk.rgbs for chunk in chunks]),
+        errors=np.concatenate([chunk.errors for chunk in chunks]),
+        track_offsets=_offsets(
+            np.concatenate([np.diff(chunk.track_offsets) for chunk in chunks])
+        ),
+        image_ids=np.concatenate([chunk.image_ids for chunk in chunks]),
+        point2D_idxs=np.concatenate([chunk.point2D_idxs for chunk in chunks]),
+    )
+
+
+def header_counts(path: PathLikeObject) -> Tuple[int, int]:
+    """The numbers of the records and of their elements from the file header.
+
+    The mean is rounded in the header, so the number of the
+    elements is an estimate. Return zeros without the header.
+    """
+
+    with open(path, "r") as fid:
+        for line in fid:
+            if not line.startswith("#"):
+                break
+            match = HEADER_COUNTS.search(line)
+            if match:
+                num_records = int(match[1])
+                return num_records, round(num_records * float(match[2]))
+    return 0, 0
+
+
+class _Column:
+    """Array filled chunk by chunk, which grows when the estimate is short."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.array = None
+        self.size = 0
+
+    def append(self, values: np.ndarray):
+        end = self.size + len(values)
+        if self.array is None:
+            shape = (max(self.capacity, end),) + values.shape[1:]
+            self.array = np.empty(shape, dtype=values.dtype)
+        elif end > len(self.array):
+            array = np.empty(
+                (max(end, 2 * len(self.array)),) + values.shape[1:], dtype=values.dtype
+            )
+            array[: self.size] = self.array[: self.size]
+            self.array = array
+        self.array[self.size : end] = values
+        self.size = end
+
+    def result(self) -> np.ndarray:
+        if self.size < len(self.array):
+            # The header overestimated the size, the spare rows aren't kept
+            self.array = self.array[: self.size].copy()
+        return self.array
+
+
+def gather_chunks(
+    chunks: Iterable[tuple],
+    empty: tuple,
+    offsets_field: str,
+    num_records: int = 0,
+    num_elements: int = 0,
+):
+    """Copy the chunks of ImageArrays or Point3DArrays into one of them.
+
+    The arrays are preallocated for num_records records and
+    num_elements elements (see 'header_counts'), so the memory is
+    the result and one chunk rather than the result twice.
+
+    Parameters
+    --------------
+        chunks : Iterable[tuple]
+            The chunks of the same type as empty.
+        empty : tuple
+            The result without chunks.
+        offsets_field : str
+            The CSR offsets field, the fields after it
+            are the elements of the records.
+        num_records : int = 0
+        num_elements : int = 0
+            The expected sizes, the arrays grow if they are exceeded.
+    """
+
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None:
+        return empty
+
+    fields = first._fields
+    element_fields = fields[fields.index(offsets_field) + 1 :]
+    columns = {
+        field: _Column(num_elements if field in element_fields else num_records)
+        for field in fields
+        if field not in ("names", offsets_field)
+    }
+    lengths = _Column(num_records)
+    names = []
+
+    for chunk in itertools.chain([first], chunks):
+        for field, column in columns.items():
+            column.append(getattr(chunk, field))
+        lengths.append(np.diff(getattr(chunk, offsets_field)))
+        if "names" in fields:
+            names.extend(chunk.names)
+
+    result = {field: column.result() for field, column in columns.items()}
+    result[offsets_field] = _offsets(lengths.result())
+    if "names" in fields:
+        result["names"] = names
+    return first._replace(**result)
+
+
+def _images_chunk(headers: Sequence[str], points_lines: Sequence[str]) -> ImageArrays:
+    headers = [line.split() for line in headers]
+    values = np.array([elems[1:8] for elems in headers], dtype=np.float64)
+    values = values.reshape(-1, 7)
+
+    points2D, point2D_offsets = _parse_lines(points_lines)
+    points2D = points2D.reshape(-1, 3)
+
+    return ImageArrays(
+        ids=np.array([int(elems[0]) for elems in headers], dtype=np.int64),
+        qvecs=values[:, :4],
+        tvecs=values[:, 4:],
+        camera_ids=np.array([int(elems[8]) for elems in headers], dtype=np.int64),
+        names=[elems[9] for elems in headers],
+        point2D_offsets=point2D_offsets // 3,
+        xys=points2D[:, :2].copy(),
+        point3D_ids=points2D[:, 2].astype(np.int64),
+    )
+
+
+def iter_images_text_chunks(
+    path: PathLikeObject, chunk_size: int = CHUNK_SIZE
+) -> Iterator[ImageArrays]:
+    """Read 'images.txt' as ImageArrays of at most chunk_size images."""
+
+    headers = []
+    points_lines = []
+    num_bytes = 0
+    with open(path, "r") as fid:
+        while True:
+            line = fid.readline()
+            if not line:
+                break
+            line = line.strip()
+            if len(line) > 0 and line[0] != "#":
+                headers.append(line)
+                points_lines.append(fid.readline())
+                num_bytes += len(points_lines[-1])
+                if len(headers) == chunk_size or num_bytes >= CHUNK_BYTES:
+                    yield _images_chunk(headers, points_lines)
+                    headers, points_lines, num_bytes = [], [], 0
+    if headers:
+        yield _images_chunk(headers, points_lines)
+
+
+def read_images_text_arrays(
+    path: PathLikeObject, chunk_size: int = CHUNK_SIZE
+) -> ImageArrays:
+    """Chunked version of read_images_text returning ImageArrays."""
+    return gather_chunks(
+        iter_images_text_chunks(path, chunk_size),
+        image_dict_to_arrays({}),
+        "point2D_offsets",
+        *header_counts(path),
+    )
+
+
+def read_images_text_bulk(path: PathLikeObject) -> dict:
+    """Drop-in replacement of read_images_text built on the chunked reader."""
+    return image_arrays_to_dict(read_images_text_arrays(path))
+
+
+def _points3D_chunk(lines: Sequence[str]) -> Point3DArrays:
+    values, line_offsets = _parse_lines(lines)
+    starts = line_offsets[:-1]
+
+    header = values[starts[:, None] + np.arange(8)]
+    track_lengths = (np.diff(line_offsets) - 8) // 2
+    track_offsets = _offsets(track_lengths)
+
+    # Flat positions of the (IMAGE_ID, POINT2D_IDX) pairs of all tracks
+    track_starts = np.repeat(starts + 8 - 2 * track_offsets[:-1], track_lengths)
+    image_id_positions = track_starts + 2 * np.arange(track_offsets[-1])
+
+    return Point3DArrays(
+        ids=header[:, 0].astype(np.int64),
+        xyzs=header[:, 1:4].copy(),
+        rgbs=header[:, 4:7].astype(np.uint8),
+        errors=header[:, 7].copy(),
+        track_offsets=track_offsets,
+        image_ids=values[image_id_positions].astype(np.int64),
+        point2D_idxs=values[image_id_positions + 1].astype(np.int64),
+    )
+
+
+def iter_points3D_text_chunks(
+    path: PathLikeObject, chunk_size: int = CHUNK_SIZE
+) -> Iterator[Point3DArrays]:
+    """Read 'points3D.txt' as Point3DArrays of at most chunk_size points."""
+
+    lines = []
+    with open(path, "r") as fid:
+        for line in fid:
+            line = line.strip()
+            if len(line) > 0 and line[0] != "#":
+                lines.append(line)
+                if len(lines) == chunk_size:
+                    yield _points3D_chunk(lines)
+                    lines = []
+    if lines:
+        yield _points3D_chunk(lines)
+
+
+def read_points3D_text_arrays(
+    path: PathLikeObject, chunk_size: int = CHUNK_SIZE
+) -> Point3DArrays:
+    """Chunked version of read_points3D_text returning Point3DArrays."""
+    return gather_chunks(
+        iter_points3D_text_chunks(path, chunk_size),
+        point_dict_to_arrays({}),
+        "track_offsets",
+        *header_counts(path),
+    )
+
+
+def read_points3D_text_bulk(path: PathLikeObject) -> dict:
+    """Drop-in replacement of read_points3D_text built on the chunked reader."""
+    return point_arrays_to_dict(read_points3D_text_arrays(path))
+
+
+def write_images_text_arrays(
+    images: ImageArrays, path: PathLikeObject, chunk_size: int = CHUNK_SIZE
+):
+    """Chunked version of write_images_text for ImageArrays.
+
+    The observations of chunk_size images are formatted with one
+    vectorized conversion to strings. The output is identical
+    to write_images_text.
+    """
+
+    num_images = len(images.ids)
+    offsets = images.point2D_offsets
+    mean_observations = offsets[-1] / num_images if num_images else 0
+    HEADER = (
+        "# Image list with two lines of data per image:\n"
+        + "#   IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n"
+        + "#   POINTS2D[] as (X, Y, POINT3D_ID)\n"
+        + "# Number of images: {}, mean observations per image: {}\n".format(
+            num_images, mean_observations
+        )
+    )
+
+    with open_replacing(path, "w") as fid:
+        fid.write(HEADER)
+        for start in range(0, num_images, chunk_size):
+            end = min(start + chunk_size, num_images)
+
+            ids = images.ids[start:end].astype(str)
+            poses = np.hstack(
+                [images.qvecs[start:end], images.tvecs[start:end]]
+            ).astype(str)
+            camera_ids = images.camera_ids[start:end].astype(str)
+
+            first, last = offsets[start], offsets[end]
+            tokens = np.empty((last - first, 3), dtype=object)
+            tokens[:, :2] = images.xys[first:last].astype(str)
+            tokens[:, 2] = images.point3D_ids[first:last].astype(str)
+            tokens = tokens.ravel().tolist()
+            bounds = (3 * (offsets[start : end + 1] - first)).tolist()
+
+            lines = []
+            for i in range(end - start):
+                lines.append(
+                    " ".join(
+                        [ids[i], *poses[i], camera_ids[i], images.names[start + i]]
+                    )
+                )
+                lines.append(" ".join(tokens[bounds[i] : bounds[i + 1]]))
+            fid.write("\n".join(lines) + "\n")
+
+
+def write_images_text_bulk(images: dict, path: PathLikeObject):
+    """Drop-in replacement of write_images_text built on the chunked writer."""
+    write_images_text_arrays(image_dict_to_arrays(images), path)
+
+
+def write_points3D_text_arrays(
+    points3D: Point3DArrays, path: PathLikeObject, chunk_size: int = CHUNK_SIZE
+):
+    """Chunked version of write_points3D_text for Point3DArrays.
+
+    The tracks of chunk_size points are formatted with one
+    vectorized conversion to strings. The output is identical
+    to write_points3D_text.
+    """
+
+    num_points = len(points3D.ids)
+    offsets = points3D.track_offsets
+    mean_track_length = offsets[-1] / num_points if num_points else 0
+    HEADER = (
+        "# 3D point list with one line of data per point:\n"
+        + "#   POINT3D_ID, X, Y, Z, R, G, B, ERROR, TRACK[] as (IMAGE_ID, POINT2D_IDX)\n"
+        + "# Number of points: {}, mean track length: {}\n".format(
+            num_points, mean_track_length
+        )
+    )
+
+    with open_replacing(path, "w") as fid:
+        fid.write(HEADER)
+        for start in range(0, num_points, chunk_size):
+            end = min(start + chunk_size, num_points)
+
+            header = np.empty((end - start, 8), dtype=object)
+            header[:, 0] = points3D.ids[start:end].astype(str)
+            header[:, 1:4] = points3D.xyzs[start:end].astype(str)
+            header[:, 4:7] = points3D.rgbs[start:end].astype(str)
+            header[:, 7] = points3D.errors[start:end].astype(str)
+            header = header.tolist()
+
+            first, last = offsets[start], offsets[end]
+            tokens = np.empty((last - first, 2), dtype=object)
+            tokens[:, 0] = points3D.image_ids[first:last].astype(str)
+            tokens[:, 1] = points3D.point2D_idxs[first:last].astype(str)
+            tokens = tokens.ravel().tolist()
+            bounds = (2 * (offsets[start : end + 1] - first)).tolist()
+
+            lines = [
+                " ".join(header[i]) + " " + " ".join(tokens[bounds[i] : bounds[i + 1]])
+                for i in range(end - start)
+            ]
+            fid.write("\n".join(lines) + "\n")
+
+
+def write_points3D_text_bulk(points3D: dict, path: PathLikeObject):
+    """Drop-in replacement of write_points3D_text built on the chunked writer."""
+    write_points3D_text_arrays(point_dict_to_arrays(points3D), path)